@@ -1,6 +1,7 @@
 # Copyright (c) EGOGE - All Rights Reserved.
 # This software may be used and distributed according to the terms of the Apache-2.0 license.
 import sys
+import time
 import traceback
 import os
 import logging
@@ -12,7 +13,7 @@ from PySide6.QtGui import QIcon, QAction
 from PySide6.QtCore import Qt
 
 from models.model_info import ModelInfo
-from embeddings.embeddings_constants import DEFAULT_COLLECTION_NAME
+from embeddings.embeddings_constants import DEFAULT_COLLECTION_NAME, DEFAULT_LLM_FOLDER, STUDY_STREAM_COLLECTION_NAME
 from embeddings.embedding_database import load_vector_store
 from embeddings.unstructured.document_splitter import DocumentSplitter
 
@@ -22,11 +23,11 @@ from .study_stream_directory_panel import StudyStreamDirectoryPanel
 from .study_stream_error import StudyStreamException
 from .study_stream_assistor_panel import StudyStreamAssistorPanel
 from .study_stream_settings import StudyStreamSettings
+from .study_stream_task import StudyStreamTaskWorker, get_task_scheduler
+from .study_stream_task_dialog import StudyStreamTaskDialog
+from models.retrieval_qa import create_retrieval_qa
 from db.study_stream_dao import check_study_stream_database
 
-STUDY_STREAM_COLLECTION_NAME = "STUDY_STREAM_LLM_DB"
-DEFAULT_LLM_FOLDER="llm_models"
-
 class StudyStreamApp(QMainWindow):
     def __init__(self, current_dir,  app_config, logging, verbose=False):
         super().__init__()
@@ -38,18 +39,27 @@ class StudyStreamApp(QMainWindow):
             self, 
             app_config=self.app_config, 
             current_dir=self.current_dir,
-            logging=self.logging  
+            logging=self.logging,
+            get_db=lambda: self.docs_db,
+            suspend_db_writes=self.suspend_db_writes,
+            reopen_db=self.reopen_db
         ) 
         print(self.settings_dialog.color_scheme)
         self.main_color_scheme = self.settings_dialog.get_color_scheme()['main_window']  
-        self.start_model()
+        self.task_dialog = StudyStreamTaskDialog(self, scheduler=get_task_scheduler(), color_scheme=self.main_color_scheme)
+        self.docs_db = None
+        # The documents are not analyzed while the vectorstore is migrated
+        self.is_db_suspended = False
+        self.init_model_config()
 
         self.initUI()
         self.doc = None
         self.pdf_files = []
         self.page_index = 0  # Initialize page_index here
+        # The window is painted first, the models are loaded in background
+        self.start_model()
     
-    def start_model(self):
+    def init_model_config(self):
         # Init ML/AI models
         self.next_question_delay = self.app_config["next_question_delay"]
         # The number of seconds passed b/w questions
@@ -64,21 +74,72 @@ class StudyStreamApp(QMainWindow):
         self.model_info = ModelInfo() # DEFAULT_MODEL_NAME = "hkunlp/instructor-large" 
         app_system_prompt = self.app_config["system_prompt"]    
         self.prompt_info = PromptInfo(system_prompt=app_system_prompt, template_type=None, use_history=True)
+        self.document_splitter = DocumentSplitter(logging)
 
+    def start_model(self):
+        self.model_start_time = time.time()
+        self.statusBar().showMessage("Loading the AI models ...")
+        self.model_task = StudyStreamTaskWorker(self.load_models, report_progress=True, name="Loading the AI models")
+        self.model_task.progress.connect(self.on_model_progress)
+        self.model_task.finished.connect(self.on_model_loaded)
+        self.model_task.error.connect(self.on_model_error)
+        self.model_task.run()
+
+    def load_models(self, progress):
+        # Runs in background: loads the embedding model, the vectorstore and LLM
         llm_folder = os.getenv("LLM_FOLDER")
         if not llm_folder:
             llm_folder = DEFAULT_LLM_FOLDER
-        self.logging.info(f"\n=====================\nLoading the vectorstore from {llm_folder} ...")
-        self.docs_db = load_vector_store(
+        progress(f"Loading the vectorstore from {llm_folder} ...")
+        docs_db = load_vector_store(
             model_name=self.model_info.model_name, 
             collection_name=STUDY_STREAM_COLLECTION_NAME, 
             persist_directory=llm_folder
         )
-        
-        if self.docs_db is None:
+        if docs_db is None:
             raise StudyStreamException(f"Failed to load the vectorstore from {llm_folder}.")  
-        else:
-            self.document_splitter = DocumentSplitter(logging)
+
+        documents_count = docs_db._collection.count()
+        progress(f"Loading LLM '{self.model_info.model_id}' ...")
+        qa_service = create_retrieval_qa(model_info=self.model_info, prompt_info=self.prompt_info, vectorstore=docs_db)
+        if qa_service is None:
+            raise StudyStreamException(f"Failed to initialize the retrieval framework for the vectorstore: {docs_db}.")
+
+        return {"db": docs_db, "qa_service": qa_service, "documents_count": documents_count}
+
+    def on_model_progress(self, message: str):
+        self.logging.info(message)
+        self.statusBar().showMessage(message)
+
+    def on_model_loaded(self, result):
+        self.docs_db = result["db"]
+        self.central_panel.set_db(None if self.is_db_suspended else self.docs_db)
+        self.right_panel.set_qa_service(
+            db=self.docs_db, 
+            qa_service=result["qa_service"], 
+            documents_count=result["documents_count"]
+        )
+        elapsed_time = round(time.time() - self.model_start_time, ndigits=2)
+        self.logging.info(f"The AI models are loaded in {elapsed_time} seconds")
+        self.statusBar().showMessage(f"The AI models are ready (loaded in {elapsed_time} seconds)", 10000)
+
+    def on_model_error(self, error):
+        self.logging.error(f"Failed to load the AI models: {error}")
+        self.statusBar().showMessage(f"Failed to load the AI models: {error}")
+
+    def suspend_db_writes(self):
+        self.is_db_suspended = True
+        self.central_panel.set_db(None)
+
+    def reopen_db(self, is_moved: bool):
+        self.is_db_suspended = False
+        if not is_moved:
+            self.central_panel.set_db(self.docs_db)
+            return
+        # The vectorstore moved to the new LLM_FOLDER: it is reloaded with the retrieval framework using it
+        self.docs_db = None
+        self.right_panel.set_chat_state(is_chat_enabled=False)
+        self.start_model()
 
     def initUI(self):
         self.setWindowTitle("Study Stream")
@@ -145,6 +206,11 @@ class StudyStreamApp(QMainWindow):
         self.toolbar.addWidget(spacer)
 
         # Add actions to the toolbar
+        tasks_icon = QIcon(self.current_dir + self.app_config['tasks_icon'])
+        tasks_action = QAction(tasks_icon, "Tasks", self)
+        tasks_action.triggered.connect(self.task_dialog.show_tasks)
+        self.toolbar.addAction(tasks_action)
+
         icon_path = self.current_dir + self.app_config['settings_icon']
         settings_icon = QIcon(icon_path)
         settings_action = QAction(settings_icon, "Settings", self)
@@ -1,29 +1,32 @@
 # Copyright (c) EGOGE - All Rights Reserved.
 # This software may be used and distributed according to the terms of the Apache-2.0 license.
+import time
 from datetime import datetime
-from typing import Dict
+from typing import Dict, List
 import json
 import pytz
 from PySide6.QtCore import QObject, Qt, QSize, QTimer
-from PySide6.QtWidgets import QLabel, QScrollArea, QVBoxLayout, QWidget, QPushButton, QDockWidget, QHBoxLayout, QTextEdit
+from PySide6.QtWidgets import QLabel, QVBoxLayout, QWidget, QPushButton, QDockWidget, QHBoxLayout, QTextEdit
 from PySide6.QtGui import QIcon, QFont, QPixmap
 
 from langchain_community.vectorstores import Chroma
 
-from models.retrieval_qa import create_retrieval_qa
-from db.study_stream_dao import update_note
+from db.study_stream_dao import append_messages, fetch_messages
 from models.prompt_info import PromptInfo
 from models.model_info import ModelInfo
 from .study_stream_task import StudyStreamTaskWorker
+from .study_stream_task_priority import StudyStreamTaskPriority
 from .study_stream_error import StudyStreamException
 from .study_stream_chat_icon_type import StudyStreamChatIconType
-from .study_stream_message_widget import StudyStreamMessageWidget
+from .study_stream_chat_view import StudyStreamChatView, StudyStreamChatItem, StudyStreamBubbleStyle
+from .study_stream_markdown_renderer import get_markdown_renderer, RENDER_FRAME_BUDGET_MS
 from study_stream_api.study_stream_subject import StudyStreamSubject
 from study_stream_api.study_stream_message import StudyStreamMessage
-from study_stream_api.study_stream_note import StudyStreamNote
 from study_stream_api.study_stream_message_type import StudyStreamMessageType
 
 DEFAULT_STUDENT_NOTE = "Student Note"
+# The number of messages loaded at once; older messages are loaded on the scroll to the top
+MESSAGE_PAGE_SIZE = 50
 
 class StudyStreamAssistorPanel(QDockWidget):
     def __init__(self, parent: QObject, system_prompt: PromptInfo, app_config, color_scheme, asserts_path: str, db: Chroma, model_info: ModelInfo, verbose: bool, logging):
@@ -38,19 +41,26 @@ class StudyStreamAssistorPanel(QDockWidget):
         self.logging = logging
         self.verbose = verbose
         self.timer = None
+        self.question_start_time = None
         self.rotate_icon_angle = 0
         self.messages = []
+        # The messages which are not saved yet: only these are appended to the note on save
+        self.unsaved_messages = []
+        # The sequence number of the oldest loaded message, or None if there are no older messages
+        self.oldest_message_seq = None
+        # The background task fetching and rendering a page of messages
+        self.messages_task = None
         self.study_target = None
-        self.create_assistor()
+        # The retrieval framework is loaded in background, the chat is disabled till it is set
+        self.qa_service = None
         self.initUI()
+        self.set_chat_state(is_chat_enabled=False)
 
-    def create_assistor(self):
-        dic = self.docs_db.get()["ids"]
-        documents_count = len(dic)
+    def set_qa_service(self, db: Chroma, qa_service, documents_count: int):
+        self.docs_db = db
+        self.qa_service = qa_service
         self.logging.info(f"\n>>>>>>>>>>>>>\nLoaded the vectorstore with {documents_count} documents.\nLLM model name: {self.model_info.model_name}.\nSystem Prompt:\n---\n{self.system_prompt}\n---\n<<<<<<<<<<<<")  
-        self.qa_service = create_retrieval_qa(model_info=self.model_info, prompt_info=self.system_prompt, vectorstore=self.docs_db)
-        if self.qa_service is None:
-            raise StudyStreamException(f"Failed to initialize the retrieval framework for the vectorstore: {self.docs_db}.")      
+        self.set_chat_state(is_chat_enabled=True)
     
     def initUI(self):
         self.setAllowedAreas(Qt.DockWidgetArea.RightDockWidgetArea)
@@ -64,17 +74,11 @@ class StudyStreamAssistorPanel(QDockWidget):
         self.title_lable.setAlignment(Qt.AlignmentFlag.AlignHCenter)
         chat_layout.addWidget(self.title_lable)
 
-        # Scroll area for chat display
-        self.scroll_area = QScrollArea(chat_widget)
-        self.scroll_area.setWidgetResizable(True)
-        self.scroll_area.setStyleSheet(self.color_scheme["main-css"])
-        self.scroll_content = QWidget()
-        self.scroll_layout = QVBoxLayout(self.scroll_content)
-        self.scroll_layout.setContentsMargins(0, 0, 0, 0)
-        self.scroll_layout.setAlignment(Qt.AlignmentFlag.AlignTop)
-        self.scroll_layout.setSpacing(5)
-        self.scroll_area.setWidget(self.scroll_content)
-        chat_layout.addWidget(self.scroll_area)
+        # Virtualized chat display: only the visible messages are painted
+        self.chat_view = StudyStreamChatView(font=QFont(self.app_config['chat_font'], self.app_config['chat_font_size']), parent=chat_widget)
+        self.chat_view.setStyleSheet(self.color_scheme["main-css"])
+        self.chat_view.top_reached.connect(self.on_chat_top_reached)
+        chat_layout.addWidget(self.chat_view)
 
         # Input area
         input_area = QWidget()
@@ -92,6 +96,8 @@ class StudyStreamAssistorPanel(QDockWidget):
         self.ai_message = self.color_scheme['ai-message-css']
         self.datetime_css = self.color_scheme['datetime-css']
         self.datetime_user_css = self.color_scheme['datetime-user-css']
+        # The chat view paints the messages in the style of the CSS: parsed once per message kind
+        self.bubble_styles = {}
 
         self.button_css = self.color_scheme['object-button-css']
         self.button_hover_css = self.color_scheme['object-button-hover-css']
@@ -157,53 +163,112 @@ class StudyStreamAssistorPanel(QDockWidget):
                 clean_chat = False
             self.study_target = target               
             self.title_lable.setText(self.study_target.class_name)
-            self.load_student_note(self.study_target.note, clean_chat=clean_chat)
+            self.load_student_note(self.study_target, clean_chat=clean_chat)
             self.set_chat_state(is_chat_enabled=True)
         else:     
             self.title_lable.setText(DEFAULT_STUDENT_NOTE)
 
-    def load_student_note(self, note: StudyStreamNote, clean_chat: bool):
+    def load_student_note(self, subject: StudyStreamSubject, clean_chat: bool):
         if clean_chat:
             self.clear_chat() 
-        if note:
-            self.messages = note.to_messages()
-            for message in self.messages:
-                if message.type == StudyStreamMessageType.QUESTION.value:
-                    self.add_message(
-                        message=message.content,
-                        message_type=StudyStreamChatIconType.USER,
-                        text_css=self.user_message,
-                        icon_css=self.icon_css,
-                        datetime_css=self.datetime_user_css
-                    )
-                elif message.type == StudyStreamMessageType.ANSWER.value:
-                    self.add_message(
-                        message=message.content,
-                        message_type=StudyStreamChatIconType.SYSTEM, 
-                        text_css=self.ai_message, 
-                        icon_css=self.ai_icon_css,
-                        datetime_css=self.datetime_css
-                    ) 
+        self.unsaved_messages = []
+        self.messages = []
+        self.oldest_message_seq = None
+        self.async_task_messages(subject_id=subject.id, before_seq=None)
+
+    def load_older_messages(self):
+        self.async_task_messages(subject_id=self.study_target.id, before_seq=self.oldest_message_seq)
+
+    def async_task_messages(self, subject_id: int, before_seq: int):
+        # The messages are fetched and their Markdown is rendered in background, before their rows are shown
+        self.messages_task = StudyStreamTaskWorker(self.fetch_rendered_messages, subject_id, before_seq, name="Loading the chat messages")
+        self.messages_task.finished.connect(lambda result: self.on_messages_loaded(result))
+        self.messages_task.error.connect(lambda error: self.on_messages_error(error))
+        self.messages_task.run()
+
+    def fetch_rendered_messages(self, subject_id: int, before_seq: int):
+        messages = fetch_messages(subject_id=subject_id, before_seq=before_seq, limit=MESSAGE_PAGE_SIZE)
+        render_time = get_markdown_renderer().prerender([message.content for message in messages if self.is_chat_message(message)])
+        return {"subject_id": subject_id, "before_seq": before_seq, "messages": messages, "render_time": render_time}
+
+    def on_messages_loaded(self, result):
+        self.messages_task = None
+        if not self.study_target or self.study_target.id != result["subject_id"]:
+            # The user opened another class in the meantime
+            return
+        messages = result["messages"]
+        start_time = time.perf_counter()
+        chat_items = self.to_chat_items(messages)
+        self.messages = messages + self.messages
+        if result["before_seq"] is None:
+            self.chat_view.append_items(chat_items)
         else:
-            self.messages = []      
+            self.chat_view.prepend_items(chat_items)
+        show_time = 1000 * (time.perf_counter() - start_time)
+        self.update_oldest_message_seq(loaded_count=len(messages))
+        self.logging.info(
+            f"Loaded {len(messages)} messages: rendered in {round(result['render_time'], ndigits=2)} ms in background; "
+            f"shown in {round(show_time, ndigits=2)} ms; render cache: {get_markdown_renderer().get_stats()}"
+        )
+        if show_time > RENDER_FRAME_BUDGET_MS:
+            self.logging.info(f"Showing the messages took {round(show_time, ndigits=2)} ms, over the frame budget of {RENDER_FRAME_BUDGET_MS} ms")
+
+    def on_messages_error(self, error):
+        self.messages_task = None
+        self.logging.info(f"Failed to load the messages: {error}")
+
+    def update_oldest_message_seq(self, loaded_count: int):
+        if loaded_count < MESSAGE_PAGE_SIZE or self.messages[0].seq <= 1:
+            self.oldest_message_seq = None
+        else:
+            self.oldest_message_seq = self.messages[0].seq
+
+    def on_chat_top_reached(self):
+        if self.study_target and self.oldest_message_seq and self.messages_task is None:
+            self.load_older_messages()
+
+    @staticmethod
+    def is_chat_message(message: StudyStreamMessage)-> bool:
+        return message.type in (StudyStreamMessageType.QUESTION.value, StudyStreamMessageType.ANSWER.value)
+
+    def to_chat_items(self, messages: List[StudyStreamMessage])-> List[StudyStreamChatItem]:
+        chat_items = []
+        for message in messages:
+            if message.type == StudyStreamMessageType.QUESTION.value:
+                chat_items.append(self.create_chat_item(
+                    message=message.content,
+                    message_type=StudyStreamChatIconType.USER,
+                    text_css=self.user_message,
+                    icon_css=self.icon_css,
+                    datetime_css=self.datetime_user_css,
+                    created_at=message.created_at
+                ))
+            elif message.type == StudyStreamMessageType.ANSWER.value:
+                chat_items.append(self.create_chat_item(
+                    message=message.content,
+                    message_type=StudyStreamChatIconType.SYSTEM, 
+                    text_css=self.ai_message, 
+                    icon_css=self.ai_icon_css,
+                    datetime_css=self.datetime_css,
+                    created_at=message.created_at
+                ))
+        return chat_items
 
     def add_bookmark(self, bookmark: Dict):
         print(f'BOOKMARK: {bookmark}')
         # Convert dictionary to a JSON-formatted string with indentation
         dict_str = json.dumps(bookmark, indent=4)
 
-        # Construct a markdown-friendly string
+        # Construct a markdown-friendly string: without any indentation, which markdown renders as a code block;
+        # the selected text is joined into one line, so its emphasis is not broken
+        bookmark_lines = [
+            f"Bookmark at the page #{bookmark['page']} of **{bookmark['file'].split('/')[-1]}**",
+            "",
+            f"- Selected Text: _{' '.join(str(bookmark['text']).split())}_"
+        ]
         if bookmark['comment']:
-            bookmark_markdown = f"""
-            Bookmark at the page #{bookmark['page']} of **{bookmark['file'].split('/')[-1]}**
-              - Selected Text: _{bookmark['text']}_
-              - Comment: _{bookmark['comment']}_
-            """
-        else:    
-            bookmark_markdown = f"""            
-            Bookmark at the page #{bookmark['page']} of **{bookmark['file'].split('/')[-1]}**
-              - Selected Text: _{bookmark['text']}_
-            """
+            bookmark_lines.append(f"- Comment: _{' '.join(str(bookmark['comment']).split())}_")
+        bookmark_markdown = "\n".join(bookmark_lines)
 
         new_message = StudyStreamMessage(
             type=StudyStreamMessageType.BOOKMARK,
@@ -212,6 +277,7 @@ class StudyStreamAssistorPanel(QDockWidget):
         )
         
         self.messages.append(new_message)          
+        self.unsaved_messages.append(new_message)
         self.update_save_chat_button(is_enabled=True)
         self.add_message(
             message=bookmark_markdown, 
@@ -222,12 +288,10 @@ class StudyStreamAssistorPanel(QDockWidget):
         ) 
     
     def save_chat(self):
-        print(f"save_chat: {self.study_target} - {self.messages}")
-        if self.study_target and self.messages and len(self.messages) > 0:
-            json_txt = StudyStreamNote.messages_to_json(messages=self.messages)
-            print(f"JSON: {json_txt}")         
-            updated_class = update_note(updated_class=self.study_target, note=json_txt)
-            if updated_class:                     
+        print(f"save_chat: {self.study_target} - {len(self.unsaved_messages)} new messages")
+        if self.study_target and self.unsaved_messages:
+            if append_messages(subject_id=self.study_target.id, messages=self.unsaved_messages):
+                self.unsaved_messages = []
                 self.update_save_chat_button(is_enabled=False)
     
     def send_message(self):
@@ -236,7 +300,7 @@ class StudyStreamAssistorPanel(QDockWidget):
         self.send_question(question=question)
 
     def send_question(self, question: str)-> bool:    
-        if self.timer:
+        if self.timer or self.qa_service is None:
             return False
         new_message = StudyStreamMessage(
             type=StudyStreamMessageType.QUESTION,
@@ -244,6 +308,7 @@ class StudyStreamAssistorPanel(QDockWidget):
             creation_time=datetime.now(tz=pytz.utc)
         )
         self.messages.append(new_message)
+        self.unsaved_messages.append(new_message)
         self.update_save_chat_button(is_enabled=True)
         self.add_message(
             message=question, 
@@ -253,6 +318,7 @@ class StudyStreamAssistorPanel(QDockWidget):
             datetime_css=self.datetime_user_css
         )
         self.chat_input_area.clear()
+        self.question_start_time = time.time()
         self.timer = QTimer()
         self.timer.timeout.connect(self.rotate_icon)
         self.timer.start(500)
@@ -261,7 +327,8 @@ class StudyStreamAssistorPanel(QDockWidget):
         return True
     
     def async_task_question(self, question: str):   
-        self.file_task = StudyStreamTaskWorker(self.ask_ai, question)
+        # The question is started before any queued document ingestion
+        self.file_task = StudyStreamTaskWorker(self.ask_ai, question, name="Answering the question", priority=StudyStreamTaskPriority.INTERACTIVE)
         self.file_task.finished.connect(lambda result: self.on_task_complete(result))
         self.file_task.error.connect(lambda error: self.on_task_error(error))
         self.file_task.run()    
@@ -284,6 +351,7 @@ class StudyStreamAssistorPanel(QDockWidget):
             creation_time=datetime.now(tz=pytz.utc)
         )
         self.messages.append(new_message)          
+        self.unsaved_messages.append(new_message)
         self.update_save_chat_button(is_enabled=True)
         self.add_message(
             message=answer, 
@@ -300,6 +368,8 @@ class StudyStreamAssistorPanel(QDockWidget):
             self.logging.info(log_message)
         else:            
             self.logging.info(f"Got the answer from ai.")
+        if self.question_start_time:
+            self.logging.info(f"Answer latency: {round(time.time() - self.question_start_time, ndigits=2)} seconds")
         
         self.set_chat_state(is_chat_enabled=True)        
 
@@ -308,7 +378,7 @@ class StudyStreamAssistorPanel(QDockWidget):
         self.set_chat_state(is_chat_enabled=True)        
     
     def update_save_chat_button(self, is_enabled: bool):
-        if is_enabled and self.study_target and self.messages and len(self.messages) > 0:
+        if is_enabled and self.study_target and self.unsaved_messages:
             self.save_chat_button.setDisabled(False)
             self.save_chat_button.setStyleSheet(self.enabled_css)
             self.save_chat_button.setToolTip("Save your chat history!")
@@ -318,7 +388,12 @@ class StudyStreamAssistorPanel(QDockWidget):
             self.save_chat_button.setToolTip("Your chat history is saved!")
 
     def set_chat_state(self, is_chat_enabled: bool):
-        if is_chat_enabled:
+        if self.qa_service is None:
+            self.update_save_chat_button(is_enabled=True)
+            self.send_button.setDisabled(True)
+            self.chat_input_area.setPlaceholderText(self.app_config['chat_loading_message'])
+            self.chat_input_area.setEnabled(False)
+        elif is_chat_enabled:
             if self.timer:
                 self.timer.stop()
                 self.timer = None   
@@ -334,21 +409,16 @@ class StudyStreamAssistorPanel(QDockWidget):
             self.chat_input_area.setPlaceholderText(self.app_config['chat_waiting_message'])
             self.chat_input_area.setEnabled(False)
 
-    def add_message(self, message: str, message_type: StudyStreamMessageType, text_css: str, icon_css: str, datetime_css: str):
+    def create_chat_item(self, message: str, message_type: StudyStreamChatIconType, text_css: str, icon_css: str, datetime_css: str, created_at=None)-> StudyStreamChatItem:
         icon = message_type.get_icon(app_config=self.app_config, asserts_path=self.asserts_path)
-        message_widget = StudyStreamMessageWidget(message=message, icon=icon, text_css=text_css, icon_css=icon_css, datetime_css=datetime_css)
-        self.scroll_layout.addWidget(message_widget)        
-        self.scroll_to_bottom(widget_height=message_widget.height())
-
-    def scroll_to_bottom(self, widget_height: int):
-        # Scroll the vertical scrollbar to the maximum position
-        self.scroll_area.verticalScrollBar().setValue(
-            self.scroll_area.verticalScrollBar().maximum() + widget_height + 50
-        )
-        self.scroll_area.show()
+        style_key = (text_css, icon_css, datetime_css)
+        if style_key not in self.bubble_styles:
+            self.bubble_styles[style_key] = StudyStreamBubbleStyle(text_css=text_css, icon_css=icon_css, datetime_css=datetime_css)
+        return StudyStreamChatItem(message=message, icon=icon, style=self.bubble_styles[style_key], created_at=created_at)
+
+    def add_message(self, message: str, message_type: StudyStreamChatIconType, text_css: str, icon_css: str, datetime_css: str):
+        chat_item = self.create_chat_item(message=message, message_type=message_type, text_css=text_css, icon_css=icon_css, datetime_css=datetime_css)
+        self.chat_view.append_items([chat_item])
 
     def clear_chat(self):
-        while  self.scroll_layout.count():
-            child = self.scroll_layout.takeAt(0)
-            if child.widget():
-                child.widget().deleteLater()    
+        self.chat_view.clear()
@@ -0,0 +1,266 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the Apache-2.0 license.
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from PySide6.QtCore import Qt, QAbstractListModel, QModelIndex, QSize, QRectF, QPointF, QEvent, QUrl, QDateTime, Signal, QTimer
+from PySide6.QtGui import QColor, QPainter, QPen, QPixmap, QFont, QTextDocument, QAbstractTextDocumentLayout, QPalette, QDesktopServices
+from PySide6.QtWidgets import QListView, QStyledItemDelegate, QStyleOptionViewItem, QAbstractItemView
+
+from .study_stream_markdown_renderer import get_markdown_renderer
+
+# The layout of the message row: the header with the icon and the timestamp above the message bubble
+ROW_MARGIN = 5
+ROW_SPACING = 5
+ICON_SIZE = 32
+# The number of the laid out message documents kept for painting: the visible rows and some more
+DOCUMENT_CACHE_SIZE = 128
+
+
+def to_html(message: str) -> str:
+    # Convert Markdown to HTML: the messages pre-rendered in background are taken from the cache
+    return get_markdown_renderer().render(message)
+
+
+def parse_css(css: str) -> Dict[str, str]:
+    """Parses the declarations of the color scheme's CSS, e.g. 'color: #FFF; padding: 10px;', to a dictionary."""
+    declarations = {}
+    for declaration in css.split(';'):
+        if ':' in declaration:
+            name, value = declaration.split(':', 1)
+            declarations[name.strip()] = value.strip()
+    return declarations
+
+
+def to_pixels(value: str) -> int:
+    return int(float(value.replace('px', ''))) if value else 0
+
+
+class StudyStreamBubbleStyle:
+    """The painting style of the message bubble, taken from the message CSS of the color scheme."""
+
+    def __init__(self, text_css: str, icon_css: str, datetime_css: str):
+        text_style = parse_css(text_css)
+        border = text_style.get('border', '0px solid transparent').split()
+        self.border_width = to_pixels(border[0])
+        self.border_color = QColor(border[-1])
+        self.border_radius = to_pixels(text_style.get('border-radius'))
+        self.padding = to_pixels(text_style.get('padding'))
+        self.margin_left = to_pixels(text_style.get('margin-left'))
+        self.margin_right = to_pixels(text_style.get('margin-right'))
+        self.background_color = QColor(text_style.get('background-color', 'transparent'))
+        self.text_color = QColor(text_style.get('color', '#000'))
+
+        self.icon_margin_left = to_pixels(parse_css(icon_css).get('margin-left'))
+
+        datetime_style = parse_css(datetime_css)
+        self.datetime_color = QColor(datetime_style.get('color', '#AAA'))
+        self.datetime_italic = datetime_style.get('font-style') == 'italic'
+        self.datetime_margin_right = to_pixels(datetime_style.get('margin-right'))
+
+    def get_text_width(self, row_width: int) -> int:
+        return max(1, row_width - 2 * ROW_MARGIN - self.margin_left - self.margin_right - 2 * (self.padding + self.border_width))
+
+
+class StudyStreamChatItem:
+    """One message of the chat view; it keeps the rendered HTML and its measured size, not a widget."""
+
+    __slots__ = ('html', 'icon', 'style', 'timestamp', 'size_hint')
+
+    def __init__(self, message: str, icon: QPixmap, style: StudyStreamBubbleStyle, created_at: Optional[datetime] = None):
+        self.html = to_html(message)
+        self.icon = icon
+        self.style = style
+        self.timestamp = QDateTime(created_at if created_at else datetime.now()).toString()
+        # (row width, QSize): the size is measured once per width
+        self.size_hint = None
+
+
+class StudyStreamChatModel(QAbstractListModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.items: List[StudyStreamChatItem] = []
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.items)
+
+    def data(self, index: QModelIndex, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.ItemDataRole.UserRole:
+            return self.items[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return self.items[index.row()].html
+        return None
+
+    def append_items(self, items: List[StudyStreamChatItem]):
+        if items:
+            self.beginInsertRows(QModelIndex(), len(self.items), len(self.items) + len(items) - 1)
+            self.items.extend(items)
+            self.endInsertRows()
+
+    def prepend_items(self, items: List[StudyStreamChatItem]):
+        if items:
+            self.beginInsertRows(QModelIndex(), 0, len(items) - 1)
+            self.items[0:0] = items
+            self.endInsertRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self.items = []
+        self.endResetModel()
+
+
+class StudyStreamChatDelegate(QStyledItemDelegate):
+    """
+    Paints the messages with QTextDocument instead of creating a widget per message:
+    the view asks to paint only the visible rows, the sizes are cached per message and row width,
+    and the laid out documents of the recently painted rows are kept in LRU cache.
+    """
+
+    def __init__(self, view: QListView, font: QFont):
+        super().__init__(view)
+        self.view = view
+        self.font = font
+        self.documents: "OrderedDict[tuple, QTextDocument]" = OrderedDict()
+        self.scaled_icons: Dict[int, QPixmap] = {}
+
+    def get_document(self, item: StudyStreamChatItem, text_width: int) -> QTextDocument:
+        # The key holds the item, so its id cannot be reused by a new item while the document is cached
+        key = (item, text_width)
+        document = self.documents.get(key)
+        if document is None:
+            document = QTextDocument()
+            document.setDefaultFont(self.font)
+            document.setDocumentMargin(0)
+            document.setHtml(item.html)
+            document.setTextWidth(text_width)
+            self.documents[key] = document
+            if len(self.documents) > DOCUMENT_CACHE_SIZE:
+                self.documents.popitem(last=False)
+        else:
+            self.documents.move_to_end(key)
+        return document
+
+    def get_icon(self, icon: QPixmap) -> QPixmap:
+        scaled_icon = self.scaled_icons.get(icon.cacheKey())
+        if scaled_icon is None:
+            scaled_icon = icon.scaled(ICON_SIZE, ICON_SIZE, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+            self.scaled_icons[icon.cacheKey()] = scaled_icon
+        return scaled_icon
+
+    def get_bubble_rect(self, item: StudyStreamChatItem, row_rect) -> QRectF:
+        style = item.style
+        document = self.get_document(item, style.get_text_width(row_rect.width()))
+        inset = style.padding + style.border_width
+        return QRectF(
+            row_rect.left() + ROW_MARGIN + style.margin_left,
+            row_rect.top() + ROW_MARGIN + ICON_SIZE + ROW_SPACING,
+            style.get_text_width(row_rect.width()) + 2 * inset,
+            document.size().height() + 2 * inset
+        )
+
+    def sizeHint(self, option: QStyleOptionViewItem, index: QModelIndex) -> QSize:
+        item = index.data(Qt.ItemDataRole.UserRole)
+        row_width = self.view.viewport().width()
+        if item.size_hint is None or item.size_hint[0] != row_width:
+            style = item.style
+            document = self.get_document(item, style.get_text_width(row_width))
+            text_height = document.size().height() + 2 * (style.padding + style.border_width)
+            item.size_hint = (row_width, QSize(row_width, int(2 * ROW_MARGIN + ICON_SIZE + ROW_SPACING + text_height)))
+        return item.size_hint[1]
+
+    def paint(self, painter: QPainter, option: QStyleOptionViewItem, index: QModelIndex):
+        item = index.data(Qt.ItemDataRole.UserRole)
+        style = item.style
+        row_rect = option.rect
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+
+        # Header: the icon and the timestamp
+        painter.drawPixmap(row_rect.left() + ROW_MARGIN + style.icon_margin_left, row_rect.top() + ROW_MARGIN, self.get_icon(item.icon))
+        datetime_font = QFont(self.font)
+        datetime_font.setItalic(style.datetime_italic)
+        datetime_font.setPointSizeF(max(1.0, self.font.pointSizeF() * 0.8))
+        painter.setFont(datetime_font)
+        painter.setPen(style.datetime_color)
+        datetime_rect = QRectF(
+            row_rect.left(), row_rect.top() + ROW_MARGIN,
+            row_rect.width() - ROW_MARGIN - style.datetime_margin_right, ICON_SIZE
+        )
+        painter.drawText(datetime_rect, Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter, item.timestamp)
+
+        # Message bubble
+        bubble_rect = self.get_bubble_rect(item, row_rect)
+        half_border = style.border_width / 2
+        painter.setPen(QPen(style.border_color, style.border_width) if style.border_width else Qt.PenStyle.NoPen)
+        painter.setBrush(style.background_color)
+        painter.drawRoundedRect(bubble_rect.adjusted(half_border, half_border, -half_border, -half_border), style.border_radius, style.border_radius)
+
+        # Message text
+        inset = style.padding + style.border_width
+        document = self.get_document(item, style.get_text_width(row_rect.width()))
+        painter.translate(bubble_rect.topLeft() + QPointF(inset, inset))
+        paint_context = QAbstractTextDocumentLayout.PaintContext()
+        paint_context.palette.setColor(QPalette.ColorRole.Text, style.text_color)
+        document.documentLayout().draw(painter, paint_context)
+        painter.restore()
+
+    def editorEvent(self, event, model, option: QStyleOptionViewItem, index: QModelIndex) -> bool:
+        # The links of the message are opened in the browser, as QTextBrowser did
+        if event.type() == QEvent.Type.MouseButtonRelease and event.button() == Qt.MouseButton.LeftButton:
+            item = index.data(Qt.ItemDataRole.UserRole)
+            bubble_rect = self.get_bubble_rect(item, option.rect)
+            inset = item.style.padding + item.style.border_width
+            document = self.get_document(item, item.style.get_text_width(option.rect.width()))
+            anchor = document.documentLayout().anchorAt(event.position() - bubble_rect.topLeft() - QPointF(inset, inset))
+            if anchor:
+                QDesktopServices.openUrl(QUrl(anchor))
+                return True
+        return super().editorEvent(event, model, option, index)
+
+
+class StudyStreamChatView(QListView):
+    """
+    The virtualized chat history: the messages are rows of the model painted by the delegate.
+    Emits 'top_reached' when the user scrolls to the first loaded message, so older messages can be prepended.
+    """
+    top_reached = Signal()
+
+    def __init__(self, font: QFont, parent=None):
+        super().__init__(parent)
+        self.chat_model = StudyStreamChatModel(self)
+        self.setModel(self.chat_model)
+        self.setItemDelegate(StudyStreamChatDelegate(self, font))
+        self.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.setResizeMode(QListView.ResizeMode.Adjust)
+        self.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        self.setFocusPolicy(Qt.FocusPolicy.NoFocus)
+        self.setMouseTracking(True)
+        # Set while older messages are prepended: the scrolling is not the user's one
+        self.prepending = False
+        self.verticalScrollBar().valueChanged.connect(self.on_scrolled)
+
+    def append_items(self, items: List[StudyStreamChatItem]):
+        self.chat_model.append_items(items)
+        # The rows are laid out with a delay
+        QTimer.singleShot(0, self.scrollToBottom)
+
+    def prepend_items(self, items: List[StudyStreamChatItem]):
+        scroll_bar = self.verticalScrollBar()
+        bottom_offset = scroll_bar.maximum() - scroll_bar.value()
+        self.prepending = True
+        self.chat_model.prepend_items(items)
+        # Lay out the new rows now and keep the message the user sees in its place
+        self.doItemsLayout()
+        scroll_bar.setValue(scroll_bar.maximum() - bottom_offset)
+        self.prepending = False
+
+    def clear(self):
+        self.chat_model.clear()
+
+    def on_scrolled(self, value: int):
+        if not self.prepending and value == self.verticalScrollBar().minimum() and self.chat_model.rowCount() > 0:
+            self.top_reached.emit()
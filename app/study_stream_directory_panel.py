@@ -1,15 +1,17 @@
 # Copyright (c) EGOGE - All Rights Reserved.
 # This software may be used and distributed according to the terms of the Apache-2.0 license.
 import os
-import shutil
-from typing import List
+from datetime import datetime
+from typing import Dict, List
 
-from PySide6.QtCore import QObject, Qt, QSize
-from PySide6.QtWidgets import (QDockWidget, QFileDialog, QToolBar, QWidget, 
+from PySide6.QtCore import QObject, Qt, QSize, QTimer
+from PySide6.QtWidgets import (QDockWidget, QFileDialog, QToolBar, QWidget, QHeaderView,
                              QTreeWidget, QTreeWidgetItem, QVBoxLayout, QMessageBox)
 from PySide6.QtGui import QIcon, QPixmap, QAction
 
 from .study_stream_document_view import StudyStreamDocumentView
+from .study_stream_document_store import StudyStreamDocumentStore
+from .study_stream_task import StudyStreamTaskWorker
 from study_stream_api.study_stream_subject import StudyStreamSubject
 from study_stream_api.study_stream_document import StudyStreamDocument
 from study_stream_api.study_stream_document_status import StudyStreamDocumentStatus
@@ -17,11 +19,16 @@ from study_stream_api.study_stream_school import StudyStreamSchool
 from study_stream_api.study_stream_school_type import StudyStreamSchoolType
 
 from embeddings.unstructured.file_type import FileType
-from db.study_stream_dao import fetch_all_schools_with_related_data, create_entity
+from db.study_stream_dao import fetch_schools_with_document_counts, fetch_subject_documents, fetch_processed_document, create_entity
 
 
 DEFAULT_CLASS_NAME = 'My Class'
 DEFAULT_SCHOOL_NAME = 'My School'
+# The number of documents added to a class node at once: the rest is added by "Load more..."
+DOCUMENT_PAGE_SIZE = 100
+LOAD_MORE_DOCUMENTS = 'Load more...'
+NAME_COLUMN = 0
+COUNT_COLUMN = 1
 
 class StudyStreamDirectoryPanel(QDockWidget):
     def __init__(self, 
@@ -44,7 +51,13 @@ class StudyStreamDirectoryPanel(QDockWidget):
         self.selected_file = None
         self.selected_school = None
         self.schools = []
+        # The number of documents per subject id
+        self.document_counts: Dict[int, int] = {}
+        # The id of the last loaded document per subject id; the subject is not in it till its node is expanded
+        self.loaded_documents: Dict[int, int] = {}
         self.displayed_target = None 
+        # The tasks importing the documents: the files are stored in background
+        self.import_tasks: List[StudyStreamTaskWorker] = []
         self.initPanel()
         self.load_study_stream_schema()
 
@@ -98,6 +111,11 @@ class StudyStreamDirectoryPanel(QDockWidget):
         # Tree Widget for displaying folders and files
         self.class_tree = QTreeWidget()
         self.class_tree.setHeaderHidden(True)
+        # The second column shows the number of classes of a school and of documents of a class
+        self.class_tree.setColumnCount(2)
+        self.class_tree.header().setStretchLastSection(False)
+        self.class_tree.header().setSectionResizeMode(NAME_COLUMN, QHeaderView.ResizeMode.Stretch)
+        self.class_tree.header().setSectionResizeMode(COUNT_COLUMN, QHeaderView.ResizeMode.ResizeToContents)
         self.class_tree.setStyleSheet(f"""
             QTreeWidget {{
                 {self.color_scheme["main-css"]}                                 
@@ -143,6 +161,9 @@ class StudyStreamDirectoryPanel(QDockWidget):
         self.selected_file = None
         self.selected_folder = None    
         self.selected_school = None  
+        self.displayed_target = None
+        self.document_counts = {}
+        self.loaded_documents = {}
         self.class_tree.clear()
         self.class_tree.clearSelection()
         self.class_tree.setCurrentItem(None) 
@@ -186,13 +207,13 @@ class StudyStreamDirectoryPanel(QDockWidget):
         return None                              
 
     def load_study_stream_schema(self)-> List[StudyStreamSchool]:
-        self.schools = fetch_all_schools_with_related_data()
+        # Only schools and classes are loaded here: documents are loaded when their class is expanded,
+        # and notes when the class is opened
+        self.schools, self.document_counts = fetch_schools_with_document_counts()
         for school in self.schools:
-            school_node = self.add_school(school_entity=school)
+            school_node = self.add_school(school_entity=school, with_select=False)
             for subject in school.subjects:
-                class_node = self.add_class(subject_entity=subject, parent_node=school_node, with_select=False)
-                for document in subject.documents:
-                    self.add_document(document_entity=document, parent_node=class_node, with_select=False)
+                self.add_class(subject_entity=subject, parent_node=school_node, with_select=False)
         
         if self.schools and len(self.schools) > 0:
             self.selected_school = self.class_tree.topLevelItem(0)
@@ -208,9 +229,57 @@ class StudyStreamDirectoryPanel(QDockWidget):
         item_target = item.data(0, Qt.ItemDataRole.UserRole)
         if isinstance(item_target, StudyStreamSubject):
             item.setIcon(0, self.class_selected_icon)
+            if item_target.id not in self.loaded_documents:
+                self.load_documents(class_node=item)
             if self.selected_folder is None:
                 self.selected_folder = item
 
+    def load_documents(self, class_node: QTreeWidgetItem):
+        """Adds the next page of documents to the class node, followed by "Load more..." if there are more documents."""
+        subject = class_node.data(0, Qt.ItemDataRole.UserRole)
+        documents = fetch_subject_documents(
+            subject_id=subject.id, 
+            after_id=self.loaded_documents.get(subject.id, 0), 
+            limit=DOCUMENT_PAGE_SIZE
+        )
+        # The imported documents are already in the tree
+        shown_ids = {document.id for document in self.get_child_documents(class_node)}
+        for document in documents:
+            if document.id not in shown_ids:
+                self.add_document(document_entity=document, parent_node=class_node, with_select=False)
+        if documents:
+            self.loaded_documents[subject.id] = documents[-1].id
+        else:
+            self.loaded_documents.setdefault(subject.id, 0)
+        class_node.setChildIndicatorPolicy(QTreeWidgetItem.ChildIndicatorPolicy.DontShowIndicatorWhenChildless)
+        if len(documents) == DOCUMENT_PAGE_SIZE:
+            load_more_node = QTreeWidgetItem()
+            load_more_node.setText(0, LOAD_MORE_DOCUMENTS)
+            load_more_node.setData(0, Qt.ItemDataRole.UserRole, LOAD_MORE_DOCUMENTS)
+            class_node.addChild(load_more_node)
+        self.logging.info(f"Loaded {len(documents)} documents of the class '{subject.class_name}'")
+
+    def load_more_documents(self, load_more_node: QTreeWidgetItem):
+        class_node = load_more_node.parent()
+        class_node.removeChild(load_more_node)
+        self.load_documents(class_node=class_node)
+
+    def get_child_documents(self, class_node: QTreeWidgetItem)-> List[StudyStreamDocument]:
+        documents = []
+        for i in range(class_node.childCount()):
+            item_target = class_node.child(i).data(0, Qt.ItemDataRole.UserRole)
+            if isinstance(item_target, StudyStreamDocument):
+                documents.append(item_target)
+        return documents
+
+    def set_document_count(self, class_node: QTreeWidgetItem, subject: StudyStreamSubject, count: int):
+        self.document_counts[subject.id] = count
+        class_node.setText(COUNT_COLUMN, str(count))
+        class_node.setTextAlignment(COUNT_COLUMN, Qt.AlignmentFlag.AlignRight)
+        if count > 0 and subject.id not in self.loaded_documents:
+            # The documents are loaded on the first expand
+            class_node.setChildIndicatorPolicy(QTreeWidgetItem.ChildIndicatorPolicy.ShowIndicator)
+
     def on_item_collapsed(self, item: QTreeWidgetItem):
         item_target = item.data(0, Qt.ItemDataRole.UserRole)
         if isinstance(item_target, StudyStreamSubject):
@@ -219,7 +288,7 @@ class StudyStreamDirectoryPanel(QDockWidget):
                 self.selected_folder = None
 
     def on_item_changed(self, item: QTreeWidgetItem, column):
-        if item.text(column).strip() == '':
+        if column == NAME_COLUMN and item.text(column).strip() == '':
             item.setText(column, DEFAULT_CLASS_NAME)  # Provide a default name if empty
             item_target = item.data(0, Qt.ItemDataRole.UserRole)
             if isinstance(item_target, StudyStreamSubject):
@@ -230,17 +299,17 @@ class StudyStreamDirectoryPanel(QDockWidget):
         school_entity = create_entity(school_entity)
         self.add_school(school_entity)
 
-    def add_school(self, school_entity: StudyStreamSchool)-> QTreeWidgetItem:        
+    def add_school(self, school_entity: StudyStreamSchool, with_select=True)-> QTreeWidgetItem:        
         school_node = QTreeWidgetItem()
-        school_node.setChildIndicatorPolicy
         school_node.setText(0, school_entity.name)
         school_node.setIcon(0, self.school_icon) 
         school_node.setFlags(school_node.flags() | Qt.ItemFlag.ItemIsEditable)  # Make the item editable         
         school_node.setData(0, Qt.ItemDataRole.UserRole, school_entity)
         # School is always at the top level 
         self.class_tree.addTopLevelItem(school_node)  
-        self.selected_school = school_node    
-        self.class_tree.editItem(school_node, 0)  # Optional  
+        if with_select:
+            self.selected_school = school_node    
+            self.class_tree.editItem(school_node, 0)  # Optional  
         #self.disable_editing(root=None, node=school_node)  
 
         return school_node
@@ -265,6 +334,8 @@ class StudyStreamDirectoryPanel(QDockWidget):
         class_node.setFlags(class_node.flags() | Qt.ItemFlag.ItemIsEditable)  # Make the item editable         
         class_node.setData(0, Qt.ItemDataRole.UserRole, subject_entity)
         parent_node.addChild(class_node)    
+        self.set_document_count(class_node=class_node, subject=subject_entity, count=self.document_counts.get(subject_entity.id, 0))
+        self.set_class_count(school_node=parent_node)
         #self.disable_editing(root=parent_node, node=class_node)  
         if with_select:  
             self.class_tree.expandItem(parent_node) 
@@ -272,6 +343,10 @@ class StudyStreamDirectoryPanel(QDockWidget):
             self.class_tree.editItem(class_node, 0) 
 
         return class_node    
+
+    def set_class_count(self, school_node: QTreeWidgetItem):
+        school_node.setText(COUNT_COLUMN, str(school_node.childCount()))
+        school_node.setTextAlignment(COUNT_COLUMN, Qt.AlignmentFlag.AlignRight)
     
     def import_document(self):
         if self.selected_folder is None:
@@ -289,28 +364,56 @@ class StudyStreamDirectoryPanel(QDockWidget):
                 QMessageBox.warning(self, 'Unsupported File Type', 'The selected file type is not supported.')
                 return
             
-             # Define the document folder path
-            document_folder = self.get_document_folder()
-            
-            # Create the document folder if it doesn't exist
-            os.makedirs(document_folder, exist_ok=True)
-
-            # Define the destination path
-            destination_path = os.path.join(document_folder, doc_name)
-            
-            # Copy the file to the document folder
-            shutil.copy(doc_path, destination_path)
-
+            # Store the file in background: big documents are not copied on the UI thread
             class_entity = self.selected_folder.data(0, Qt.ItemDataRole.UserRole)
-            doc_entity = StudyStreamDocument(
-                name=doc_name, 
-                file_path=destination_path,  # Update the file path to the new location
-                file_type_enum=file_type_enum,
-                status_enum=StudyStreamDocumentStatus.NEW
+            document_store = StudyStreamDocumentStore(document_folder=self.get_document_folder())
+            import_task = StudyStreamTaskWorker(
+                document_store.import_file, doc_path, 
+                report_progress=True,
+                cancellable=True,
+                name=f"Importing {doc_name}"
+            )
+            import_task.finished.connect(
+                lambda destination_path, task=import_task: self.on_document_imported(task, class_entity, doc_name, file_type_enum, destination_path)
             )
-            doc_entity.subject_id = class_entity.id
-            doc_entity = create_entity(doc_entity)
-            self.add_document(document_entity=doc_entity, parent_node=self.selected_folder, with_select=True)
+            import_task.error.connect(lambda error, task=import_task: self.on_import_error(task, doc_name, error))
+            import_task.cancelled.connect(lambda task=import_task: self.on_import_error(task, doc_name, "cancelled"))
+            self.import_tasks.append(import_task)
+            import_task.run()
+
+    def on_document_imported(self, import_task: StudyStreamTaskWorker, class_entity: StudyStreamSubject, doc_name: str, file_type_enum: FileType, destination_path: str):
+        self.import_tasks.remove(import_task)
+        if destination_path is None:
+            return
+        doc_entity = StudyStreamDocument(
+            name=doc_name, 
+            file_path=destination_path,  # The path of the stored content
+            file_type_enum=file_type_enum,
+            status_enum=StudyStreamDocumentStatus.NEW
+        )
+        # The same content was already analyzed for another class: its embeddings are reused
+        if fetch_processed_document(file_path=destination_path):
+            self.logging.info(f"'{doc_name}' has been already analyzed; its embeddings are reused")
+            doc_entity.status = StudyStreamDocumentStatus.PROCESSED.value
+            doc_entity.processed_date = datetime.now()
+        doc_entity.subject_id = class_entity.id
+        doc_entity = create_entity(doc_entity)
+        # The tree might be reloaded while the file was stored
+        class_node = self.find_item_with_id(entity=class_entity)
+        if class_node is None:
+            return
+        self.set_document_count(
+            class_node=class_node, 
+            subject=class_entity, 
+            count=self.document_counts.get(class_entity.id, 0) + 1
+        )
+        self.add_document(document_entity=doc_entity, parent_node=class_node, with_select=True)
+
+    def on_import_error(self, import_task: StudyStreamTaskWorker, doc_name: str, error):
+        self.import_tasks.remove(import_task)
+        self.logging.error(f"Failed to import '{doc_name}': {error}")
+        if error != "cancelled":
+            QMessageBox.warning(self, 'Failed Import', f"Failed to import '{doc_name}': {error}")
 
     def get_document_folder(self)-> str:
         return self.asserts_path + "/" + os.getenv("DOCUMENT_FOLDER") 
@@ -345,7 +448,10 @@ class StudyStreamDirectoryPanel(QDockWidget):
         current_item = self.class_tree.currentItem()
         if current_item:
             item_target = current_item.data(0, Qt.ItemDataRole.UserRole)
-            if isinstance(item_target, StudyStreamDocument): 
+            if item_target == LOAD_MORE_DOCUMENTS:
+                # The node is replaced after the selection change is handled
+                QTimer.singleShot(0, lambda: self.load_more_documents(load_more_node=current_item))
+            elif isinstance(item_target, StudyStreamDocument): 
                 if item_target != self.displayed_target:                    
                     self.selected_file = current_item
                     self.document_view.show_content(item=current_item)    
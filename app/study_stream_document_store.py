@@ -0,0 +1,163 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the Apache-2.0 license.
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import Callable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: no reflinks
+    fcntl = None
+
+# The folder of the stored documents inside the document folder
+OBJECTS_FOLDER = "objects"
+# The size of the chunk read at once while hashing and copying a document
+COPY_CHUNK_SIZE = 1024 * 1024
+# If set, a document on the same filesystem is stored as a hardlink when it cannot be reflinked:
+# the stored document then shares its content with the imported file, so editing the file changes the stored document;
+# by default it is copied
+DOCUMENT_STORE_HARDLINKS = os.getenv("DOCUMENT_STORE_HARDLINKS", "false").lower() == "true"
+# The Linux ioctl cloning a file (Btrfs, XFS): the copy shares the blocks till one of the files is changed
+FICLONE = 0x40049409
+
+
+class StudyStreamDocumentStore:
+    """
+    Content-addressed store of the imported documents: a document is stored once under
+    'objects/<first two hash chars>/<sha256><extension>' of the document folder,
+    so the same file imported into several classes shares one stored copy and one set of embeddings,
+    and documents with the same name never overwrite each other.
+
+    The document is stored as a reflink when it is on the same filesystem (or as a hardlink if they are enabled),
+    otherwise it is copied while it is hashed. The import runs in a worker thread.
+    """
+
+    def __init__(self, document_folder: str):
+        self.objects_folder = os.path.join(document_folder, OBJECTS_FOLDER)
+
+    def get_object_path(self, content_hash: str, extension: str) -> str:
+        return os.path.join(self.objects_folder, content_hash[:2], content_hash + extension.lower())
+
+    @staticmethod
+    def get_object_hash(object_path: str) -> Optional[str]:
+        """Returns the content hash named by the path of the stored document, or None if the file is not stored."""
+        content_hash = os.path.splitext(os.path.basename(object_path))[0]
+        if len(content_hash) != 64 or os.path.basename(os.path.dirname(object_path)) != content_hash[:2]:
+            return None
+        if any(char not in "0123456789abcdef" for char in content_hash):
+            return None
+        return content_hash
+
+    def import_file(self, file_path: str, progress: Callable[[str], None] = None, is_cancelled: Callable[[], bool] = None) -> str:
+        """
+        Stores the file; returns the path of the stored document, which is the same for the same content,
+        or None if the import is cancelled.
+        """
+        os.makedirs(self.objects_folder, exist_ok=True)
+        extension = os.path.splitext(file_path)[1]
+        if os.stat(file_path).st_dev == os.stat(self.objects_folder).st_dev:
+            # Same filesystem: hash the file first, then link it instead of copying
+            content_hash = self.hash_file(file_path, progress, is_cancelled)
+            if content_hash is None:
+                return None
+            object_path = self.get_object_path(content_hash, extension)
+            if not os.path.exists(object_path):
+                temp_path = self.get_temp_path()
+                try:
+                    # The file may have changed since it was hashed: the linked content is verified
+                    if not self.link_file(file_path, temp_path) or self.hash_file(temp_path) != content_hash:
+                        if os.path.exists(temp_path):
+                            os.remove(temp_path)
+                        content_hash = self.copy_file(file_path, temp_path, progress, is_cancelled)
+                        if content_hash is None:
+                            return None
+                        object_path = self.get_object_path(content_hash, extension)
+                    self.store_temp_file(temp_path, object_path)
+                finally:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+            return object_path
+
+        # Another filesystem: copy the file and hash it in one pass
+        temp_path = self.get_temp_path()
+        try:
+            content_hash = self.copy_file(file_path, temp_path, progress, is_cancelled)
+            if content_hash is None:
+                return None
+            object_path = self.get_object_path(content_hash, extension)
+            if not os.path.exists(object_path):
+                self.store_temp_file(temp_path, object_path)
+            return object_path
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def get_temp_path(self) -> str:
+        # The temporary file is in the store, so it is moved to its place atomically
+        file_handle, temp_path = tempfile.mkstemp(prefix=".import-", dir=self.objects_folder)
+        os.close(file_handle)
+        os.remove(temp_path)
+        return temp_path
+
+    @staticmethod
+    def store_temp_file(temp_path: str, object_path: str):
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        os.replace(temp_path, object_path)
+
+    @staticmethod
+    def link_file(file_path: str, temp_path: str) -> bool:
+        if fcntl is not None:
+            try:
+                with open(file_path, "rb") as source, open(temp_path, "wb") as target:
+                    fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+                return True
+            except OSError:
+                os.remove(temp_path)
+        if DOCUMENT_STORE_HARDLINKS:
+            try:
+                os.link(file_path, temp_path)
+                return True
+            except OSError:
+                pass
+        return False
+
+    @staticmethod
+    def hash_file(file_path: str, progress: Callable[[str], None] = None, is_cancelled: Callable[[], bool] = None) -> str:
+        file_size = max(1, os.path.getsize(file_path))
+        digest = hashlib.sha256()
+        read_size = 0
+        last_percent = -1
+        with open(file_path, "rb") as source:
+            for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b""):
+                if is_cancelled and is_cancelled():
+                    return None
+                digest.update(chunk)
+                read_size += len(chunk)
+                percent = 100 * read_size // file_size
+                if progress and percent != last_percent:
+                    last_percent = percent
+                    progress(f"Hashed {percent}% of {os.path.basename(file_path)}")
+        return digest.hexdigest()
+
+    @staticmethod
+    def copy_file(file_path: str, temp_path: str, progress: Callable[[str], None] = None, is_cancelled: Callable[[], bool] = None) -> str:
+        """Copies the file by chunks; returns the hash of its content, or None if the copy is cancelled."""
+        file_size = max(1, os.path.getsize(file_path))
+        digest = hashlib.sha256()
+        copied_size = 0
+        last_percent = -1
+        with open(file_path, "rb") as source, open(temp_path, "wb") as target:
+            for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b""):
+                if is_cancelled and is_cancelled():
+                    return None
+                digest.update(chunk)
+                target.write(chunk)
+                copied_size += len(chunk)
+                percent = 100 * copied_size // file_size
+                if progress and percent != last_percent:
+                    last_percent = percent
+                    progress(f"Copied {percent}% of {os.path.basename(file_path)}")
+        shutil.copystat(file_path, temp_path)
+        return digest.hexdigest()
@@ -51,6 +51,10 @@ class StudyStreamDocumentView(QWidget):
 
     def get_object_view(self) -> StudyStreamObjectView:
         return self.object_view  
+
+    def set_db(self, db: Chroma):
+        self.docs_db = db
+        self.object_view.set_db(db)
         
     def initUI(self):
         self.setMaximumHeight(self.parent.height() - 50)
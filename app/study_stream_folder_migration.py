@@ -0,0 +1,180 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the Apache-2.0 license.
+import hashlib
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+from embeddings.embeddings_constants import get_duration_message
+
+# The number of files copied at once to another device
+MIGRATION_COPY_WORKERS = 4
+# The size of the chunk read at once while copying and verifying a file
+MIGRATION_CHUNK_SIZE = 1024 * 1024
+# The minimal interval between two progress messages
+MIGRATION_PROGRESS_INTERVAL = 0.2
+
+
+class StudyStreamFolderMigration:
+    """
+    Migrates the content of a folder, e.g. the vectorstore or the documents, to another folder in a worker thread.
+
+    The source folder is not changed, so the application keeps working with it till the cut-over:
+    - on the same device the files are hardlinked, which, as a rename, does not copy any data,
+      and the changes made in place in the source are seen in the destination; the files created
+      or replaced (e.g. by 'os.replace') in the source meanwhile are linked again;
+    - on another device the files are copied in parallel and verified by their SHA-256,
+      then the files changed in the source meanwhile are copied again.
+    In both cases the files deleted from the source meanwhile are deleted from the destination.
+
+    The progress is kept in 'copied_bytes' / 'total_bytes', read by the UI thread on the progress signal.
+    """
+
+    def __init__(self, src_folder_path: str, dest_folder_path: str, max_workers: int = MIGRATION_COPY_WORKERS):
+        self.src_folder_path = src_folder_path
+        self.dest_folder_path = dest_folder_path
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.total_bytes = 0
+        self.copied_bytes = 0
+        self.start_time = None
+        self.last_progress_time = 0
+
+    def get_percent(self) -> int:
+        with self.lock:
+            return 100 * self.copied_bytes // self.total_bytes if self.total_bytes else 100
+
+    def list_files(self) -> Dict[str, Tuple[int, int]]:
+        """Lists the files of the source folder: (size, modification time) per relative path."""
+        files = {}
+        for root, _, file_names in os.walk(self.src_folder_path):
+            for file_name in file_names:
+                file_path = os.path.join(root, file_name)
+                file_stat = os.stat(file_path)
+                files[os.path.relpath(file_path, self.src_folder_path)] = (file_stat.st_size, file_stat.st_mtime_ns)
+        return files
+
+    def migrate(self, progress: Callable[[str], None] = None, is_cancelled: Callable[[], bool] = None) -> Dict[str, int]:
+        """
+        Migrates the folder; returns the number of the migrated files and bytes.
+        Raises an exception if a copied file does not match its source; nothing is changed in the source folder.
+        """
+        self.start_time = time.time()
+        os.makedirs(self.dest_folder_path, exist_ok=True)
+        if not os.path.exists(self.src_folder_path):
+            return {"files": 0, "bytes": 0, "verified": 0}
+        files = self.list_files()
+        self.total_bytes = sum(size for size, _ in files.values())
+        is_same_device = os.stat(self.src_folder_path).st_dev == os.stat(self.dest_folder_path).st_dev
+
+        if is_same_device and self.link_files(list(files), is_cancelled):
+            # The application kept working with the source folder: link the files created or replaced meanwhile
+            if not (is_cancelled and is_cancelled()):
+                current_files = self.list_files()
+                self.link_files([path for path in current_files if not self.is_linked(path)], is_cancelled)
+                self.remove_deleted_files(files, current_files)
+            self.copied_bytes = self.total_bytes
+            self.report(progress, force=True)
+            return {"files": len(files), "bytes": self.total_bytes, "verified": 0}
+
+        verified_count = self.copy_files(list(files), progress, is_cancelled)
+        # The application kept working with the source folder: copy the files changed meanwhile
+        current_files = self.list_files()
+        changed_files = [path for path, state in current_files.items() if files.get(path) != state]
+        if changed_files and not (is_cancelled and is_cancelled()):
+            with self.lock:
+                self.total_bytes += sum(os.path.getsize(os.path.join(self.src_folder_path, path)) for path in changed_files)
+            verified_count += self.copy_files(changed_files, progress, is_cancelled)
+        if not (is_cancelled and is_cancelled()):
+            self.remove_deleted_files(files, current_files)
+        self.report(progress, force=True)
+        return {"files": len(files), "bytes": self.total_bytes, "verified": verified_count}
+
+    def link_files(self, file_paths: List[str], is_cancelled: Callable[[], bool] = None) -> bool:
+        for file_path in file_paths:
+            if is_cancelled and is_cancelled():
+                return True
+            dest_path = os.path.join(self.dest_folder_path, file_path)
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            if os.path.exists(dest_path):
+                os.remove(dest_path)
+            try:
+                os.link(os.path.join(self.src_folder_path, file_path), dest_path)
+            except OSError:
+                # The filesystem does not support hardlinks: the files are copied
+                return False
+        return True
+
+    def is_linked(self, file_path: str) -> bool:
+        dest_path = os.path.join(self.dest_folder_path, file_path)
+        try:
+            return os.stat(dest_path).st_ino == os.stat(os.path.join(self.src_folder_path, file_path)).st_ino
+        except FileNotFoundError:
+            return False
+
+    def remove_deleted_files(self, migrated_files: Dict[str, Tuple[int, int]], current_files: Dict[str, Tuple[int, int]]):
+        # Only the migrated files are removed: the destination may have its own files
+        for file_path in migrated_files:
+            dest_path = os.path.join(self.dest_folder_path, file_path)
+            if file_path not in current_files and os.path.exists(dest_path):
+                os.remove(dest_path)
+
+    def copy_files(self, file_paths: List[str], progress: Callable[[str], None] = None, is_cancelled: Callable[[], bool] = None) -> int:
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self.copy_file, file_path, progress, is_cancelled) for file_path in file_paths]
+            # The first failed copy fails the migration
+            return sum(1 for future in futures if future.result())
+
+    def copy_file(self, file_path: str, progress: Callable[[str], None] = None, is_cancelled: Callable[[], bool] = None) -> bool:
+        if is_cancelled and is_cancelled():
+            return False
+        src_path = os.path.join(self.src_folder_path, file_path)
+        dest_path = os.path.join(self.dest_folder_path, file_path)
+        temp_path = dest_path + ".migrating"
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        digest = hashlib.sha256()
+        try:
+            with open(src_path, "rb") as source, open(temp_path, "wb") as target:
+                for chunk in iter(lambda: source.read(MIGRATION_CHUNK_SIZE), b""):
+                    if is_cancelled and is_cancelled():
+                        return False
+                    digest.update(chunk)
+                    target.write(chunk)
+                    with self.lock:
+                        self.copied_bytes += len(chunk)
+                    self.report(progress)
+            shutil.copystat(src_path, temp_path)
+            if self.hash_file(temp_path) != digest.hexdigest():
+                raise IOError(f"The copy of '{src_path}' does not match its source")
+            os.replace(temp_path, dest_path)
+            return True
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @staticmethod
+    def hash_file(file_path: str) -> str:
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as file:
+            for chunk in iter(lambda: file.read(MIGRATION_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def report(self, progress: Callable[[str], None], force: bool = False):
+        if progress is None:
+            return
+        with self.lock:
+            now = time.time()
+            if not force and now - self.last_progress_time < MIGRATION_PROGRESS_INTERVAL:
+                return
+            self.last_progress_time = now
+            copied_bytes = self.copied_bytes
+            total_bytes = self.total_bytes
+        message = f"Migrated {copied_bytes // (1024 * 1024)} of {total_bytes // (1024 * 1024)} MB"
+        if 0 < copied_bytes < total_bytes:
+            elapsed_time = now - self.start_time
+            message += f"; ETA: {get_duration_message(elapsed_time / copied_bytes * (total_bytes - copied_bytes))}"
+        progress(message)
@@ -0,0 +1,97 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the Apache-2.0 license.
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List
+
+import markdown
+
+# The number of the rendered messages kept in memory
+MARKDOWN_CACHE_SIZE = 2048
+# The time of one frame at 60 FPS: rendering on the UI thread above it is noticeable
+RENDER_FRAME_BUDGET_MS = 16.0
+# The number of the latest render times kept for the statistics
+RENDER_TIME_SAMPLES = 10000
+# 'nl2br' keeps the line breaks of the chat, the others render the answers of LLM: code blocks, tables and lists
+MARKDOWN_EXTENSIONS = ['fenced_code', 'tables', 'sane_lists', 'nl2br']
+
+
+class StudyStreamMarkdownRenderer:
+    """
+    Renders the Markdown of chat messages to HTML, keeping the recently rendered HTML in LRU cache
+    keyed by the hash of the message content, so re-opened notes are not rendered again.
+
+    The renderer is thread-safe: messages are pre-rendered in background before their rows are shown.
+    """
+
+    def __init__(self, max_size: int = MARKDOWN_CACHE_SIZE):
+        self.max_size = max_size
+        self.cache: "OrderedDict[str, str]" = OrderedDict()
+        self.lock = threading.Lock()
+        # Markdown instances keep state between conversions and are not thread-safe: one per thread
+        self.local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.render_times = deque(maxlen=RENDER_TIME_SAMPLES)
+        self.max_render_time = 0.0
+
+    @staticmethod
+    def get_key(message: str) -> str:
+        return hashlib.sha256(message.encode('utf-8')).hexdigest()
+
+    def get_markdown(self) -> markdown.Markdown:
+        if not hasattr(self.local, 'markdown'):
+            self.local.markdown = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+        return self.local.markdown
+
+    def render(self, message: str) -> str:
+        key = self.get_key(message)
+        with self.lock:
+            html = self.cache.get(key)
+            if html is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return html
+
+        start_time = time.perf_counter()
+        md = self.get_markdown()
+        html = md.convert(message)
+        md.reset()
+        render_time = 1000 * (time.perf_counter() - start_time)
+
+        with self.lock:
+            self.misses += 1
+            self.render_times.append(render_time)
+            self.max_render_time = max(self.max_render_time, render_time)
+            self.cache[key] = html
+            if len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+        return html
+
+    def prerender(self, messages: List[str]) -> float:
+        """Renders the messages which are not in the cache yet; returns the time spent in milliseconds."""
+        start_time = time.perf_counter()
+        for message in messages:
+            self.render(message)
+        return 1000 * (time.perf_counter() - start_time)
+
+    def get_stats(self) -> Dict[str, float]:
+        with self.lock:
+            render_times = sorted(self.render_times)
+            return {
+                "size": len(self.cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "mean_render_ms": round(sum(render_times) / len(render_times), ndigits=3) if render_times else 0.0,
+                "p99_render_ms": round(render_times[min(len(render_times) - 1, int(0.99 * len(render_times)))], ndigits=3) if render_times else 0.0,
+                "max_render_ms": round(self.max_render_time, ndigits=3)
+            }
+
+
+markdown_renderer = StudyStreamMarkdownRenderer()
+
+
+def get_markdown_renderer() -> StudyStreamMarkdownRenderer:
+    return markdown_renderer
@@ -1,6 +1,7 @@
 # Copyright (c) EGOGE - All Rights Reserved.
 # This software may be used and distributed according to the terms of the Apache-2.0 license.
-from typing import List
+from datetime import datetime
+from typing import Dict, List
 from PySide6.QtWidgets import (QHBoxLayout,  QToolTip, QScrollArea, QPushButton, QGridLayout, QLineEdit, 
                               QSpacerItem, QWidget, QLabel, QFrame, QVBoxLayout, QDateTimeEdit, QSizePolicy)
 from PySide6.QtGui import QIcon, QPixmap
@@ -8,9 +9,11 @@ from PySide6.QtCore import QObject, QSize, Qt, QDateTime, QTimer
 
 from langchain_community.vectorstores import Chroma
 from embeddings.unstructured.document_splitter import DocumentSplitter
-from embeddings.embedding_database import add_file_content_to_db
-from db.study_stream_dao import update_document, update_class, update_school, delete_entity, get_school_with_subjects, get_subject
-from .study_stream_task import StudyStreamTaskWorker
+from embeddings.embedding_database import add_file_content_to_db, add_files_content_to_db
+from db.study_stream_dao import (update_document, update_class, update_school, delete_entity, get_school_with_subjects, get_subject,
+                                 fetch_new_documents, fetch_processed_document, update_documents_status)
+from .study_stream_task import StudyStreamTaskWorker, TASK_POOL_SIZE
+from .study_stream_task_priority import StudyStreamTaskPriority
 from study_stream_api.study_stream_document import StudyStreamDocument
 from study_stream_api.study_stream_school import StudyStreamSchool
 from study_stream_api.study_stream_subject import StudyStreamSubject
@@ -52,12 +55,15 @@ class StudyStreamObjectView(QWidget):
         self.db = db
         self.load_chat_lambda = load_chat_lambda
         self.document_splitter = DocumentSplitter(logging)
-        self.document_in_progress = None
+        # The documents being analyzed and their tasks by document id: several documents are analyzed concurrently
+        self.documents_in_progress: Dict[int, StudyStreamDocument] = {}
+        self.document_tasks: Dict[int, StudyStreamTaskWorker] = {}
+        # The latest progress of the bulk analysis of the new documents of a class or school
+        self.bulk_progress_message = None
+        self.timer = None
         self.study_doc = None
         self.study_class = None
         self.study_school = None
-        self.file_in_progress = None 
-        self.file_task = None
         self.on_save_item = None
         self.on_delete_item = None
         self.initUI()
@@ -204,6 +210,9 @@ class StudyStreamObjectView(QWidget):
 
         self.setLayout(self.main_layout)   
 
+    def set_db(self, db: Chroma):
+        self.db = db
+
     def start_chat(self):
        if self.study_class:
           print(f"start_chat({self.study_class})")
@@ -273,7 +282,7 @@ class StudyStreamObjectView(QWidget):
                     self.llm_button.setStyleSheet(self.enabled_css)
                     self.llm_button.setIcon(self.load_icon)
                 elif self.study_doc.status == StudyStreamDocumentStatus.IN_PROGRESS.value:
-                    if self.document_in_progress:
+                    if self.study_doc.id in self.documents_in_progress:
                         self.llm_button.setVisible(True)
                         self.llm_button.setDisabled(True)
                         self.llm_button.setStyleSheet(self.disbaled_css)
@@ -284,10 +293,22 @@ class StudyStreamObjectView(QWidget):
                         self.llm_button.setDisabled(False)
                         self.llm_button.setStyleSheet(self.enabled_css)
                         self.llm_button.setIcon(self.load_icon)             
-            elif self.document_in_progress:
-                self.llm_button.setToolTip(f"Please wait ! Analyzing {self.document_in_progress.name} ...")  
+                self.llm_button.setToolTip("Analyze the document with AI")  
+            elif self.documents_in_progress:
+                if self.bulk_progress_message:
+                    self.llm_button.setToolTip(f"Please wait ! {self.bulk_progress_message}")  
+                else:
+                    document_names = ", ".join(document.name for document in self.documents_in_progress.values())
+                    self.llm_button.setToolTip(f"Please wait ! Analyzing {document_names} ...")  
                 self.llm_button.setDisabled(False)
                 self.llm_button.setVisible(True)                
+            elif self.study_class or self.study_school:
+                # All new documents of the class or school are analyzed in one bulk task
+                self.llm_button.setToolTip("Analyze all new documents with AI")  
+                self.llm_button.setDisabled(False)
+                self.llm_button.setStyleSheet(self.enabled_css)
+                self.llm_button.setIcon(self.load_icon)
+                self.llm_button.setVisible(True)                
             else:
                 self.llm_button.setVisible(False)
         else:
@@ -561,59 +582,167 @@ class StudyStreamObjectView(QWidget):
             return self.course_icon
             
     def process_document(self):    
-        if self.study_doc and self.study_doc.status_enum == StudyStreamDocumentStatus.NEW:
+        if self.db is None:
+            self.logging.warning(f"The vectorstore is loading or being migrated; '{self.study_doc}' cannot be analyzed yet.")
+            return
+        if self.study_class or self.study_school:
+            self.process_new_documents()
+        elif self.study_doc and self.study_doc.status_enum == StudyStreamDocumentStatus.NEW and fetch_processed_document(file_path=self.study_doc.file_path):
+            # The same content was already analyzed for another document: its embeddings are reused
+            self.logging.info(f"'{self.study_doc.name}' has been already analyzed; its embeddings are reused")
+            self.study_doc.status = StudyStreamDocumentStatus.PROCESSED.value
+            self.study_doc.processed_date = datetime.now()
+            self.update_document_on_finished_load(self.study_doc)
+        elif self.study_doc and self.study_doc.status_enum == StudyStreamDocumentStatus.NEW:
             # Asynchroneously run the adding Documemt to the embedding vector store 
-            self.rotate_icon_angle = 0
             self.study_doc.status_enum = StudyStreamDocumentStatus.IN_PROGRESS
             print(f"process_document: {self.study_doc.file_path}")
             updated_doc = update_document(updated_document=self.study_doc)
             if updated_doc:   
                 self.study_doc = updated_doc         
-                self.rotate_icon() 
-                self.timer = QTimer()
-                self.timer.timeout.connect(self.rotate_icon)
-                self.timer.start(500)
-                self.document_in_progress = updated_doc
-                self.async_task(document=self.document_in_progress) 
+                self.documents_in_progress[updated_doc.id] = updated_doc
+                self.start_rotating_icon()
+                self.async_task(document=updated_doc) 
                 if self.on_save_item:
                     self.on_save_item(entity=self.study_doc)       
         else:
             self.logging.error(f"Document '{self.study_doc}' has the state is not acceptable for the analysis !!!")
     
     def async_task(self, document: StudyStreamDocument):   
-        self.file_task = StudyStreamTaskWorker(add_file_content_to_db, self.db, self.document_splitter, document.file_path)
-        self.file_task.finished.connect(lambda result: self.on_task_complete(result))
-        self.file_task.error.connect(lambda error: self.on_task_error(error))
-        self.file_task.run()
-
-    def on_task_complete(self, result):
-        if self.document_in_progress:
-            self.logging.info(f"Has finished processing '{self.document_in_progress.name}': {result}")
-            self.document_in_progress.status_enum = StudyStreamDocumentStatus.PROCESSED
-            self.update_document_on_finished_load()              
-
-    def on_task_error(self, error):
-        if self.file_in_progress:
-            item_target = self.file_in_progress.data(0, Qt.ItemDataRole.UserRole)
-            if isinstance(item_target, StudyStreamDocument):
-                self.logging.info(f"Failed to rocess '{item_target.name}': {error}")
-                self.document_in_progress.status_enum = StudyStreamDocumentStatus.NEW
-                self.update_document_on_finished_load()  
-
-    def update_document_on_finished_load(self):
-        if self.timer:
+        # Document ingestion runs on the shared task pool below the chat questions
+        file_task = StudyStreamTaskWorker(
+            add_file_content_to_db, self.db, self.document_splitter, document.file_path, 
+            name=f"Analyzing {document.name}", 
+            priority=StudyStreamTaskPriority.BULK
+        )
+        file_task.finished.connect(lambda result, document_id=document.id: self.on_task_complete(document_id, result))
+        file_task.error.connect(lambda error, document_id=document.id: self.on_task_error(document_id, error))
+        file_task.cancelled.connect(lambda document_id=document.id: self.on_task_error(document_id, "cancelled"))
+        self.document_tasks[document.id] = file_task
+        file_task.run()
+
+    def on_task_complete(self, document_id: int, result):
+        document = self.documents_in_progress.get(document_id)
+        if document:
+            self.logging.info(f"Has finished processing '{document.name}': {result}")
+            document.status_enum = StudyStreamDocumentStatus.PROCESSED
+            self.update_document_on_finished_load(document)              
+
+    def on_task_error(self, document_id: int, error):
+        document = self.documents_in_progress.get(document_id)
+        if document:
+            self.logging.info(f"Failed to process '{document.name}': {error}")
+            document.status_enum = StudyStreamDocumentStatus.NEW
+            self.update_document_on_finished_load(document)  
+
+    def process_new_documents(self):
+        if self.study_class:
+            target_name = self.study_class.class_name
+            documents = fetch_new_documents(subject_id=self.study_class.id)
+        else:
+            target_name = self.study_school.name
+            documents = fetch_new_documents(school_id=self.study_school.id)
+        documents = [document for document in documents if document.id not in self.documents_in_progress]
+        if not documents:
+            self.logging.info(f"'{target_name}' has no new documents to analyze")
+            return
+        # All documents are marked in one transaction, instead of one per document
+        if not update_documents_status({StudyStreamDocumentStatus.IN_PROGRESS: [document.id for document in documents]}):
+            self.logging.error(f"Failed to start the analysis of {len(documents)} new documents of '{target_name}'")
+            return
+        for document in documents:
+            document.status = StudyStreamDocumentStatus.IN_PROGRESS.value
+            document.in_progress_date = datetime.now()
+            self.documents_in_progress[document.id] = document
+            if self.on_save_item:
+                self.on_save_item(entity=document)
+        self.start_rotating_icon()
+        self.async_bulk_task(documents=documents, target_name=target_name)
+
+    def async_bulk_task(self, documents: List[StudyStreamDocument], target_name: str):
+        # The files are parsed in parallel and added to the vectorstore in batches by one task: 
+        # its progress with ETA is shown in the task queue and it can be cancelled there
+        document_ids = [document.id for document in documents]
+        # Several documents may refer to the same file: it is added once
+        file_paths = list(dict.fromkeys(document.file_path for document in documents))
+        bulk_task = StudyStreamTaskWorker(
+            add_files_content_to_db, self.db, self.document_splitter, file_paths, 
+            # The parsing threads are sized as the share of the task pool available to the bulk tasks
+            max_workers=max(1, TASK_POOL_SIZE - 1),
+            report_progress=True,
+            cancellable=True,
+            name=f"Analyzing {len(documents)} new documents of {target_name}", 
+            priority=StudyStreamTaskPriority.BULK
+        )
+        bulk_task.finished.connect(lambda result, ids=document_ids: self.on_bulk_task_complete(ids, result))
+        bulk_task.error.connect(lambda error, ids=document_ids: self.on_bulk_task_complete(ids, None, error))
+        bulk_task.cancelled.connect(lambda ids=document_ids, task=bulk_task: self.on_bulk_task_complete(ids, task.result, "cancelled"))
+        bulk_task.progress.connect(self.on_bulk_task_progress)
+        for document_id in document_ids:
+            self.document_tasks[document_id] = bulk_task
+        bulk_task.run()
+
+    def on_bulk_task_progress(self, message: str):
+        self.bulk_progress_message = message
+        if (self.study_class or self.study_school) and self.documents_in_progress:
+            self.llm_button.setToolTip(f"Please wait ! {message}")  
+
+    def on_bulk_task_complete(self, document_ids: List[int], result, error=None):
+        documents = [self.documents_in_progress[document_id] for document_id in document_ids if document_id in self.documents_in_progress]
+        if not documents:
+            return
+        # A cancelled task returns the files added before it stopped; the others stay new
+        processed_files = set(result["processed"]) if result else set()
+        statuses = {StudyStreamDocumentStatus.PROCESSED: [], StudyStreamDocumentStatus.NEW: []}
+        for document in documents:
+            status = StudyStreamDocumentStatus.PROCESSED if document.file_path in processed_files else StudyStreamDocumentStatus.NEW
+            statuses[status].append(document.id)
+        if error:
+            self.logging.info(f"Failed to process {len(documents)} new documents: {error}")
+        self.logging.info(f"Has finished processing {len(statuses[StudyStreamDocumentStatus.PROCESSED])} of {len(documents)} new documents")
+        if not update_documents_status(statuses):
+            self.logging.error(f"Failed to save the status of {len(documents)} analyzed documents")
+        else:
+            for document in documents:
+                if document.id in statuses[StudyStreamDocumentStatus.PROCESSED]:
+                    document.status = StudyStreamDocumentStatus.PROCESSED.value
+                    document.processed_date = datetime.now()
+                else:
+                    document.status = StudyStreamDocumentStatus.NEW.value
+        self.bulk_progress_message = None
+        for document in documents:
+            self.on_document_finished(document)
+        if self.study_class or self.study_school:
+            self.show_llm_button(self.llm_button.isVisible())
+
+    def update_document_on_finished_load(self, document: StudyStreamDocument):
+        updated_doc = update_document(updated_document=document)
+        self.on_document_finished(updated_doc if updated_doc else document, is_updated=updated_doc is not None)
+
+    def on_document_finished(self, updated_doc: StudyStreamDocument, is_updated: bool = True):
+        self.documents_in_progress.pop(updated_doc.id, None)
+        self.document_tasks.pop(updated_doc.id, None)
+        if not self.documents_in_progress and self.timer:
             self.timer.stop()
             self.timer = None  
-        self.llm_button.setVisible(False)    
-        updated_doc = update_document(updated_document=self.document_in_progress)
+        if not is_updated:
+            return
+        if self.on_save_item:
+            self.on_save_item(entity=updated_doc)
         if self.study_doc and self.study_doc.id == updated_doc.id:
+            self.llm_button.setVisible(False)    
             self.study_doc = updated_doc
-            if self.on_save_item:
-                self.on_save_item(entity=self.study_doc)
             self.clear_layout(self.content_area_layout)
             self.create_doc_fields_grid()
-        self.document_in_progress = None                 
-        self.on_click() 
+            self.on_click() 
+
+    def start_rotating_icon(self):
+        if self.timer is None:
+            self.rotate_icon_angle = 0
+            self.rotate_icon() 
+            self.timer = QTimer()
+            self.timer.timeout.connect(self.rotate_icon)
+            self.timer.start(500)
 
     def rotate_icon(self):    
         new_icon, self.rotate_icon_angle = StudyStreamChatIconType.rotate_icon(
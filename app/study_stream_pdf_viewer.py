@@ -1,16 +1,25 @@
 import os
+from collections import OrderedDict
 from pathlib import Path
 from PySide6.QtCore import Qt, QUrl, Signal, QObject, Slot
-from PySide6.QtWidgets import QWidget, QVBoxLayout, QMenu, QInputDialog
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QMenu, QInputDialog, QStackedWidget
 from PySide6.QtWebEngineWidgets import QWebEngineView
 from PySide6.QtWebEngineCore import QWebEngineSettings
 from PySide6.QtWebChannel import QWebChannel
 from PySide6.QtGui import QIcon
 from urllib.parse import quote
 
+from embeddings.extraction_cache import get_extraction_cache, PDF_EXTRACTOR_NAME
+from .study_stream_document_store import StudyStreamDocumentStore
+
 # Set the environment variable for the dictionaries
 #os.environ['QTWEBENGINE_DICTIONARIES_PATH'] = '/path/to/your/dictionaries'
 
+# The number of the recently viewed documents kept loaded: re-opening them is instant
+PDF_VIEW_CACHE_SIZE = 3
+# The number of the documents whose last viewed page is remembered
+LAST_PAGE_HISTORY_SIZE = 100
+
 class Bridge(QObject):
     pageNumber = Signal(str)
 
@@ -31,21 +40,17 @@ class StudyStreamPdfView(QWidget):
         self.pdf_js_path = script_directory / "PDF_js" / "web" / "viewer.html"
         print('PDF.js viewer path:', self.pdf_js_path)
         self.pdf_path = ""
+        self.file_path = None
         self.current_page = 1
-
-        self.web_view = QWebEngineView()
+        # The loaded viewers of the recently viewed documents by file path, the least recent first
+        self.web_views: "OrderedDict[str, QWebEngineView]" = OrderedDict()
+        # The last viewed page by file path
+        self.last_pages: "OrderedDict[str, int]" = OrderedDict()
+        self.web_view = None
 
         self.layout = QVBoxLayout(self)
-        self.layout.addWidget(self.web_view)
-
-        self.settings = self.web_view.settings()
-        self.settings.setAttribute(QWebEngineSettings.PluginsEnabled, True)
-        self.settings.setAttribute(QWebEngineSettings.PdfViewerEnabled, True)
-        self.settings.setAttribute(QWebEngineSettings.JavascriptEnabled, True)
-        self.settings.setAttribute(QWebEngineSettings.JavascriptCanAccessClipboard, True)
-
-        self.web_view.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
-        self.web_view.customContextMenuRequested.connect(self.show_context_menu)
+        self.stack = QStackedWidget()
+        self.layout.addWidget(self.stack)
 
         self.context_menu = QMenu(self)
         self.context_menu.setStyleSheet("""            
@@ -72,11 +77,23 @@ class StudyStreamPdfView(QWidget):
         self.send_chat_action.triggered.connect(self.send_to_chat)
         self.bookmark_action.triggered.connect(self.add_bookmark)
 
-        self.channel = QWebChannel()
-        self.bridge = Bridge()
-        self.channel.registerObject('bridge', self.bridge)
-        self.web_view.page().setWebChannel(self.channel)
-        self.bridge.pageNumber.connect(self.user_comment)
+    def create_web_view(self) -> QWebEngineView:
+        web_view = QWebEngineView()
+        settings = web_view.settings()
+        settings.setAttribute(QWebEngineSettings.PluginsEnabled, True)
+        settings.setAttribute(QWebEngineSettings.PdfViewerEnabled, True)
+        settings.setAttribute(QWebEngineSettings.JavascriptEnabled, True)
+        settings.setAttribute(QWebEngineSettings.JavascriptCanAccessClipboard, True)
+
+        web_view.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
+        web_view.customContextMenuRequested.connect(self.show_context_menu)
+
+        channel = QWebChannel(web_view)
+        bridge = Bridge(web_view)
+        channel.registerObject('bridge', bridge)
+        web_view.page().setWebChannel(channel)
+        bridge.pageNumber.connect(self.user_comment)
+        return web_view
 
     def add_bookmark(self):
         js_code = """
@@ -107,6 +124,16 @@ class StudyStreamPdfView(QWidget):
                 'text': selected_text, 
                 'comment': recorded_comment                
             }
+            # The selection may start on the page before the shown one: the page of the selected text
+            # is taken from the extracted text, if the document was analyzed already
+            page_index = get_extraction_cache().find_page(
+                self.file_path, 
+                PDF_EXTRACTOR_NAME, 
+                selected_text, 
+                content_hash=StudyStreamDocumentStore.get_object_hash(self.file_path)
+            )
+            if page_index is not None:
+                bookmark['page'] = page_index + 1
             print('bookmark dict obj:', bookmark)
             self.bookmark_signal.emit(bookmark)
 
@@ -125,9 +152,44 @@ class StudyStreamPdfView(QWidget):
                 print('Cannot send the text! The chat is busy!')     
 
     def show_pdf(self, file_path):
-        # Encode the file path to handle spaces and special characters
-        encoded_file_path = quote(file_path)
+        if self.web_view is not None:
+            self.save_last_page(self.file_path, self.web_view)
         self.file_path = file_path
-        full_url = QUrl(f'file:///{self.pdf_js_path}?file=file:///{encoded_file_path}#page={self.current_page}')
-        #print('this is full url:', full_url.toString())
-        self.web_view.load(full_url)
+        web_view = self.web_views.get(file_path)
+        if web_view is None:
+            web_view = self.create_web_view()
+            self.current_page = self.last_pages.get(file_path, 1)
+            # Encode the file path to handle spaces and special characters
+            encoded_file_path = quote(file_path)
+            full_url = QUrl(f'file:///{self.pdf_js_path}?file=file:///{encoded_file_path}#page={self.current_page}')
+            #print('this is full url:', full_url.toString())
+            web_view.load(full_url)
+            self.stack.addWidget(web_view)
+            self.web_views[file_path] = web_view
+            if len(self.web_views) > PDF_VIEW_CACHE_SIZE:
+                evicted_path, evicted_view = self.web_views.popitem(last=False)
+                self.save_last_page(evicted_path, evicted_view, release=True)
+        else:
+            # The document is still loaded at the page where the user left it
+            self.web_views.move_to_end(file_path)
+        self.web_view = web_view
+        self.stack.setCurrentWidget(web_view)
+
+    def save_last_page(self, file_path: str, web_view: QWebEngineView, release: bool = False):
+        """Remembers the page the document is shown at; the released viewer is deleted afterwards."""
+        def on_page_number(number):
+            if number:
+                self.last_pages[file_path] = int(number)
+                self.last_pages.move_to_end(file_path)
+                if len(self.last_pages) > LAST_PAGE_HISTORY_SIZE:
+                    self.last_pages.popitem(last=False)
+            if release:
+                web_view.deleteLater()
+
+        if release:
+            self.stack.removeWidget(web_view)
+        web_view.page().runJavaScript(
+            "window.PDFViewerApplication && PDFViewerApplication.pdfViewer ? PDFViewerApplication.pdfViewer.currentPageNumber : 0", 
+            0, 
+            on_page_number
+        )
@@ -1,27 +1,37 @@
 # Copyright (c) EGOGE - All Rights Reserved.
 # This software may be used and distributed according to the terms of the Apache-2.0 license.
 import os
-import shutil
 import json
 from PySide6.QtWidgets import (QVBoxLayout, QWidget, QDialog, 
                                QComboBox, QLineEdit, QPushButton,
-                               QLabel, QHBoxLayout, QGridLayout, QFrame)
+                               QLabel, QHBoxLayout, QGridLayout, QFrame, QProgressDialog)
 from PySide6.QtGui import QIcon, Qt
 from PySide6.QtCore import QSize
 from dotenv import load_dotenv
-from db.study_stream_dao import get_db_connection
+from db.study_stream_dao import get_db_connection, relocate_document_paths
+from .study_stream_error import StudyStreamException
+from .study_stream_folder_migration import StudyStreamFolderMigration
+from .study_stream_task import StudyStreamTaskWorker
+from .study_stream_task_priority import StudyStreamTaskPriority
 
 # Define the path to the .env file
 ENV_PATH = os.path.join(os.path.dirname(__file__), '..', 'profiles', '.env')
 
 class StudyStreamSettings(QDialog):
 
-    def __init__(self, parent, app_config, current_dir: str, logging):
+    def __init__(self, parent, app_config, current_dir: str, logging, get_db=None, suspend_db_writes=None, reopen_db=None):
         super().__init__(parent)
         self.current_dir = current_dir        
         self.load_color_scheme()
         self.app_config = app_config
         self.logging = logging
+        # The vectorstore of the application: its chunks are relocated with the documents, 
+        # and it is not written while LLM_FOLDER is migrated, then it is reopened from the new folder
+        self.get_db = get_db
+        self.suspend_db_writes = suspend_db_writes
+        self.reopen_db = reopen_db
+        # The running folder migrations by the property of the folder
+        self.migration_tasks = {}
         self.initPanel()
 
     def load_color_scheme(self):
@@ -326,29 +336,102 @@ class StudyStreamSettings(QDialog):
 
     def update_folder(self, property: str, orig_folder: str, folder_path: str):
         """
-        Copies all contents from the source directory to the destination directory.
+        Migrates all contents from the source directory to the destination directory in background;
+        the application keeps using the source directory till the migration is finished and verified.
         """
         if orig_folder == folder_path:
             return
+        if property in self.migration_tasks:
+            self.logging.warning(f"The migration of '{property}' is still running; '{folder_path}' is ignored")
+            return
         src_folder_path = self.current_dir + "/" + orig_folder
         dest_folder_path = self.current_dir + "/" + folder_path     
-        # Ensure the destination directory exists
-        if not os.path.exists(dest_folder_path):
-            os.makedirs(dest_folder_path)
-        if os.path.exists(src_folder_path):
-            try:
-                # Iterate over all files and directories in the source directory
-                for item in os.listdir(src_folder_path):
-                    s = os.path.join(src_folder_path, item)
-                    d = os.path.join(dest_folder_path, item)
-                    if os.path.isdir(s):
-                        shutil.copytree(s, d, dirs_exist_ok=True)
-                    else:
-                        shutil.copy2(s, d)
-                self.logging.info(f"Contents copied from {src_folder_path} to {dest_folder_path}")
-                self.update_env_var(property, folder_path)           
-            except Exception as e:
-                self.logging.error(f"An error occurred while copying contents of '{property}' from '{src_folder_path}' to '{dest_folder_path}': {e}")
+        migration = StudyStreamFolderMigration(src_folder_path=src_folder_path, dest_folder_path=dest_folder_path)
+        migration_task = StudyStreamTaskWorker(
+            migration.migrate, 
+            report_progress=True,
+            cancellable=True,
+            name=f"Migrating {property} to {folder_path}",
+            priority=StudyStreamTaskPriority.BULK
+        )
+        # The dialog is not modal: the user keeps working while the folder is migrated
+        progress_dialog = QProgressDialog(f"Migrating {property} to '{folder_path}' ...", "Cancel", 0, 100, self.parentWidget())
+        progress_dialog.setWindowTitle("Study Stream Migration")
+        progress_dialog.setWindowModality(Qt.WindowModality.NonModal)
+        progress_dialog.setAutoClose(False)
+        progress_dialog.setAutoReset(False)
+        progress_dialog.setMinimumDuration(0)
+        progress_dialog.canceled.connect(migration_task.cancel)
+        migration_task.progress.connect(lambda message: self.on_migration_progress(progress_dialog, migration, message))
+        migration_task.finished.connect(
+            lambda result: self.on_migration_finished(property, orig_folder, folder_path, src_folder_path, dest_folder_path, result)
+        )
+        migration_task.error.connect(lambda error: self.on_migration_failed(property, src_folder_path, dest_folder_path, error))
+        migration_task.cancelled.connect(lambda: self.on_migration_failed(property, src_folder_path, dest_folder_path, "cancelled"))
+        self.migration_tasks[property] = (migration_task, progress_dialog)
+        if property == "LLM_FOLDER" and self.suspend_db_writes:
+            # The chunks written to the old folder after it was migrated would be lost
+            self.suspend_db_writes()
+        progress_dialog.show()
+        migration_task.run()
+
+    def on_migration_progress(self, progress_dialog: QProgressDialog, migration: StudyStreamFolderMigration, message: str):
+        progress_dialog.setLabelText(message)
+        progress_dialog.setValue(migration.get_percent())
+
+    def on_migration_finished(self, property: str, orig_folder: str, folder_path: str, src_folder_path: str, dest_folder_path: str, result):
+        self.close_migration(property)
+        self.logging.info(f"Contents of '{property}' migrated from {src_folder_path} to {dest_folder_path}: {result}")
+        if property != "DOCUMENT_FOLDER":
+            self.use_folder(property, folder_path)
+            return
+        # Cut-over: the documents are moved to the new folder in the vectorstore and in the database, then the new folder is used 
+        relocation_task = StudyStreamTaskWorker(
+            self.relocate_documents, src_folder_path, dest_folder_path,
+            name=f"Relocating the documents to {folder_path}",
+            priority=StudyStreamTaskPriority.BULK
+        )
+        relocation_task.finished.connect(lambda _: self.use_folder(property, folder_path))
+        relocation_task.error.connect(
+            lambda error: self.logging.error(f"The documents were not relocated to '{dest_folder_path}'; '{property}' still refers to '{orig_folder}': {error}")
+        )
+        relocation_task.run()
+
+    def relocate_documents(self, src_folder_path: str, dest_folder_path: str) -> int:
+        # Runs in background: the chunks are relocated first, so they are put back if the database fails
+        from embeddings.embedding_database import relocate_chunk_sources
+        from embeddings.embeddings_constants import DEFAULT_LLM_FOLDER, STUDY_STREAM_COLLECTION_NAME
+        from embeddings.vectorstore_backends import open_vector_store
+
+        docs_db = self.get_db() if self.get_db else None
+        if docs_db is None:
+            # The models are still loading: the stored chunks are relocated without the embedding model
+            docs_db = open_vector_store(persist_directory=os.getenv("LLM_FOLDER") or DEFAULT_LLM_FOLDER, collection_name=STUDY_STREAM_COLLECTION_NAME)
+        relocate_chunk_sources(docs_db, old_folder=src_folder_path, new_folder=dest_folder_path)
+        relocated_count = relocate_document_paths(old_folder=src_folder_path, new_folder=dest_folder_path)
+        if relocated_count < 0:
+            relocate_chunk_sources(docs_db, old_folder=dest_folder_path, new_folder=src_folder_path)
+            raise StudyStreamException(f"Failed to relocate the documents to '{dest_folder_path}' in the database")
+        return relocated_count
+
+    def use_folder(self, property: str, folder_path: str):
+        self.update_env_var(property, folder_path)
+        os.environ[property] = folder_path
+        if property == "LLM_FOLDER" and self.reopen_db:
+            self.reopen_db(is_moved=True)
+
+    def on_migration_failed(self, property: str, src_folder_path: str, dest_folder_path: str, error):
+        self.close_migration(property)
+        self.logging.error(f"An error occurred while migrating contents of '{property}' from '{src_folder_path}' to '{dest_folder_path}': {error}")
+        if property == "LLM_FOLDER" and self.reopen_db:
+            # The application keeps writing to the old folder
+            self.reopen_db(is_moved=False)
+
+    def close_migration(self, property: str):
+        _, progress_dialog = self.migration_tasks.pop(property)
+        # Closing the dialog emits 'canceled': the task is done already
+        progress_dialog.canceled.disconnect()
+        progress_dialog.close()
     
     def update_env_var(self, key, value):
         # Read the .env file
@@ -1,48 +1,174 @@
 # Copyright (c) EGOGE - All Rights Reserved.
 # This software may be used and distributed according to the terms of the Apache-2.0 license.
+import os
+import time
 import traceback
-from PySide6.QtCore import QObject, QThread
+from collections import deque
+from typing import List
+
+from PySide6.QtCore import QObject, QRunnable, QThreadPool
 from PySide6.QtCore import Signal
 
+from .study_stream_task_priority import StudyStreamTaskPriority
+from .study_stream_task_state import StudyStreamTaskState
+
+# The number of the worker threads shared by all tasks of the application
+TASK_POOL_SIZE = int(os.getenv("TASK_POOL_SIZE", str(max(2, min(4, os.cpu_count() or 2)))))
+# The number of the completed tasks shown in the task queue
+TASK_HISTORY_SIZE = 50
+
 class StudyStreamTaskWorker(QObject):
+    started = Signal()  # Signal to indicate the task is picked by a worker thread
     finished = Signal(object)  # Signal to indicate task completion
     error = Signal(Exception)  # Signal to pass exceptions
+    progress = Signal(str)  # Signal to report the task progress
+    cancelled = Signal()  # Signal to indicate the task was cancelled
 
-    def __init__(self, func, *args, **kwargs):
+    def __init__(self, func, *args, report_progress=False, cancellable=False, name=None, priority=StudyStreamTaskPriority.NORMAL, **kwargs):
         super().__init__()
         self.func = func
         self.args = args
         self.kwargs = kwargs
-        self.thread = QThread()
-        self.moveToThread(self.thread)
-
-        # Connect thread signals
-        self.thread.started.connect(self.run_task)
-        self.finished.connect(self.thread.quit)
-        self.finished.connect(self.finished_handling)
-        self.error.connect(self.error_handling)
-        self.thread.finished.connect(self.thread.deleteLater)
+        # If set, the task function receives the 'progress' callback emitting the progress signal
+        self.report_progress = report_progress
+        # If set, the task function receives the 'is_cancelled' callback to stop early when the task is cancelled
+        self.cancellable = cancellable
+        self.name = name if name else getattr(func, '__name__', 'task')
+        self.priority = priority
+        self.state = StudyStreamTaskState.QUEUED
+        self.progress_message = ""
+        self.cancel_requested = False
+        self.submit_time = None
+        self.start_time = None
+        self.end_time = None
+        # The result of the last run: a cancelled task can return the part of its work done before it stopped
+        self.result = None
 
     def run(self):
-        self.thread.start()
+        # The task is queued in the shared worker pool, instead of a new thread per task
+        get_task_scheduler().submit(self)
+
+    def cancel(self):
+        get_task_scheduler().cancel(self)
+
+    def is_cancelled(self) -> bool:
+        return self.cancel_requested
 
     def run_task(self):
+        # Runs in a worker thread of the pool: the signals are delivered to the UI thread
+        self.state = StudyStreamTaskState.RUNNING
+        self.start_time = time.time()
+        self.started.emit()
         try:
-            print(f"<StudyStreamTaskWorker> Task is running ...")
-            result = self.func(*self.args, **self.kwargs)
-            self.finished.emit(result)
-            print(f"<StudyStreamTaskWorker> Task is finished")
+            print(f"<StudyStreamTaskWorker> Task '{self.name}' is running ...")
+            kwargs = dict(self.kwargs)
+            if self.report_progress:
+                kwargs['progress'] = self.progress.emit
+            if self.cancellable:
+                kwargs['is_cancelled'] = self.is_cancelled
+            result = self.func(*self.args, **kwargs)
+            self.result = result
+            if self.cancel_requested:
+                self.cancelled.emit()
+            else:
+                self.finished.emit(result)
+            print(f"<StudyStreamTaskWorker> Task '{self.name}' is finished")
         except Exception as e:
-            print(f"<StudyStreamTaskWorker> Task failed  with {e}")
+            print(f"<StudyStreamTaskWorker> Task '{self.name}' failed  with {e}")
             traceback.print_exc()
             self.error.emit(e)
 
-    def finished_handling(self, result):
-        #print("Task completed with result:", result)
-        # Add more finished handling logic here
-        print("Task is completed !!!")
-        pass
+class StudyStreamTaskRunnable(QRunnable):
+    def __init__(self, worker: StudyStreamTaskWorker):
+        super().__init__()
+        self.worker = worker
+        # The scheduler owns the runnable till the task is done
+        self.setAutoDelete(False)
+
+    def run(self):
+        self.worker.run_task()
+
+class StudyStreamTaskScheduler(QObject):
+    """
+    Runs the tasks of the application on one bounded pool of worker threads.
+
+    The tasks are started by their priority; the bulk tasks never take the last worker thread,
+    so a chat question does not wait for the document ingestion.
+    The queued tasks can be cancelled; the running ones are asked to stop if they are cancellable.
+    """
+    tasks_changed = Signal()
+
+    def __init__(self, max_threads: int = TASK_POOL_SIZE):
+        super().__init__()
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(max_threads)
+        self.max_bulk_tasks = max(1, max_threads - 1)
+        self.bulk_queue = deque()
+        self.bulk_in_pool = 0
+        self.runnables = {}
+        self.active_tasks: List[StudyStreamTaskWorker] = []
+        self.completed_tasks = deque(maxlen=TASK_HISTORY_SIZE)
+
+    def submit(self, worker: StudyStreamTaskWorker):
+        worker.submit_time = time.time()
+        worker.started.connect(self.tasks_changed.emit)
+        worker.progress.connect(lambda message, task=worker: self.on_task_progress(task, message))
+        worker.finished.connect(lambda result, task=worker: self.on_task_done(task, StudyStreamTaskState.FINISHED))
+        worker.error.connect(lambda error, task=worker: self.on_task_done(task, StudyStreamTaskState.FAILED))
+        worker.cancelled.connect(lambda task=worker: self.on_task_done(task, StudyStreamTaskState.CANCELLED))
+        self.active_tasks.append(worker)
+        if worker.priority == StudyStreamTaskPriority.BULK:
+            self.bulk_queue.append(worker)
+            self.start_bulk_tasks()
+        else:
+            self.start(worker)
+        self.tasks_changed.emit()
+
+    def start(self, worker: StudyStreamTaskWorker):
+        runnable = StudyStreamTaskRunnable(worker)
+        self.runnables[worker] = runnable
+        self.pool.start(runnable, worker.priority.value)
+
+    def start_bulk_tasks(self):
+        while self.bulk_queue and self.bulk_in_pool < self.max_bulk_tasks:
+            self.bulk_in_pool += 1
+            self.start(self.bulk_queue.popleft())
+
+    def cancel(self, worker: StudyStreamTaskWorker):
+        if worker.state != StudyStreamTaskState.QUEUED and worker.state != StudyStreamTaskState.RUNNING:
+            return
+        worker.cancel_requested = True
+        if worker in self.bulk_queue:
+            self.bulk_queue.remove(worker)
+            worker.cancelled.emit()
+        elif worker.state == StudyStreamTaskState.QUEUED and self.pool.tryTake(self.runnables[worker]):
+            worker.cancelled.emit()
+        # Otherwise the running task stops if it checks 'is_cancelled', or its result is dropped
+        self.tasks_changed.emit()
+
+    def on_task_progress(self, worker: StudyStreamTaskWorker, message: str):
+        worker.progress_message = message
+        self.tasks_changed.emit()
+
+    def on_task_done(self, worker: StudyStreamTaskWorker, state: StudyStreamTaskState):
+        if worker not in self.active_tasks:
+            return
+        worker.state = state
+        worker.end_time = time.time()
+        self.active_tasks.remove(worker)
+        self.completed_tasks.appendleft(worker)
+        if self.runnables.pop(worker, None) is not None and worker.priority == StudyStreamTaskPriority.BULK:
+            self.bulk_in_pool -= 1
+            self.start_bulk_tasks()
+        self.tasks_changed.emit()
+
+    def get_tasks(self) -> List[StudyStreamTaskWorker]:
+        return self.active_tasks + list(self.completed_tasks)
+
+task_scheduler = None
 
-    def error_handling(self, error):
-        print("An error occurred:", error)
-        # Add more error handling logic here
\ No newline at end of file
+def get_task_scheduler() -> StudyStreamTaskScheduler:
+    global task_scheduler
+    if task_scheduler is None:
+        task_scheduler = StudyStreamTaskScheduler()
+    return task_scheduler
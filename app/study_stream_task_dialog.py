@@ -0,0 +1,98 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the Apache-2.0 license.
+import time
+from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem,
+                               QPushButton, QHeaderView, QAbstractItemView, QLabel)
+
+from .study_stream_task import StudyStreamTaskScheduler, StudyStreamTaskWorker
+from .study_stream_task_state import StudyStreamTaskState
+
+TASK_COLUMNS = ["Task", "Priority", "State", "Progress", "Time (s)"]
+
+class StudyStreamTaskDialog(QDialog):
+    """Shows the queued, running and recently completed background tasks; the active ones can be cancelled."""
+
+    def __init__(self, parent, scheduler: StudyStreamTaskScheduler, color_scheme):
+        super().__init__(parent)
+        self.scheduler = scheduler
+        self.color_scheme = color_scheme
+        self.tasks = []
+        self.initPanel()
+        self.scheduler.tasks_changed.connect(self.refresh_tasks)
+
+    def initPanel(self):
+        self.setWindowTitle("Study Stream Tasks")
+        self.setGeometry(100, 100, 700, 400)
+        self.setStyleSheet(self.color_scheme['main-css'])
+        layout = QVBoxLayout(self)
+
+        self.summary_label = QLabel()
+        layout.addWidget(self.summary_label)
+
+        self.task_table = QTableWidget(0, len(TASK_COLUMNS))
+        self.task_table.setHorizontalHeaderLabels(TASK_COLUMNS)
+        self.task_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
+        self.task_table.horizontalHeader().setSectionResizeMode(3, QHeaderView.ResizeMode.Stretch)
+        self.task_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.task_table.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        self.task_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.task_table.itemSelectionChanged.connect(self.update_cancel_button)
+        layout.addWidget(self.task_table)
+
+        button_layout = QHBoxLayout()
+        button_layout.addStretch()
+        self.cancel_button = QPushButton("Cancel Task")
+        self.cancel_button.clicked.connect(self.cancel_task)
+        self.cancel_button.setEnabled(False)
+        button_layout.addWidget(self.cancel_button)
+        close_button = QPushButton("Close")
+        close_button.clicked.connect(self.hide)
+        button_layout.addWidget(close_button)
+        layout.addLayout(button_layout)
+
+    def show_tasks(self):
+        self.show()
+        self.raise_()
+        self.activateWindow()
+        self.refresh_tasks()
+
+    def refresh_tasks(self):
+        if not self.isVisible():
+            return
+        selected_task = self.get_selected_task()
+        self.tasks = self.scheduler.get_tasks()
+        self.task_table.setRowCount(len(self.tasks))
+        now = time.time()
+        for row, task in enumerate(self.tasks):
+            state = task.state.name
+            if task.cancel_requested and task.state == StudyStreamTaskState.RUNNING:
+                state = "CANCELLING"
+            if task.start_time is None:
+                elapsed = now - task.submit_time
+            else:
+                elapsed = (task.end_time or now) - task.start_time
+            for column, value in enumerate([task.name, task.priority.name, state, task.progress_message, f"{elapsed:.1f}"]):
+                self.task_table.setItem(row, column, QTableWidgetItem(value))
+            if task is selected_task:
+                self.task_table.selectRow(row)
+        running_count = sum(1 for task in self.tasks if task.state == StudyStreamTaskState.RUNNING)
+        queued_count = sum(1 for task in self.tasks if task.state == StudyStreamTaskState.QUEUED)
+        self.summary_label.setText(f"Running: {running_count}; queued: {queued_count}; worker threads: {self.scheduler.pool.maxThreadCount()}")
+        self.update_cancel_button()
+
+    def get_selected_task(self) -> StudyStreamTaskWorker:
+        rows = self.task_table.selectionModel().selectedRows()
+        if rows and rows[0].row() < len(self.tasks):
+            return self.tasks[rows[0].row()]
+        return None
+
+    def update_cancel_button(self):
+        task = self.get_selected_task()
+        self.cancel_button.setEnabled(
+            task is not None and not task.cancel_requested and task.state in (StudyStreamTaskState.QUEUED, StudyStreamTaskState.RUNNING)
+        )
+
+    def cancel_task(self):
+        task = self.get_selected_task()
+        if task:
+            task.cancel()
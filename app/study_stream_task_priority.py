@@ -0,0 +1,11 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the Apache-2.0 license.
+from enum import Enum
+
+class StudyStreamTaskPriority(Enum):
+    # The user waits for the result: chat questions
+    INTERACTIVE = 2
+    # Loading models, notes and other data for the UI
+    NORMAL = 1
+    # Document ingestion: never takes the last free worker
+    BULK = 0
@@ -1,16 +1,22 @@
 # Copyright (c) EGOGE - All Rights Reserved.
 # This software may be used and distributed according to the terms of the Apache-2.0 license.
 import os
-from typing import List
+import json
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
 import psycopg2
 import traceback
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, func
+from sqlalchemy.exc import DisconnectionError
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm import joinedload, subqueryload
 from study_stream_api.study_stream_school import StudyStreamSchool
 from study_stream_api.study_stream_subject import StudyStreamSubject
 from study_stream_api.study_stream_document import StudyStreamDocument
+from study_stream_api.study_stream_document_status import StudyStreamDocumentStatus
+from study_stream_api.study_stream_message import StudyStreamMessage
 from study_stream_api.study_stream_school_type import StudyStreamSchoolType
 
 # Context manager for session handling
@@ -23,8 +29,35 @@ DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
 
-# Connect to the database
+# Connection pool parameters from environment variables
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+# Seconds to wait for a free connection
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Seconds after which a connection is replaced regardless of its use
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Seconds after which a connection idle in the pool is replaced
+DB_POOL_IDLE_TIMEOUT = int(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))
+
+POOL_CHECKIN_TIME = "checkin_time"
+
+CREATE_MESSAGE_TABLE = """
+    CREATE TABLE IF NOT EXISTS study_stream_message (
+        id SERIAL PRIMARY KEY,
+        subject_id INT NOT NULL REFERENCES study_stream_subject(id) ON DELETE CASCADE,
+        seq INT NOT NULL,
+        message_type SMALLINT NOT NULL,
+        content TEXT NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (subject_id, seq)
+    );
+"""
+
+# Connect to the database: the connection of the default database is taken from the pool
+# shared with ORM sessions and is returned to it on close(); other databases are connected directly.
 def get_db_connection(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT):
+    if (dbname, user, password, host, port) == (DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT):
+        return engine.raw_connection()
     conn = psycopg2.connect(
         dbname=dbname,
         user=user,
@@ -37,13 +70,41 @@ def get_db_connection(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=D
 def get_engine():
     engine = create_engine(
         f'postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}',        
-        poolclass=NullPool
+        poolclass=QueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True
     )
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        connection_record.info[POOL_CHECKIN_TIME] = time.time()
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        # The pool replaces the connection which was idle too long (the server or firewall may have dropped it)
+        checkin_time = connection_record.info.get(POOL_CHECKIN_TIME)
+        if checkin_time is not None and time.time() - checkin_time > DB_POOL_IDLE_TIMEOUT:
+            connection_record.info.pop(POOL_CHECKIN_TIME, None)
+            raise DisconnectionError(f"The connection was idle for more than {DB_POOL_IDLE_TIMEOUT} seconds")
+
     return engine
 
 engine = get_engine()
 Session = sessionmaker(bind=engine)
 
+def get_pool_stats() -> Dict[str, int]:
+    """Returns the statistics of the connection pool shared by ORM sessions and raw connections."""
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow()
+    }
+
 @contextmanager
 def get_session():
     session = Session()
@@ -109,9 +170,32 @@ def create_tables(conn):
         created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
         updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
     );                    
-    """)
+    """ + CREATE_MESSAGE_TABLE)
+    conn.commit()
+    cursor.close()
+
+# One-time migration of the notes (the whole chat serialized as JSON) to the append-only messages
+def migrate_notes_to_messages(conn, logging):
+    cursor = conn.cursor()
+    cursor.execute(CREATE_MESSAGE_TABLE)
+    cursor.execute("SELECT subject_id, json_content FROM study_stream_note")
+    migrated_count = 0
+    for subject_id, json_content in cursor.fetchall():
+        # JSONB is parsed by psycopg2
+        messages_data = json.loads(json_content) if isinstance(json_content, str) else json_content
+        messages_data.sort(key=lambda msg_data: datetime.fromisoformat(msg_data['created_at']))
+        cursor.executemany("""
+            INSERT INTO study_stream_message (subject_id, seq, message_type, content, created_at) 
+            VALUES (%s, %s, %s, %s, %s)
+        """, [
+            (subject_id, seq, msg_data['type'], msg_data['content'], datetime.fromisoformat(msg_data['created_at']))
+            for seq, msg_data in enumerate(messages_data, start=1)
+        ])
+        migrated_count += len(messages_data)
+    # The table and the messages are committed together: a failed migration is repeated on the next start
     conn.commit()
     cursor.close()
+    logging.info(f"Migrated {migrated_count} note messages to 'study_stream_message'")
 
 # Insert default/template data
 def insert_default_data(conn):
@@ -140,6 +224,9 @@ def check_study_stream_database(logging):
         create_tables(conn)
         logging.info("Creating default School with one Subject ...")
         insert_default_data(conn)
+    elif not table_exists(conn, 'study_stream_message'):
+        logging.info("Migrating Study Stream notes to messages ...")
+        migrate_notes_to_messages(conn, logging)
     else:
         logging.info("Study Stream tables already exist !!!")
     
@@ -149,11 +236,9 @@ def get_subject(subject_id):
     print(f"DB Fetch for Subject: {subject_id}")
     try:
         with get_session() as session:
+            # The messages of the subject's note are fetched by pages: see fetch_messages()
             subject = (session.query(StudyStreamSubject)
-                .options(
-                    joinedload(StudyStreamSubject.documents),
-                    joinedload(StudyStreamSubject.note)
-                )
+                .options(joinedload(StudyStreamSubject.documents))
                 .filter_by(id=subject_id)
                 .first())   
             process_subject(session, subject)
@@ -167,15 +252,8 @@ def get_school_with_subjects(school_id):
     print(f"DB Fetch for School: {school_id}")
     try:
         with get_session() as session:
-            school = (session.query(StudyStreamSchool)
-                .options(
-                    joinedload(StudyStreamSchool.subjects)
-                    .joinedload(StudyStreamSubject.documents),
-                    joinedload(StudyStreamSchool.subjects)
-                    .joinedload(StudyStreamSubject.note)
-                )
-                .filter_by(id=school_id)
-                .first())  
+            # The subjects are joined by the relationship; their documents and notes are not needed
+            school = session.query(StudyStreamSchool).filter_by(id=school_id).first()
             process_school(session,school) 
             return school  
     except Exception as e:
@@ -183,43 +261,201 @@ def get_school_with_subjects(school_id):
         print(traceback.format_exc())
     return None  
 
-def fetch_all_schools_with_related_data() -> List[StudyStreamSchool]:
+def fetch_schools_with_document_counts() -> Tuple[List[StudyStreamSchool], Dict[int, int]]:
+    """
+    Fetches all schools with their subjects, but without the documents and notes of the subjects,
+    and the number of documents per subject id (subjects without documents are not in the map).
+    """
     try:
         with get_session() as session:
-            schools = session.query(StudyStreamSchool).options(
-                joinedload(StudyStreamSchool.subjects).options(
-                    joinedload(StudyStreamSubject.documents),
-                    joinedload(StudyStreamSubject.note)
-                )
-            ).all()
+            schools = session.query(StudyStreamSchool).order_by(StudyStreamSchool.id).all()
+            document_counts = dict(
+                session.query(StudyStreamDocument.subject_id, func.count(StudyStreamDocument.id))
+                .group_by(StudyStreamDocument.subject_id)
+                .all()
+            )
             for school in schools:
                 process_school(session, school)
-        return schools
+        return schools, document_counts
     except Exception as e:
-        print("An error occurred while fetching schools with related data.")
+        print("An error occurred while fetching schools with document counts.")
         print(traceback.format_exc())
-    return [] 
+    return [], {}
+
+def fetch_subject_documents(subject_id, after_id: int = 0, limit: int = 100) -> List[StudyStreamDocument]:
+    """
+    Fetches one page of documents of the subject ordered by id: 
+    the page starts after the document 'after_id', the last document of the previous page.
+    """
+    try:
+        with get_session() as session:
+            documents = (session.query(StudyStreamDocument)
+                .filter(StudyStreamDocument.subject_id == subject_id, StudyStreamDocument.id > after_id)
+                .order_by(StudyStreamDocument.id)
+                .limit(limit)
+                .all())
+            for document in documents:
+                session.expunge(document)
+            return documents
+    except Exception as e:
+        print(f"An error occurred while fetching documents of a subject '{subject_id}'.")
+        print(traceback.format_exc())
+    return []
+
+def fetch_new_documents(subject_id=None, school_id=None) -> List[StudyStreamDocument]:
+    """
+    Fetches the documents which are not analyzed yet (the status NEW) of the subject or
+    of all subjects of the school.
+    """
+    try:
+        with get_session() as session:
+            query = session.query(StudyStreamDocument).filter(StudyStreamDocument.status == StudyStreamDocumentStatus.NEW.value)
+            if subject_id is not None:
+                query = query.filter(StudyStreamDocument.subject_id == subject_id)
+            elif school_id is not None:
+                query = query.join(StudyStreamSubject, StudyStreamSubject.id == StudyStreamDocument.subject_id).filter(StudyStreamSubject.school_id == school_id)
+            documents = query.order_by(StudyStreamDocument.id).all()
+            for document in documents:
+                session.expunge(document)
+            return documents
+    except Exception as e:
+        print(f"An error occurred while fetching new documents of a subject '{subject_id}' / a school '{school_id}'.")
+        print(traceback.format_exc())
+    return []
+
+def fetch_document_file_paths() -> Optional[Set[str]]:
+    """Fetches the file paths of all documents; None on failure, so no document is taken as deleted."""
+    try:
+        with get_session() as session:
+            return {file_path for (file_path,) in session.query(StudyStreamDocument.file_path).distinct()}
+    except Exception as e:
+        print("An error occurred while fetching the file paths of documents.")
+        print(traceback.format_exc())
+    return None
+
+def fetch_processed_document(file_path: str) -> StudyStreamDocument:
+    """
+    Fetches an analyzed document stored in the file: the stored documents are content-addressed,
+    so a document with the same file has the same content and its embeddings can be reused.
+    """
+    try:
+        with get_session() as session:
+            document = (session.query(StudyStreamDocument)
+                .filter(StudyStreamDocument.file_path == file_path, 
+                        StudyStreamDocument.status == StudyStreamDocumentStatus.PROCESSED.value)
+                .first())
+            if document:
+                session.expunge(document)
+            return document
+    except Exception as e:
+        print(f"An error occurred while fetching a processed document of the file '{file_path}'.")
+        print(traceback.format_exc())
+    return None
+
+def update_documents_status(statuses: Dict[StudyStreamDocumentStatus, List[int]]) -> bool:
+    """
+    Updates the status of many documents in one transaction: one UPDATE per status, one commit.
+    The date of the status is set with the status.
+    """
+    try:
+        with get_session() as session:
+            for status, document_ids in statuses.items():
+                if not document_ids:
+                    continue
+                update_values = {StudyStreamDocument.status: status.value}
+                if status == StudyStreamDocumentStatus.IN_PROGRESS:
+                    update_values[StudyStreamDocument.in_progress_date] = datetime.now()
+                elif status == StudyStreamDocumentStatus.PROCESSED:
+                    update_values[StudyStreamDocument.processed_date] = datetime.now()
+                (session.query(StudyStreamDocument)
+                    .filter(StudyStreamDocument.id.in_(document_ids))
+                    .update(update_values, synchronize_session=False))
+            session.commit()
+            return True
+    except Exception as e:
+        print(f"An error occurred while updating the status of documents: {statuses}.")
+        print(traceback.format_exc())
+    return False
+
+def relocate_document_paths(old_folder: str, new_folder: str) -> int:
+    """
+    Moves the file paths of all documents stored in the old folder to the new folder in one transaction;
+    returns the number of the relocated documents, or -1 on failure.
+    """
+    old_prefix = old_folder.rstrip("/") + "/"
+    new_prefix = new_folder.rstrip("/") + "/"
+    try:
+        with get_session() as session:
+            relocated_count = (session.query(StudyStreamDocument)
+                .filter(StudyStreamDocument.file_path.startswith(old_prefix, autoescape=True))
+                .update(
+                    {StudyStreamDocument.file_path: func.concat(new_prefix, func.substr(StudyStreamDocument.file_path, len(old_prefix) + 1))},
+                    synchronize_session=False
+                ))
+            session.commit()
+            print(f"Relocated {relocated_count} documents from '{old_prefix}' to '{new_prefix}'")
+            return relocated_count
+    except Exception as e:
+        print(f"An error occurred while relocating documents from '{old_prefix}' to '{new_prefix}'.")
+        print(traceback.format_exc())
+    return -1
 
 def process_school(session, school: StudyStreamSchool):
     print(f"DB Fetch for School: {school.name}, Type: {school.school_type}")
-    for subject in school.subjects:
-        process_subject(session, subject)
+    # The loaded subjects, documents and notes are expunged with the school (the 'all' cascade)
     session.expunge(school)
 
 def process_subject(session, subject: StudyStreamSubject): 
     print(f"DB Fetch for Subject: {subject.class_name}")
-    if subject.note:
-        messages = subject.note.to_messages()
-        #for message in messages:
-        #    print(f"    Message: {message.content}, Created At: {message.created_at}")
-    for document in subject.documents:
-        #print(f"DB Fetch for Document: {document.name}, File Path: {document.file_path}, Status: {document.status}")
-        session.expunge(document)
     session.expunge(subject)  
 
-def fetch_messages_for_subject(session, subject_id):
-    subject = session.query(StudyStreamSubject).options(joinedload(StudyStreamSubject.note)).filter_by(id=subject_id).first()
-    return subject.note.to_messages() if subject and subject.note else []
+def fetch_messages(subject_id, before_seq: int = None, limit: int = 50) -> List[StudyStreamMessage]:
+    """
+    Fetches one page of the subject's messages in their order: the latest messages 
+    or, when 'before_seq' is set, the messages preceding it (scrolling back the chat).
+    """
+    try:
+        with get_session() as session:
+            query = session.query(StudyStreamMessage).filter(StudyStreamMessage.subject_id == subject_id)
+            if before_seq is not None:
+                query = query.filter(StudyStreamMessage.seq < before_seq)
+            messages = query.order_by(StudyStreamMessage.seq.desc()).limit(limit).all()
+            for message in messages:
+                session.expunge(message)
+            messages.reverse()
+            return messages
+    except Exception as e:
+        print(f"An error occurred while fetching messages of a subject '{subject_id}'.")
+        print(traceback.format_exc())
+    return []
+
+def append_messages(subject_id, messages: List[StudyStreamMessage]) -> bool:
+    """
+    Appends the new messages to the subject's note: only these rows are written,
+    the messages get the next sequence numbers of the subject.
+    """
+    try:
+        with get_session() as session:
+            session.expire_on_commit = False
+            last_seq = (session.query(func.coalesce(func.max(StudyStreamMessage.seq), 0))
+                .filter(StudyStreamMessage.subject_id == subject_id)
+                .scalar())
+            for seq, message in enumerate(messages, start=last_seq + 1):
+                message.subject_id = subject_id
+                message.seq = seq
+            session.add_all(messages)
+            session.commit()
+            for message in messages:
+                session.expunge(message)
+            print(f"Appended {len(messages)} messages to the note of Class: {subject_id}")
+            return True
+    except Exception as e:
+        print(f"An error occurred while appending messages to a note of Class: {subject_id}.")
+        print(traceback.format_exc())
+        # The messages are not saved: they are appended with the next save
+        for message in messages:
+            message.seq = None
+    return False
 
 def create_entity(entity):
     with get_session() as session:
@@ -295,25 +531,6 @@ def update_class(updated_class: StudyStreamSubject)-> StudyStreamSubject:
         print(traceback.format_exc())
     return None  
 
-def update_note(updated_class: StudyStreamSubject, note: str)-> StudyStreamSubject:
-    try:
-        with get_session() as session:
-            session.expire_on_commit = False
-            # Fetch the document
-            db_class = StudyStreamSubject.read(session, updated_class.id)
-            if not db_class:
-                print(f"Class with id {updated_class.id} not found.")
-                return None
-            
-            print(f"Updating a note of Class fields: name = '{db_class}'")
-            db_class.update_note(session, json_content=note)
-            session.expunge(db_class)  
-            return db_class
-    except Exception as e:
-        print(f"An error occurred while updating a note of Class: {updated_class.id}.")
-        print(traceback.format_exc())
-    return None  
-
 def update_school(updated_school: StudyStreamSchool)-> StudyStreamSchool:
     try:
         with get_session() as session:
@@ -5,22 +5,24 @@ import logging
 import asyncio
 import time
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from langchain_community.vectorstores import Chroma
+from typing import TYPE_CHECKING, Callable, Dict, List
+from langchain_core.vectorstores import VectorStore
 
-from .document_loader import load_documents
-
-from embeddings.embeddings_constants import CHROMA_SETTINGS, DEFAULT_COLLECTION_NAME, BATCH_SIZE, get_elapse_time_message
+from embeddings.embeddings_constants import (DEFAULT_COLLECTION_NAME, BATCH_SIZE, get_elapse_time_message, 
+                                             get_duration_message, INGESTION_BATCH_SIZE, INGESTION_PARSE_WORKERS)
+from embeddings.vectorstore_backends import (open_vector_store, DEFAULT_VECTORSTORE_BACKEND, MANIFEST_BACKEND_KEY, 
+                                             MANIFEST_MODEL_NAME_KEY, VECTORSTORE_BACKENDS)
 
 from models.model_info import ModelInfo
 from models.models_constants import DEFAULT_MODEL_NAME
 
-from .document_loader import load_zip_with_splits, load_document_split, load_supported_documents
-
-from embeddings.unstructured.file_loader_query import FileLoaderQuery
-from embeddings.unstructured.document_splitter import DocumentSplitter
+# Chroma and the document converters are imported by the functions using them: they are slow to import
+if TYPE_CHECKING:
+    from embeddings.unstructured.document_splitter import DocumentSplitter
 
-def create_manifest(collection_name, model_name, persist_directory):
+def create_manifest(collection_name, model_name, persist_directory, backend=None):
     if persist_directory is None:
         return False
     
@@ -29,6 +31,9 @@ def create_manifest(collection_name, model_name, persist_directory):
 
     if model_name is None:
         model_name = DEFAULT_MODEL_NAME    
+
+    if backend is None:
+        backend = DEFAULT_VECTORSTORE_BACKEND
    
     meta_inf_path = os.path.join(persist_directory, 'META-INF')
     manifest_file_path = os.path.join(meta_inf_path, 'MANIFEST.MF')
@@ -37,7 +42,7 @@ def create_manifest(collection_name, model_name, persist_directory):
     current_utc_datetime = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z' 
 
     # Manifest content
-    manifest_content = f"""Manifest-Version: 1.0\nCreated-On: {current_utc_datetime}\nCreated-By: EGOGE (https://github.com/gosha70/document-assistant)\nCollectio-Name: {collection_name}\nEmbedding-Class: {ModelInfo.embedding_class()}\nEmbedding-Model-Name: {model_name}
+    manifest_content = f"""Manifest-Version: 1.0\nCreated-On: {current_utc_datetime}\nCreated-By: EGOGE (https://github.com/gosha70/document-assistant)\nCollectio-Name: {collection_name}\nEmbedding-Class: {ModelInfo.embedding_class()}\n{MANIFEST_MODEL_NAME_KEY}: {model_name}\n{MANIFEST_BACKEND_KEY}: {backend}
     """
 
     if not os.path.exists(meta_inf_path):
@@ -56,7 +61,7 @@ def on_task_completion(task_id, completed_tasks):
     completed_tasks.append(task_id)
     print(f"The async task #{task_id} just finished. Total finished tasks: {len(completed_tasks)}")
 
-async def wait_for_tasks(docs_db, async_tasks, completed_tasks) -> Chroma:
+async def wait_for_tasks(docs_db, async_tasks, completed_tasks) -> VectorStore:
     """
     Waits for the specified async tasks to finish, then saves the vectorstoore.
 
@@ -82,7 +87,7 @@ async def wait_for_tasks(docs_db, async_tasks, completed_tasks) -> Chroma:
 
     return docs_db
 
-async def process_chunks(docs_db, documents, embedding, collection_name, persist_directory, async_tasks, completed_tasks, task_id) -> Chroma:
+async def process_chunks(docs_db, documents, embedding, collection_name, persist_directory, async_tasks, completed_tasks, task_id, backend=None) -> VectorStore:
     """
     Processes the specified chunk of (Documents).
 
@@ -97,6 +102,7 @@ async def process_chunks(docs_db, documents, embedding, collection_name, persist
     - async_tasks (List): the collection of isssued async tasks
     - completed_tasks (List): the collection of finished async tasks
     - task_id (int): the async task id
+    - backend (str): the vectorstore backend; Chroma by default
 
     Returns:
     - (Chroma): the embedding vectorstore
@@ -106,12 +112,13 @@ async def process_chunks(docs_db, documents, embedding, collection_name, persist
         if collection_name is None:
             collection_name = DEFAULT_COLLECTION_NAME
 
-        docs_db = Chroma.from_documents(
-            documents=documents,
+        docs_db = open_vector_store(
+            persist_directory=persist_directory,
             collection_name=collection_name,
             embedding=embedding, 
-            persist_directory=persist_directory
+            backend=backend or DEFAULT_VECTORSTORE_BACKEND
         )
+        docs_db.add_documents(documents=documents)
         logging.info("Finished the creation of embedding vectorstore.")    
     else:
         logging.info(f"The async task #{task_id} is updating the embedding vectorstore with {len(documents)} document splits ...")
@@ -121,7 +128,7 @@ async def process_chunks(docs_db, documents, embedding, collection_name, persist
 
     return docs_db
 
-def add_file_content_to_db(docs_db: Chroma, document_splitter: DocumentSplitter, file_name: str):
+def add_file_content_to_db(docs_db: VectorStore, document_splitter: "DocumentSplitter", file_name: str):
     """
     Processes the single file.
 
@@ -139,7 +146,152 @@ def add_file_content_to_db(docs_db: Chroma, document_splitter: DocumentSplitter,
         if ids:
             logging.info(f"Saving the vectorstore with new document ids: {ids}")
             docs_db.persist()
+
+def get_eta_message(start_time, done_count, total_count) -> str:
+    if done_count == 0:
+        return "unknown"
+    return get_duration_message((time.time() - start_time) / done_count * (total_count - done_count))
+
+def add_files_content_to_db(
+        docs_db: VectorStore, 
+        document_splitter: "DocumentSplitter", 
+        file_names: List[str], 
+        batch_size: int = INGESTION_BATCH_SIZE,
+        max_workers: int = INGESTION_PARSE_WORKERS,
+        progress: Callable[[str], None] = None,
+        is_cancelled: Callable[[], bool] = None) -> Dict[str, List[str]]:
+    """
+    Processes the files in bulk: the files are parsed in parallel, their splits are added 
+    to the vectorstore in batches of files, and the vectorstore is persisted once per batch.
+
+    Parameters:
+    - docs_db (Chroma): the vectorstore
+    - document_splitter (DocumentSplitter): the document splitter                     
+    - file_names (List[str]): the file names
+    - batch_size (int): the number of files added to the vectorstore at once
+    - max_workers (int): the number of threads parsing the files; they are not taken from the task pool of the application
+    - progress (Callable): the optional callback receiving the progress message with ETA
+    - is_cancelled (Callable): the optional callback; if it returns True, the remaining files are skipped
+
+    Returns:
+    - (Dict[str, List[str]]): the 'processed', 'failed' and 'skipped' (cancelled) file names
+    """
+    start_time = time.time()
+    result = {"processed": [], "failed": [], "skipped": []}
+    total_count = len(file_names)
+    batch_files = []
+    batch_documents = []
+
+    def report(message):
+        logging.info(message)
+        if progress:
+            progress(message)
+
+    def add_batch():
+        if not batch_files:
+            return
+        try:
+            if batch_documents:
+                docs_db.add_documents(documents=batch_documents)
+                docs_db.persist()
+            result["processed"].extend(batch_files)
+        except Exception as e:
+            logging.error(f"Failed to add the splits of {len(batch_files)} files to the vectorstore: {e}")
+            result["failed"].extend(batch_files)
+        batch_files.clear()
+        batch_documents.clear()
+        done_count = len(result["processed"]) + len(result["failed"])
+        report(
+            f"Analyzed {done_count}/{total_count} documents in {get_elapse_time_message(start_time=start_time)}; "
+            f"ETA: {get_eta_message(start_time, done_count, total_count)}"
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(document_splitter.process_file, file_name): file_name for file_name in file_names}
+        pending = set(futures)
+        for future in as_completed(futures):
+            if is_cancelled and is_cancelled():
+                # The queued files are not parsed; only the files being parsed are finished
+                executor.shutdown(wait=True, cancel_futures=True)
+                result["skipped"].extend(futures[skipped_future] for skipped_future in futures if skipped_future in pending)
+                break
+            pending.discard(future)
+            file_name = futures[future]
+            try:
+                documents = future.result()
+            except Exception as e:
+                logging.error(f"Failed to create unstructured Documents from '{file_name}': {e}")
+                result["failed"].append(file_name)
+                continue
+            if documents is None:
+                result["failed"].append(file_name)
+                continue
+            batch_files.append(file_name)
+            batch_documents.extend(documents)
+            if len(batch_files) >= batch_size:
+                add_batch()
+        # The parsed files of the last batch are added even if the task was cancelled meanwhile
+        add_batch()
+
+    report(
+        f"Finished the analysis of {total_count} documents in {get_elapse_time_message(start_time=start_time)}: "
+        f"{len(result['processed'])} processed, {len(result['failed'])} failed, {len(result['skipped'])} skipped"
+    )
+    return result
         
+def iter_collection_batches(collection, batch_size: int = BATCH_SIZE, include: List[str] = None):
+    """
+    Reads all chunks of the Chroma collection by pages, so a large collection is not loaded at once.
+
+    Parameters:
+    - collection: the Chroma collection, e.g. 'docs_db._collection'
+    - batch_size (int): the number of chunks per page
+    - include (List[str]): the fields read with the ids: 'documents', 'metadatas' and/or 'embeddings'
+
+    Returns:
+    - the generator of the pages as returned by 'collection.get'
+    """
+    if include is None:
+        include = ['documents', 'metadatas', 'embeddings']
+    offset = 0
+    while True:
+        batch = collection.get(include=include, limit=batch_size, offset=offset)
+        if not batch['ids']:
+            return
+        yield batch
+        offset += len(batch['ids'])
+
+def relocate_chunk_sources(docs_db, old_folder: str, new_folder: str, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Moves the 'source' metadata of the chunks of the files stored in the old folder to the new folder,
+    as the document paths in the database are moved when the document folder is migrated.
+
+    Returns:
+    - (int): the number of the relocated chunks
+    """
+    collection = docs_db._collection
+    old_prefix = old_folder.rstrip("/") + "/"
+    new_prefix = new_folder.rstrip("/") + "/"
+    # The ids are collected first: the pages must not change while they are read
+    relocated_ids = [
+        chunk_id
+        for batch in iter_collection_batches(collection, batch_size=batch_size, include=['metadatas'])
+        for chunk_id, metadata in zip(batch['ids'], batch['metadatas'])
+        if str((metadata or {}).get('source', '')).startswith(old_prefix)
+    ]
+    for start in range(0, len(relocated_ids), batch_size):
+        batch = collection.get(ids=relocated_ids[start:start + batch_size], include=['documents', 'metadatas', 'embeddings'])
+        collection.upsert(
+            ids=batch['ids'],
+            embeddings=batch['embeddings'],
+            metadatas=[dict(metadata, source=new_prefix + metadata['source'][len(old_prefix):]) for metadata in batch['metadatas']],
+            documents=batch['documents']
+        )
+    if relocated_ids:
+        docs_db.persist()
+    logging.info(f"Relocated {len(relocated_ids)} chunks from '{old_prefix}' to '{new_prefix}'")
+    return len(relocated_ids)
+
 def adjust_batch_size(batch_size, items_count):
     max_thread = items_count / batch_size
     # Limit to 10 concurrent thread (the first batch is processed synchronously)
@@ -148,7 +300,7 @@ def adjust_batch_size(batch_size, items_count):
 
     return int(batch_size)    
 
-async def process_splits_in_chunks(embedding, documents, chunk_size, collection_name, persist_directory) -> Chroma:
+async def process_splits_in_chunks(embedding, documents, chunk_size, collection_name, persist_directory, backend=None) -> VectorStore:
     """
     Add the specified (Documents) in chunks to a new (Chroma) vectorstore.
 
@@ -178,11 +330,11 @@ async def process_splits_in_chunks(embedding, documents, chunk_size, collection_
         logging.info(f"Processing the batch {batch_id}: {len(document_chunk)} documents")
 
         if document_chunk:
-            docs_db = await process_chunks(docs_db, document_chunk, embedding, collection_name, persist_directory, async_tasks, completed_tasks, i)
+            docs_db = await process_chunks(docs_db, document_chunk, embedding, collection_name, persist_directory, async_tasks, completed_tasks, i, backend)
 
     return await wait_for_tasks(docs_db, async_tasks, completed_tasks)
 
-async def process_files_in_chunks(embedding, file_paths, chunk_size, collection_name, persist_directory) -> Chroma:
+async def process_files_in_chunks(embedding, file_paths, chunk_size, collection_name, persist_directory, backend=None) -> VectorStore:
     """
     Add the specified (Documents) in chunks to a new (Chroma) vectorstore.
 
@@ -207,6 +359,8 @@ async def process_files_in_chunks(embedding, file_paths, chunk_size, collection_
     files_count = len(file_paths)
     chunk_size = adjust_batch_size(batch_size=chunk_size, items_count=files_count)
 
+    from .document_loader import load_document_split
+
     for i in range(0, files_count, chunk_size):
         file_chunk = file_paths[i:i + chunk_size]
         batch_id = f"{i // chunk_size + 1}/{total_count // chunk_size + 1}"
@@ -214,12 +368,12 @@ async def process_files_in_chunks(embedding, file_paths, chunk_size, collection_
         if file_chunk:
             documents = [load_document_split(open(file_path, 'r')) for file_path in file_chunk if file_path]
             logging.info(f"Starting the task {task_id} ...")
-            docs_db = await process_chunks(docs_db, documents, embedding, collection_name, persist_directory, async_tasks, completed_tasks, task_id)
+            docs_db = await process_chunks(docs_db, documents, embedding, collection_name, persist_directory, async_tasks, completed_tasks, task_id, backend)
             task_id = task_id + 1
 
     return await wait_for_tasks(docs_db, async_tasks, completed_tasks)
 
-async def create_embedding_database(documents, model_name, chunk_size, collection_name, persist_directory) -> Chroma:
+async def create_embedding_database(documents, model_name, chunk_size, collection_name, persist_directory, backend=None) -> VectorStore:
     """
     Creates a (Chroma) embedding vectorstore which stores processed unstructured document splits.
 
@@ -245,10 +399,11 @@ async def create_embedding_database(documents, model_name, chunk_size, collectio
         documents=documents, 
         chunk_size=chunk_size,
         collection_name=collection_name,
-        persist_directory=persist_directory
+        persist_directory=persist_directory,
+        backend=backend
     )
 
-async def create_embedding_database_from_splits(splits_directory, model_name, chunk_size, collection_name, persist_directory) -> Chroma:
+async def create_embedding_database_from_splits(splits_directory, model_name, chunk_size, collection_name, persist_directory, backend=None) -> VectorStore:
     """
     Creates a (Chroma) embedding vectorstore from unstructured document splits.
 
@@ -280,10 +435,11 @@ async def create_embedding_database_from_splits(splits_directory, model_name, ch
         file_paths=file_paths, 
         chunk_size=chunk_size,
         collection_name=collection_name,
-        persist_directory=persist_directory
+        persist_directory=persist_directory,
+        backend=backend
     )   
 
-async def create_embedding_database_from_zip(zip_file, model_name, chunk_size, collection_name, persist_directory) -> Chroma:
+async def create_embedding_database_from_zip(zip_file, model_name, chunk_size, collection_name, persist_directory, backend=None) -> VectorStore:
     """
     Creates a (Chroma) embedding vectorstore from the spcified zip file which stores processed unstructured document splits.
 
@@ -299,6 +455,8 @@ async def create_embedding_database_from_zip(zip_file, model_name, chunk_size, c
     - (Chroma): the embedding vectorstore
     """
     logging.info(f"Creating the embedding vectorstore from the zip file: '{zip_file}' ...") 
+    from .document_loader import load_zip_with_splits
+
     unzip_folder = load_zip_with_splits(zip_file=zip_file) 
 
     if unzip_folder is None:
@@ -310,11 +468,12 @@ async def create_embedding_database_from_zip(zip_file, model_name, chunk_size, c
         model_name=model_name,
         chunk_size=chunk_size,
         collection_name=collection_name,
-        persist_directory=persist_directory
+        persist_directory=persist_directory,
+        backend=backend
     )
 
 
-def create_vector_store(documents, model_name, collection_name, persist_directory) -> Chroma:
+def create_vector_store(documents, model_name, collection_name, persist_directory) -> VectorStore:
     """
     Creates a (Chroma) embedding vectorstore which stores processed unstructured document splits
     associates with the specified file types.
@@ -341,15 +500,16 @@ def create_vector_store(documents, model_name, collection_name, persist_director
     
     return None
 
-def load_vector_store(model_name, collection_name, persist_directory) -> Chroma:
+def load_vector_store(model_name, collection_name, persist_directory, backend=None) -> VectorStore:
     """
-    Load the Chroma for the vectorstore persisted in the specified directory.
+    Load the vectorstore persisted in the specified directory with the backend set in its manifest (Chroma by default).
 
     Parameters:
     - model_name (str): The embedding model name
     - collection_name (str): the vectorstore collection name
     - persist_directory (str): The optional file path to store the embedding vectorstore; 
                                if it is not specified, (Chroma) is not persisted.
+    - backend (str): The optional vectorstore backend overriding the manifest's one
 
     Returns:
     - (Chroma): the embedding vectorstore if documents are found and processed; otherwise - None.
@@ -361,11 +521,11 @@ def load_vector_store(model_name, collection_name, persist_directory) -> Chroma:
     if collection_name is None:
         collection_name = DEFAULT_COLLECTION_NAME
 
-    return Chroma(
+    return open_vector_store(
         persist_directory=persist_directory,
         collection_name=collection_name,
-        embedding_function=embedding,
-        client_settings=CHROMA_SETTINGS,
+        embedding=embedding,
+        backend=backend
     )
 
 if __name__ == "__main__":      
@@ -432,6 +592,13 @@ if __name__ == "__main__":
         help='The name of vectorsstore.', 
         default=None
     )
+    parser.add_argument(
+        '--backend', 
+        type=str, 
+        choices=VECTORSTORE_BACKENDS,
+        help='The vectorstore backend: Chroma, the in-process HNSW index, the exact search for small collections, or the int8/pq quantized index for large ones.', 
+        default=DEFAULT_VECTORSTORE_BACKEND
+    )
     parser.add_argument(
         '--test_question', 
         type=str, 
@@ -443,6 +610,10 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     logging.info(f"Creating the vectorsstore the arguments: {args}")
+    from .document_loader import load_documents, load_supported_documents
+    from embeddings.unstructured.document_splitter import DocumentSplitter
+    from embeddings.unstructured.file_loader_query import FileLoaderQuery
+
     document_splitter = DocumentSplitter(logging)
     # Call the create_vector_store function
     start_time = time.time()
@@ -453,7 +624,8 @@ if __name__ == "__main__":
             model_name=args.model_name,
             chunk_size=BATCH_SIZE,
             collection_name=args.collection_name,
-            persist_directory=args.persist_directory
+            persist_directory=args.persist_directory,
+            backend=args.backend
         ))
     elif args.splits_directory:   
         docs_db = asyncio.run(create_embedding_database_from_splits(
@@ -461,7 +633,8 @@ if __name__ == "__main__":
             model_name=args.model_name,
             chunk_size=BATCH_SIZE,
             collection_name=args.collection_name,
-            persist_directory=args.persist_directory
+            persist_directory=args.persist_directory,
+            backend=args.backend
         ))        
     else:
         if args.file_types is None:
@@ -475,10 +648,11 @@ if __name__ == "__main__":
             model_name=args.model_name,
             chunk_size=BATCH_SIZE,
             collection_name=args.collection_name,
-            persist_directory=args.persist_directory
+            persist_directory=args.persist_directory,
+            backend=args.backend
         ))
 
-    create_manifest(collection_name=args.collection_name, model_name=args.model_name, persist_directory=args.persist_directory)
+    create_manifest(collection_name=args.collection_name, model_name=args.model_name, persist_directory=args.persist_directory, backend=args.backend)
      
     elapsed_time_msg = get_elapse_time_message(start_time=start_time)
    
@@ -488,8 +662,7 @@ if __name__ == "__main__":
         logging.info(f"Finished the creation of vectorstore creation in {elapsed_time_msg}.")
 
         # Test a new vectorstore
-        doc_ids = docs_db.get()["ids"]
-        logging.info(f"The vectorstore stores {len(doc_ids)} documents")
+        logging.info(f"The vectorstore stores {docs_db._collection.count()} documents")
         
         if args.test_question is not None:
             retriever = docs_db.as_retriever()
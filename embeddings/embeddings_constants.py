@@ -1,7 +1,7 @@
 # Copyright (c) EGOGE - All Rights Reserved.
 # This software may be used and distributed according to the terms of the CC-BY-SA-4.0 license.
 import time
-from chromadb.config import Settings
+from functools import lru_cache
 
 # Char-level splits
 CHUNK_SIZE = 1000
@@ -15,19 +15,41 @@ METADATA_PARAM_NAME = 'metadata'
 # Number of files to process at a time
 BATCH_SIZE = 300
 
-# Chroma settings
-CHROMA_SETTINGS = Settings(
-    anonymized_telemetry=False,
-    is_persistent=True,
-)
+# Bulk analysis of the StudyStream documents: the number of files added to the vectorstore 
+# (and persisted) at once and the number of threads parsing the files
+INGESTION_BATCH_SIZE = 16
+INGESTION_PARSE_WORKERS = 4
+
+# Chroma settings are created on the first access of CHROMA_SETTINGS, 
+# so 'chromadb' is not imported till the vectorstore is opened
+@lru_cache(maxsize=None)
+def get_chroma_settings():
+    from chromadb.config import Settings
+
+    return Settings(
+        anonymized_telemetry=False,
+        is_persistent=True,
+    )
+
+def __getattr__(name):
+    if name == "CHROMA_SETTINGS":
+        return get_chroma_settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 DEFAULT_COLLECTION_NAME = "EGOGE_DOCUMENTS_DB"
 
+# The vectorstore of the StudyStream application and the QA service
+STUDY_STREAM_COLLECTION_NAME = "STUDY_STREAM_LLM_DB"
+DEFAULT_LLM_FOLDER = "llm_models"
+DEFAULT_DOCUMENT_FOLDER = "study_document"
+
 def get_elapse_time_message(start_time):
     end_time = time.time()
-    elapsed_time = end_time - start_time
+    return get_duration_message(end_time - start_time)
+
+def get_duration_message(elapsed_time):
     if elapsed_time > 3600:
-        return f"{round(elapsed_time/60, ndigits=2)} hours"
+        return f"{round(elapsed_time/3600, ndigits=2)} hours"
     elif elapsed_time > 60:       
         return f"{round(elapsed_time/60, ndigits=2)} minutes" 
     else:
@@ -0,0 +1,161 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the CC-BY-SA-4.0 license.
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+# The folder of the extracted texts, relative to the application folder like LLM_FOLDER and DOCUMENT_FOLDER;
+# they are kept for the whole life of the documents
+EXTRACTION_CACHE_FOLDER = os.path.join(APP_DIR, os.getenv("EXTRACTION_CACHE_FOLDER", "extraction_cache"))
+# The number of the documents whose extracted texts are kept in memory
+EXTRACTION_MEMORY_SIZE = 32
+# The version of the cached extraction; a new version ignores the old cache files
+EXTRACTION_CACHE_VERSION = 1
+HASH_CHUNK_SIZE = 1024 * 1024
+# The name of the PDF text extractor (PyPDFLoader) in the cache
+PDF_EXTRACTOR_NAME = "pypdf"
+
+
+class ExtractionCache:
+    """
+    Persistent cache of the texts extracted from the documents, keyed by the SHA-256 of the document content
+    and the extractor name, so a document is parsed once by an extractor: for its analysis, its re-indexing
+    and the features of the viewer.
+
+    The cached document is the list of its pages: {"text": page text, "offset": offset of the page in the document text}.
+    """
+
+    def __init__(self, cache_folder: str = EXTRACTION_CACHE_FOLDER):
+        self.cache_folder = cache_folder
+        self.lock = threading.Lock()
+        # The content hash per (file path, size, modification time): a file is not hashed again till it changes
+        self.file_hashes: Dict[Tuple[str, int, int], str] = {}
+        self.documents: "OrderedDict[Tuple[str, str], List[Dict]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_file_key(file_path: str) -> Tuple[str, int, int]:
+        file_stat = os.stat(file_path)
+        return (os.path.abspath(file_path), file_stat.st_size, file_stat.st_mtime_ns)
+
+    def get_content_hash(self, file_path: str) -> str:
+        file_key = self.get_file_key(file_path)
+        with self.lock:
+            content_hash = self.file_hashes.get(file_key)
+        if content_hash is None:
+            digest = hashlib.sha256()
+            with open(file_path, "rb") as file:
+                for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+            content_hash = digest.hexdigest()
+            with self.lock:
+                self.file_hashes[file_key] = content_hash
+        return content_hash
+
+    def get_cache_path(self, content_hash: str, extractor_name: str) -> str:
+        return os.path.join(self.cache_folder, content_hash[:2], f"{content_hash}.{extractor_name}.json")
+
+    def get_pages(self, file_path: str, extractor_name: str, extract: Callable[[str], List[str]]) -> List[Dict]:
+        """
+        Returns the cached pages of the document; the document is parsed by 'extract',
+        returning the text per page, only if it was not parsed by the extractor yet.
+        """
+        content_hash = self.get_content_hash(file_path)
+        pages = self.read_pages(content_hash, extractor_name)
+        if pages is not None:
+            return pages
+
+        with self.lock:
+            self.misses += 1
+        pages = []
+        offset = 0
+        for text in extract(file_path):
+            pages.append({"text": text, "offset": offset})
+            offset += len(text)
+        self.write_pages(content_hash, extractor_name, pages)
+        return pages
+
+    def get_cached_pages(self, file_path: str, extractor_name: str, content_hash: str = None) -> Optional[List[Dict]]:
+        """
+        Returns the cached pages of the document without parsing it: None if it was not parsed yet.
+        The document is hashed unless its content hash is known, e.g. from the path of the stored document.
+        """
+        return self.read_pages(content_hash or self.get_content_hash(file_path), extractor_name)
+
+    def find_page(self, file_path: str, extractor_name: str, text: str, content_hash: str = None) -> Optional[int]:
+        """Finds the text in the cached pages of the document ignoring the whitespace: returns the page index."""
+        text = " ".join(text.split())
+        if not text:
+            return None
+        pages = self.get_cached_pages(file_path, extractor_name, content_hash)
+        for page_index, page in enumerate(pages or []):
+            if text in " ".join(page["text"].split()):
+                return page_index
+        return None
+
+    def read_pages(self, content_hash: str, extractor_name: str) -> Optional[List[Dict]]:
+        key = (content_hash, extractor_name)
+        with self.lock:
+            pages = self.documents.get(key)
+            if pages is not None:
+                self.documents.move_to_end(key)
+                self.hits += 1
+                return pages
+        cache_path = self.get_cache_path(content_hash, extractor_name)
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            with open(cache_path, "r", encoding="utf-8") as file:
+                cached_document = json.load(file)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring the broken extraction cache '{cache_path}': {e}")
+            return None
+        if cached_document.get("version") != EXTRACTION_CACHE_VERSION:
+            return None
+        pages = cached_document["pages"]
+        with self.lock:
+            self.hits += 1
+            self.remember_pages(key, pages)
+        return pages
+
+    def write_pages(self, content_hash: str, extractor_name: str, pages: List[Dict]):
+        cache_path = self.get_cache_path(content_hash, extractor_name)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # The cache file is replaced atomically: a concurrent reader never sees a partial file
+        file_handle, temp_path = tempfile.mkstemp(prefix=".extraction-", dir=os.path.dirname(cache_path))
+        try:
+            with os.fdopen(file_handle, "w", encoding="utf-8") as file:
+                json.dump({"version": EXTRACTION_CACHE_VERSION, "pages": pages}, file)
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            logging.warning(f"Failed to save the extraction cache '{cache_path}': {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        with self.lock:
+            self.remember_pages((content_hash, extractor_name), pages)
+
+    def remember_pages(self, key: Tuple[str, str], pages: List[Dict]):
+        # Called with the lock
+        self.documents[key] = pages
+        self.documents.move_to_end(key)
+        if len(self.documents) > EXTRACTION_MEMORY_SIZE:
+            self.documents.popitem(last=False)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {"documents": len(self.documents), "hits": self.hits, "misses": self.misses}
+
+
+# Shared by the parsing threads of the ingestion and the viewer
+extraction_cache = ExtractionCache()
+
+
+def get_extraction_cache() -> ExtractionCache:
+    return extraction_cache
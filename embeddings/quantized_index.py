@@ -0,0 +1,266 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the CC-BY-SA-4.0 license.
+import json
+import math
+import os
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from embeddings.vectorstore_backends import get_vector_space, NumpyIndex, VectorIndex, VECTOR_SPACES
+
+QUANTIZATION_MODES = ['int8', 'pq']
+# PQ: the number of the sub-vectors of a vector, one byte code per sub-vector (768 dimensions -> 96 bytes);
+# it is reduced to a divisor of the dimensions
+PQ_SUBVECTORS = 96
+PQ_CENTROIDS = 256
+KMEANS_ITERATIONS = 10
+# The number of the vectors training the quantizer; the smaller collections are searched exactly
+TRAINING_SAMPLE_SIZE = 20000
+# The number of the candidates per requested chunk re-ranked with the full-precision vectors
+RERANK_FACTOR = 10
+# The number of rows scored at once: bounds the memory of a search
+SEARCH_BLOCK_ROWS = 65536
+INDEX_META_FILE = "quantized_index.json"
+INDEX_ARRAY_FILES = ["quantized_rows.npy", "quantized_codes.npy", "quantized_norms.npy", "quantized_tables.npy"]
+
+
+def kmeans(vectors: np.ndarray, centroids_count: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """Lloyd's k-means: returns the centroids of the vectors."""
+    random_state = np.random.default_rng(seed)
+    centroids = vectors[random_state.choice(len(vectors), size=centroids_count, replace=len(vectors) < centroids_count)].copy()
+    for _ in range(iterations):
+        assignments = assign(vectors, centroids)
+        for centroid_index in range(centroids_count):
+            members = vectors[assignments == centroid_index]
+            if len(members):
+                centroids[centroid_index] = members.mean(axis=0)
+    return centroids
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # argmin ||v - c||^2 = argmin ||c||^2 - 2 v.c
+    return np.argmin((centroids * centroids).sum(axis=1)[None, :] - 2.0 * vectors @ centroids.T, axis=1)
+
+
+class QuantizedIndex:
+    """
+    The compressed index of the embeddings by the integer row of their chunk:
+    - 'int8': the scalar quantization per dimension, 1 byte per dimension (4x smaller than float32);
+    - 'pq': the product quantization, 1 byte per sub-vector, searched by the asymmetric distance tables.
+
+    The distances are approximate in the vector space of the collection; the cosine space indexes the normalized vectors.
+    """
+
+    def __init__(self, mode: str, dimensions: int, pq_subvectors: int = PQ_SUBVECTORS, space: str = 'l2'):
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"Unsupported quantization '{mode}': {QUANTIZATION_MODES}")
+        if space not in VECTOR_SPACES:
+            raise ValueError(f"Unsupported vector space '{space}': {VECTOR_SPACES}")
+        if mode == 'pq' and dimensions % pq_subvectors != 0:
+            raise ValueError(f"The {dimensions} dimensions cannot be split into {pq_subvectors} sub-vectors")
+        self.mode = mode
+        self.dimensions = dimensions
+        self.pq_subvectors = pq_subvectors
+        self.space = space
+        self.scales = None
+        self.centroids = None
+        width = dimensions if mode == 'int8' else pq_subvectors
+        self.rows = np.zeros(0, dtype=np.int64)
+        self.codes = np.zeros((0, width), dtype=np.int8 if mode == 'int8' else np.uint8)
+        self.norms = np.zeros(0, dtype=np.float32)
+        # The (rows, codes, norms) added since the last search: they are concatenated once
+        self.pending = []
+
+    def prepare(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.space == 'cosine':
+            vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+        return vectors
+
+    def train(self, sample: np.ndarray):
+        sample = self.prepare(sample)
+        if self.mode == 'int8':
+            self.scales = np.maximum(np.abs(sample).max(axis=0), 1e-12).astype(np.float32) / 127.0
+        else:
+            sub_dimensions = self.dimensions // self.pq_subvectors
+            self.centroids = np.stack([
+                kmeans(sample[:, index * sub_dimensions:(index + 1) * sub_dimensions], PQ_CENTROIDS, seed=index)
+                for index in range(self.pq_subvectors)
+            ]).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        if self.mode == 'int8':
+            return np.clip(np.round(vectors / self.scales), -127, 127).astype(np.int8)
+        sub_dimensions = self.dimensions // self.pq_subvectors
+        return np.stack([
+            assign(vectors[:, index * sub_dimensions:(index + 1) * sub_dimensions], self.centroids[index])
+            for index in range(self.pq_subvectors)
+        ], axis=1).astype(np.uint8)
+
+    def get_rows(self) -> np.ndarray:
+        return np.concatenate([self.rows] + [rows for rows, _, _ in self.pending])
+
+    def consolidate(self):
+        if self.pending:
+            self.rows = np.concatenate([self.rows] + [rows for rows, _, _ in self.pending])
+            self.codes = np.concatenate([self.codes] + [codes for _, codes, _ in self.pending])
+            self.norms = np.concatenate([self.norms] + [norms for _, _, norms in self.pending])
+            self.pending = []
+
+    def add(self, rows: np.ndarray, vectors: np.ndarray):
+        """Adds the vectors; the vector of an existing row is replaced."""
+        rows = np.asarray(rows, dtype=np.int64)
+        vectors = self.prepare(vectors)
+        if len(self) and np.isin(rows, self.get_rows()).any():
+            self.remove(rows)
+        self.pending.append((rows, self.encode(vectors), np.linalg.norm(vectors, axis=1).astype(np.float32)))
+
+    def remove(self, rows: np.ndarray):
+        self.consolidate()
+        kept = ~np.isin(self.rows, rows)
+        self.rows, self.codes, self.norms = self.rows[kept], self.codes[kept], self.norms[kept]
+
+    def __len__(self) -> int:
+        return len(self.rows) + sum(len(rows) for rows, _, _ in self.pending)
+
+    def memory_bytes(self) -> int:
+        self.consolidate()
+        tables = self.scales if self.mode == 'int8' else self.centroids
+        return self.rows.nbytes + self.codes.nbytes + self.norms.nbytes + (tables.nbytes if tables is not None else 0)
+
+    def score_rows(self, query: np.ndarray, start: int, end: int) -> np.ndarray:
+        """Returns the approximate distances of the rows to the prepared query."""
+        if self.mode == 'int8':
+            dot = (self.codes[start:end].astype(np.float32) * self.scales) @ query
+            if self.space != 'l2':
+                return 1.0 - dot
+            block_norms = self.norms[start:end]
+            return block_norms * block_norms - 2.0 * dot + float(query @ query)
+        # Asymmetric distance: the distances of the query's sub-vectors to all centroids, summed by the codes
+        sub_dimensions = self.dimensions // self.pq_subvectors
+        query_parts = query.reshape(self.pq_subvectors, sub_dimensions)
+        if self.space == 'l2':
+            tables = ((self.centroids - query_parts[:, None, :]) ** 2).sum(axis=2)
+        else:
+            tables = -(self.centroids * query_parts[:, None, :]).sum(axis=2)
+        scores = tables[np.arange(self.pq_subvectors)[None, :], self.codes[start:end]].sum(axis=1)
+        return scores if self.space == 'l2' else 1.0 + scores
+
+    def search(self, query: np.ndarray, k: int, allowed_rows: Optional[set] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the rows of the k closest vectors with their approximate distances, the closest first."""
+        self.consolidate()
+        query = self.prepare(query)
+        allowed = np.fromiter(allowed_rows, dtype=np.int64, count=len(allowed_rows)) if allowed_rows is not None else None
+        best_rows = np.zeros(0, dtype=np.int64)
+        best_scores = np.zeros(0, dtype=np.float32)
+        for start in range(0, len(self.rows), SEARCH_BLOCK_ROWS):
+            end = min(start + SEARCH_BLOCK_ROWS, len(self.rows))
+            block_rows = self.rows[start:end]
+            scores = self.score_rows(query, start, end)
+            if allowed is not None:
+                is_allowed = np.isin(block_rows, allowed)
+                block_rows, scores = block_rows[is_allowed], scores[is_allowed]
+            if len(scores) == 0:
+                continue
+            top = np.argpartition(scores, min(k, len(scores)) - 1)[:k]
+            best_rows = np.concatenate([best_rows, block_rows[top]])
+            best_scores = np.concatenate([best_scores, scores[top]])
+            order = np.argsort(best_scores)[:k]
+            best_rows, best_scores = best_rows[order], best_scores[order]
+        return best_rows, best_scores
+
+    def save(self, directory: str):
+        self.consolidate()
+        arrays = [self.rows, self.codes, self.norms, self.scales if self.mode == 'int8' else self.centroids]
+        for file_name, array in zip(INDEX_ARRAY_FILES, arrays):
+            # Save aside, then replace: the memory-mapped file of the loaded index is not overwritten
+            index_path = os.path.join(directory, file_name)
+            with open(index_path + ".tmp", "wb") as file:
+                np.save(file, array)
+            os.replace(index_path + ".tmp", index_path)
+        with open(os.path.join(directory, INDEX_META_FILE), "w", encoding="utf-8") as file:
+            json.dump({"mode": self.mode, "dimensions": self.dimensions, "pq_subvectors": self.pq_subvectors, "space": self.space}, file)
+
+    @classmethod
+    def load(cls, directory: str) -> "QuantizedIndex":
+        with open(os.path.join(directory, INDEX_META_FILE), "r", encoding="utf-8") as file:
+            meta = json.load(file)
+        index = cls(mode=meta["mode"], dimensions=meta["dimensions"], pq_subvectors=meta["pq_subvectors"], space=meta["space"])
+        # The codes are memory-mapped: the index opens without reading them; they are read into memory by the first change
+        index.rows, index.codes, index.norms, tables = [
+            np.load(os.path.join(directory, file_name), mmap_mode="r" if file_name != INDEX_ARRAY_FILES[-1] else None)
+            for file_name in INDEX_ARRAY_FILES
+        ]
+        if index.mode == 'int8':
+            index.scales = tables
+        else:
+            index.centroids = tables
+        return index
+
+
+class QuantizedVectorIndex(VectorIndex):
+    """
+    The quantized index of the local collection ('int8' and 'pq' backends): the compressed codes are searched in memory
+    for 'k * RERANK_FACTOR' candidates, which the collection re-ranks on their full-precision vectors stored in SQLite.
+
+    The vectors are searched exactly till the collection has TRAINING_SAMPLE_SIZE vectors ('quantization:sample_size'
+    of the collection metadata); then the quantizer is trained on them, and the later vectors are encoded by it.
+    The collection rebuilding the index retrains the quantizer.
+    """
+    rerank_factor = RERANK_FACTOR
+
+    def __init__(self, mode: str, dimensions: int, collection_metadata: Dict[str, Any] = None):
+        collection_metadata = collection_metadata or {}
+        self.mode = mode
+        self.dimensions = dimensions
+        self.space = get_vector_space(collection_metadata)
+        self.sample_size = int(collection_metadata.get("quantization:sample_size", TRAINING_SAMPLE_SIZE))
+        self.pq_subvectors = math.gcd(dimensions, int(collection_metadata.get("pq:subvectors", PQ_SUBVECTORS)))
+        self.quantized_index = None
+        # The full-precision vectors added before the quantizer is trained
+        self.exact_index = NumpyIndex(dimensions, collection_metadata)
+
+    def add(self, rows: np.ndarray, vectors: np.ndarray):
+        if self.quantized_index is not None:
+            self.quantized_index.add(rows, vectors)
+            return
+        self.exact_index.add(rows, vectors)
+        if len(self.exact_index.rows) >= self.sample_size:
+            self.quantized_index = QuantizedIndex(self.mode, self.dimensions, self.pq_subvectors, self.space)
+            self.quantized_index.train(self.exact_index.vectors)
+            self.quantized_index.add(self.exact_index.rows, self.exact_index.vectors)
+            self.exact_index = None
+
+    @property
+    def active_index(self):
+        # Not by the truthiness: the emptied quantized index has no rows but stays trained
+        return self.quantized_index if self.quantized_index is not None else self.exact_index
+
+    def remove(self, rows: np.ndarray):
+        self.active_index.remove(rows)
+
+    def search(self, query: np.ndarray, k: int, allowed_rows: Optional[set] = None) -> Tuple[np.ndarray, np.ndarray]:
+        return self.active_index.search(query, k, allowed_rows)
+
+    def memory_bytes(self) -> int:
+        if self.quantized_index is not None:
+            return self.quantized_index.memory_bytes()
+        return self.exact_index.rows.nbytes + self.exact_index.vectors.nbytes
+
+    def save(self, directory: str):
+        if self.quantized_index is not None:
+            self.quantized_index.save(directory)
+        elif os.path.exists(os.path.join(directory, INDEX_META_FILE)):
+            # The exact vectors are rebuilt from the collection: the saved index of a former version is removed
+            os.remove(os.path.join(directory, INDEX_META_FILE))
+
+    def load(self, directory: str) -> bool:
+        if not os.path.exists(os.path.join(directory, INDEX_META_FILE)):
+            return False
+        quantized_index = QuantizedIndex.load(directory)
+        if (quantized_index.mode, quantized_index.dimensions, quantized_index.space) != (self.mode, self.dimensions, self.space):
+            return False
+        self.quantized_index = quantized_index
+        self.exact_index = None
+        return True
@@ -4,8 +4,9 @@ import glob
 from typing import List
 from langchain_core.documents.base import Document
 from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import TextSplitter
+from langchain.text_splitter import RecursiveCharacterTextSplitter, TextSplitter
 
+from embeddings.extraction_cache import get_extraction_cache, PDF_EXTRACTOR_NAME
 from .base_file_converter import BaseFileConverter
 from .file_type import FileType
 
@@ -28,8 +29,18 @@ class PdfConverter(BaseFileConverter):
         Returns:
         - (List[Document]): the list of unstructured PDF content
         """
-        loader = PyPDFLoader(file_path)
-        return loader.load_and_split()
+        # The PDF is parsed once per content: the re-indexing takes the page texts from the extraction cache
+        pages = get_extraction_cache().get_pages(file_path=file_path, extractor_name=PDF_EXTRACTOR_NAME, extract=self.extract_pages)
+        documents = [
+            Document(page_content=page["text"], metadata={"source": file_path, "page": page_index}) 
+            for page_index, page in enumerate(pages)
+        ]
+        # The same splitting as PyPDFLoader.load_and_split()
+        return RecursiveCharacterTextSplitter().split_documents(documents)
+
+    @staticmethod
+    def extract_pages(file_path: str) -> List[str]:
+        return [document.page_content for document in PyPDFLoader(file_path).load()]
 
     def load_and_split_files(self, dir_path: str, file_pattern: str) -> List[Document]:
         """
@@ -0,0 +1,567 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the CC-BY-SA-4.0 license.
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from embeddings.embeddings_constants import DEFAULT_COLLECTION_NAME, get_chroma_settings
+
+# The vectorstore backends: 'chroma' - the Chroma server embedded in the process,
+# 'hnswlib' - the in-process HNSW index, 'numpy' - the exact brute-force search for small collections,
+# 'int8' and 'pq' - the quantized in-memory index re-ranked on the full-precision vectors, for large collections
+VECTORSTORE_BACKENDS = ['chroma', 'hnswlib', 'numpy', 'int8', 'pq']
+DEFAULT_VECTORSTORE_BACKEND = 'chroma'
+# The line of META-INF/MANIFEST.MF selecting the backend of the vectorstore
+MANIFEST_BACKEND_KEY = 'Vectorstore-Backend'
+MANIFEST_MODEL_NAME_KEY = 'Embedding-Model-Name'
+# The local backends keep the chunks (ids, texts, metadata and embeddings) in this SQLite file;
+# their vector index is a cache rebuilt from it when it is missing or stale
+LOCAL_STORE_FILE = "chunks.sqlite"
+LOCAL_INDEX_FILE = "index.bin"
+LOCAL_INDEX_META_FILE = "index.json"
+# The HNSW parameters when the collection metadata does not set them
+HNSW_M = 16
+HNSW_CONSTRUCTION_EF = 200
+HNSW_SEARCH_EF = 50
+HNSW_INITIAL_CAPACITY = 1024
+# The distances of the collection set by its 'hnsw:space' metadata as in Chroma: the squared l2 distance (default),
+# the cosine distance (1 - cosine similarity) or the inner product distance (1 - inner product)
+VECTOR_SPACES = ['l2', 'cosine', 'ip']
+DEFAULT_VECTOR_SPACE = 'l2'
+
+
+def get_manifest_path(persist_directory: str) -> str:
+    return os.path.join(persist_directory, 'META-INF', 'MANIFEST.MF')
+
+
+def read_manifest(persist_directory: str) -> Dict[str, str]:
+    """Returns the 'Key: value' lines of the vectorstore's MANIFEST.MF; empty if there is none."""
+    manifest = {}
+    if persist_directory is None:
+        return manifest
+    manifest_file_path = get_manifest_path(persist_directory)
+    if os.path.exists(manifest_file_path):
+        with open(manifest_file_path, 'r') as file:
+            for line in file:
+                key, separator, value = line.partition(':')
+                if separator:
+                    manifest[key.strip()] = value.strip()
+    return manifest
+
+
+def get_vectorstore_backend(persist_directory: str) -> str:
+    """Returns the backend set in the vectorstore's manifest; Chroma for the vectorstores created before the backends."""
+    backend = read_manifest(persist_directory).get(MANIFEST_BACKEND_KEY) or DEFAULT_VECTORSTORE_BACKEND
+    if backend not in VECTORSTORE_BACKENDS:
+        raise ValueError(f"Unsupported vectorstore backend '{backend}' in the manifest of '{persist_directory}': {VECTORSTORE_BACKENDS}")
+    return backend
+
+
+def set_vectorstore_backend(persist_directory: str, backend: str):
+    """Sets the backend line of the vectorstore's manifest, keeping its other lines."""
+    manifest_file_path = get_manifest_path(persist_directory)
+    os.makedirs(os.path.dirname(manifest_file_path), exist_ok=True)
+    lines = []
+    if os.path.exists(manifest_file_path):
+        with open(manifest_file_path, 'r') as file:
+            lines = [line.rstrip('\n') for line in file if line.partition(':')[0].strip() != MANIFEST_BACKEND_KEY]
+    lines = [line for line in lines if line.strip()] + [f"{MANIFEST_BACKEND_KEY}: {backend}"]
+    with open(manifest_file_path, 'w') as file:
+        file.write("\n".join(lines) + "\n")
+
+
+def get_vector_space(collection_metadata: Dict[str, Any] = None) -> str:
+    space = (collection_metadata or {}).get("hnsw:space", DEFAULT_VECTOR_SPACE)
+    if space not in VECTOR_SPACES:
+        raise ValueError(f"Unsupported vector space '{space}': {VECTOR_SPACES}")
+    return space
+
+
+def get_distances(vectors: np.ndarray, query: np.ndarray, space: str) -> np.ndarray:
+    """Returns the exact distances of the vectors to the query in the vector space."""
+    if space == 'l2':
+        difference = vectors - query
+        return np.einsum('ij,ij->i', difference, difference)
+    dot = vectors @ query
+    if space == 'cosine':
+        dot = dot / np.maximum(np.linalg.norm(vectors, axis=1) * np.linalg.norm(query), 1e-12)
+    return 1.0 - dot
+
+
+class VectorIndex(ABC):
+    """The index of the vectors by the integer row of their chunk; the distances are those of the collection's space, as in Chroma."""
+    # The number of the candidates per requested chunk found by the approximate distances of the index;
+    # if it is above 1, the collection re-ranks them on their full-precision vectors
+    rerank_factor = 1
+
+    @abstractmethod
+    def add(self, rows: np.ndarray, vectors: np.ndarray):
+        """Adds the vectors; the vector of an existing row is replaced."""
+        pass
+
+    @abstractmethod
+    def remove(self, rows: np.ndarray):
+        pass
+
+    @abstractmethod
+    def search(self, query: np.ndarray, k: int, allowed_rows: Optional[set] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the rows of the k closest vectors and their distances, the closest first; k does not exceed the stored vectors."""
+        pass
+
+    def save(self, directory: str):
+        pass
+
+    def load(self, directory: str) -> bool:
+        """Loads the saved index; returns False if it must be rebuilt."""
+        return False
+
+
+class NumpyIndex(VectorIndex):
+    """The exact search over all vectors held in memory."""
+
+    def __init__(self, dimensions: int, collection_metadata: Dict[str, Any] = None):
+        self.space = get_vector_space(collection_metadata)
+        self.vectors = np.zeros((0, dimensions), dtype=np.float32)
+        self.rows = np.zeros(0, dtype=np.int64)
+        self.positions: Dict[int, int] = {}
+
+    def add(self, rows: np.ndarray, vectors: np.ndarray):
+        new_rows = []
+        new_vectors = []
+        for row, vector in zip(rows, vectors):
+            position = self.positions.get(int(row))
+            if position is None:
+                new_rows.append(int(row))
+                new_vectors.append(vector)
+            else:
+                self.vectors[position] = vector
+        if new_rows:
+            for offset, row in enumerate(new_rows):
+                self.positions[row] = len(self.rows) + offset
+            self.rows = np.concatenate([self.rows, np.asarray(new_rows, dtype=np.int64)])
+            self.vectors = np.concatenate([self.vectors, np.asarray(new_vectors, dtype=np.float32)])
+
+    def remove(self, rows: np.ndarray):
+        kept = ~np.isin(self.rows, rows)
+        self.rows = self.rows[kept]
+        self.vectors = self.vectors[kept]
+        self.positions = {int(row): position for position, row in enumerate(self.rows)}
+
+    def search(self, query: np.ndarray, k: int, allowed_rows: Optional[set] = None) -> Tuple[np.ndarray, np.ndarray]:
+        rows, vectors = self.rows, self.vectors
+        if allowed_rows is not None:
+            allowed = np.isin(rows, np.fromiter(allowed_rows, dtype=np.int64, count=len(allowed_rows)))
+            rows, vectors = rows[allowed], vectors[allowed]
+        if len(rows) == 0 or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        distances = get_distances(vectors, query, self.space)
+        k = min(k, len(rows))
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+        return rows[top], distances[top]
+
+
+class HnswlibIndex(VectorIndex):
+    """
+    The in-process HNSW index (hnswlib, installed with Chroma); it is tuned by the 'hnsw:space', 'hnsw:M',
+    'hnsw:construction_ef' and 'hnsw:search_ef' collection metadata as the Chroma index.
+    """
+
+    def __init__(self, dimensions: int, collection_metadata: Dict[str, Any] = None):
+        import hnswlib
+
+        collection_metadata = collection_metadata or {}
+        self.dimensions = dimensions
+        self.space = get_vector_space(collection_metadata)
+        self.search_ef = int(collection_metadata.get("hnsw:search_ef", HNSW_SEARCH_EF))
+        self.index = hnswlib.Index(space=self.space, dim=dimensions)
+        self.index.init_index(
+            max_elements=HNSW_INITIAL_CAPACITY,
+            ef_construction=int(collection_metadata.get("hnsw:construction_ef", HNSW_CONSTRUCTION_EF)),
+            M=int(collection_metadata.get("hnsw:M", HNSW_M)),
+            allow_replace_deleted=True
+        )
+
+    def add(self, rows: np.ndarray, vectors: np.ndarray):
+        required = self.index.element_count + len(rows)
+        if required > self.index.get_max_elements():
+            # Grow geometrically: resizing copies the index
+            self.index.resize_index(max(required, 2 * self.index.get_max_elements()))
+        # The rows are never reused, so the deleted slots are safely recycled
+        self.index.add_items(vectors, rows, replace_deleted=True)
+
+    def remove(self, rows: np.ndarray):
+        for row in rows:
+            self.index.mark_deleted(int(row))
+
+    def search(self, query: np.ndarray, k: int, allowed_rows: Optional[set] = None) -> Tuple[np.ndarray, np.ndarray]:
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        self.index.set_ef(max(self.search_ef, k))
+        search_filter = (lambda row: row in allowed_rows) if allowed_rows is not None else None
+        labels, distances = self.index.knn_query(query.reshape(1, -1), k=k, filter=search_filter)
+        return labels[0].astype(np.int64), distances[0]
+
+    def save(self, directory: str):
+        index_path = os.path.join(directory, LOCAL_INDEX_FILE)
+        # Save aside, then replace: a crash leaves the previous index
+        self.index.save_index(index_path + ".tmp")
+        os.replace(index_path + ".tmp", index_path)
+
+    def load(self, directory: str) -> bool:
+        index_path = os.path.join(directory, LOCAL_INDEX_FILE)
+        if not os.path.exists(index_path):
+            return False
+        import hnswlib
+
+        self.index = hnswlib.Index(space=self.space, dim=self.dimensions)
+        self.index.load_index(index_path, allow_replace_deleted=True)
+        return True
+
+
+class LocalCollection:
+    """
+    The collection of a local backend with the API of the Chroma collection used by the application and the utilities
+    ('count', 'get', 'add', 'upsert', 'delete' and 'query'), so they work with any backend.
+    The chunks are stored in SQLite at once; the vector index is saved by 'persist()'.
+    """
+
+    def __init__(self, directory: Optional[str], name: str, index_class: Callable[..., VectorIndex], metadata: Dict[str, Any] = None):
+        self.directory = directory
+        self.name = name
+        self.index_class = index_class
+        self.lock = threading.RLock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(
+            os.path.join(directory, LOCAL_STORE_FILE) if directory is not None else ":memory:",
+            check_same_thread=False
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (row INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT NOT NULL UNIQUE, "
+            "document TEXT, metadata TEXT, embedding BLOB NOT NULL)"
+        )
+        self.connection.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+        self.connection.commit()
+        stored_metadata = self.get_setting("metadata")
+        if stored_metadata is None:
+            self.metadata = metadata or {}
+            # An unsupported vector space is rejected before the collection metadata is stored
+            get_vector_space(self.metadata)
+            self.set_setting("metadata", json.dumps(self.metadata))
+            self.connection.commit()
+        else:
+            self.metadata = json.loads(stored_metadata)
+        self.index = None
+        self.open_index()
+
+    def get_setting(self, key: str) -> Optional[str]:
+        found = self.connection.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return found[0] if found else None
+
+    def set_setting(self, key: str, value: str):
+        self.connection.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
+
+    def get_version(self) -> int:
+        return int(self.get_setting("version") or 0)
+
+    def bump_version(self):
+        # Every change gets a new version: the saved index of another version is stale
+        self.set_setting("version", str(self.get_version() + 1))
+
+    def open_index(self):
+        dimensions = self.get_setting("dimensions")
+        if dimensions is None:
+            return
+        self.index = self.index_class(int(dimensions), self.metadata)
+        if self.directory is not None and os.path.exists(os.path.join(self.directory, LOCAL_INDEX_META_FILE)):
+            with open(os.path.join(self.directory, LOCAL_INDEX_META_FILE), "r") as file:
+                index_version = json.load(file).get("version")
+            if index_version == self.get_version() and self.index.load(self.directory):
+                return
+        logging.info(f"Building the vector index of the collection '{self.name}' ...")
+        for rows, vectors in self.iter_vectors():
+            self.index.add(rows, vectors)
+
+    def iter_vectors(self, batch_size: int = 10000):
+        cursor = self.connection.execute("SELECT row, embedding FROM chunks ORDER BY row")
+        while True:
+            found = cursor.fetchmany(batch_size)
+            if not found:
+                return
+            yield (np.asarray([row for row, _ in found], dtype=np.int64),
+                   np.stack([np.frombuffer(embedding, dtype=np.float32) for _, embedding in found]))
+
+    def count(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    @staticmethod
+    def get_where_clause(where: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+        """Supports the equality of the metadata values: {'source': '/path/file.pdf'}."""
+        if not where:
+            return "", []
+        conditions = []
+        parameters = []
+        for key, value in where.items():
+            if key.startswith('$') or isinstance(value, (dict, list)):
+                raise ValueError(f"The local vectorstore backends support only the metadata equality filters: {where}")
+            conditions.append(f"json_extract(metadata, '$.\"{key}\"') = ?")
+            parameters.append(value)
+        return " WHERE " + " AND ".join(conditions), parameters
+
+    def get(self, ids: List[str] = None, where: Dict[str, Any] = None, limit: int = None, offset: int = None,
+            include: List[str] = None) -> Dict[str, Any]:
+        if include is None:
+            include = ['documents', 'metadatas']
+        sql, parameters = self.get_where_clause(where)
+        if ids is not None:
+            ids = list(ids)
+            sql += (" AND " if sql else " WHERE ") + f"id IN ({','.join('?' * len(ids))})"
+            parameters += ids
+        sql += " ORDER BY row"
+        if limit is not None or offset is not None:
+            sql += " LIMIT ? OFFSET ?"
+            parameters += [limit if limit is not None else -1, offset or 0]
+        with self.lock:
+            found = self.connection.execute(f"SELECT id, document, metadata, embedding FROM chunks{sql}", parameters).fetchall() if ids != [] else []
+        return {
+            'ids': [chunk_id for chunk_id, _, _, _ in found],
+            'documents': [document for _, document, _, _ in found] if 'documents' in include else None,
+            'metadatas': [json.loads(metadata) if metadata else None for _, _, metadata, _ in found] if 'metadatas' in include else None,
+            'embeddings': [np.frombuffer(embedding, dtype=np.float32).tolist() for _, _, _, embedding in found] if 'embeddings' in include else None
+        }
+
+    def write(self, ids: List[str], embeddings: List[List[float]], metadatas: List[dict], documents: List[str], replace: bool):
+        ids = list(ids)
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        metadatas = metadatas if metadatas is not None else [None] * len(ids)
+        documents = documents if documents is not None else [None] * len(ids)
+        with self.lock:
+            if self.index is None:
+                self.set_setting("dimensions", str(vectors.shape[1]))
+                self.index = self.index_class(vectors.shape[1], self.metadata)
+            existing_rows = dict(self.connection.execute(
+                f"SELECT id, row FROM chunks WHERE id IN ({','.join('?' * len(ids))})", ids
+            ).fetchall())
+            written_rows = []
+            written_vectors = []
+            for position, chunk_id in enumerate(ids):
+                values = (documents[position], json.dumps(metadatas[position]) if metadatas[position] else None, vectors[position].tobytes())
+                if chunk_id in existing_rows:
+                    if not replace:
+                        # As Chroma: the existing chunk is kept
+                        logging.warning(f"The chunk '{chunk_id}' already exists in the collection '{self.name}'; it is not added")
+                        continue
+                    self.connection.execute("UPDATE chunks SET document = ?, metadata = ?, embedding = ? WHERE row = ?", values + (existing_rows[chunk_id],))
+                    row = existing_rows[chunk_id]
+                else:
+                    row = self.connection.execute("INSERT INTO chunks (id, document, metadata, embedding) VALUES (?, ?, ?, ?)", (chunk_id,) + values).lastrowid
+                    existing_rows[chunk_id] = row
+                written_rows.append(row)
+                written_vectors.append(vectors[position])
+            if written_rows:
+                self.index.add(np.asarray(written_rows, dtype=np.int64), np.stack(written_vectors))
+            self.bump_version()
+            self.connection.commit()
+
+    def add(self, ids: List[str], embeddings: List[List[float]], metadatas: List[dict] = None, documents: List[str] = None):
+        self.write(ids, embeddings, metadatas, documents, replace=False)
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]], metadatas: List[dict] = None, documents: List[str] = None):
+        self.write(ids, embeddings, metadatas, documents, replace=True)
+
+    def delete(self, ids: List[str] = None, where: Dict[str, Any] = None):
+        sql, parameters = self.get_where_clause(where)
+        if ids is not None:
+            ids = list(ids)
+            sql += (" AND " if sql else " WHERE ") + f"id IN ({','.join('?' * len(ids))})"
+            parameters += ids
+        with self.lock:
+            rows = [row for row, in self.connection.execute(f"SELECT row FROM chunks{sql}", parameters).fetchall()]
+            if not rows:
+                return
+            self.connection.execute(f"DELETE FROM chunks WHERE row IN ({','.join('?' * len(rows))})", rows)
+            self.index.remove(np.asarray(rows, dtype=np.int64))
+            self.bump_version()
+            self.connection.commit()
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10, where: Dict[str, Any] = None,
+              include: List[str] = None) -> Dict[str, Any]:
+        if include is None:
+            include = ['documents', 'metadatas', 'distances']
+        results = {'ids': [], 'documents': [], 'metadatas': [], 'distances': [], 'embeddings': []}
+        with self.lock:
+            allowed_rows = None
+            if where:
+                sql, parameters = self.get_where_clause(where)
+                allowed_rows = {row for row, in self.connection.execute(f"SELECT row FROM chunks{sql}", parameters).fetchall()}
+            # HNSW fails to return more vectors than it stores
+            stored_count = self.count() if allowed_rows is None else len(allowed_rows)
+            n_results = min(n_results, stored_count)
+            for query_embedding in query_embeddings:
+                query = np.asarray(query_embedding, dtype=np.float32)
+                if self.index is None:
+                    rows, distances = [], []
+                else:
+                    rows, distances = self.index.search(query, min(n_results * self.index.rerank_factor, stored_count), allowed_rows)
+                found = {}
+                if len(rows):
+                    rows = [int(row) for row in rows]
+                    found = {row: values for row, *values in self.connection.execute(
+                        f"SELECT row, id, document, metadata, embedding FROM chunks WHERE row IN ({','.join('?' * len(rows))})", rows
+                    ).fetchall()}
+                hits = [(found[row], float(distance)) for row, distance in zip(rows, distances) if row in found]
+                if hits and self.index.rerank_factor > 1:
+                    # The candidates are re-ranked on their exact distances
+                    vectors = np.stack([np.frombuffer(embedding, dtype=np.float32) for (_, _, _, embedding), _ in hits])
+                    exact_distances = get_distances(vectors, query, get_vector_space(self.metadata))
+                    hits = [(hits[position][0], float(exact_distances[position])) for position in np.argsort(exact_distances)[:n_results]]
+                results['ids'].append([chunk_id for (chunk_id, _, _, _), _ in hits])
+                results['documents'].append([document for (_, document, _, _), _ in hits])
+                results['metadatas'].append([json.loads(metadata) if metadata else None for (_, _, metadata, _), _ in hits])
+                results['distances'].append([distance for _, distance in hits])
+                results['embeddings'].append([np.frombuffer(embedding, dtype=np.float32).tolist() for (_, _, _, embedding), _ in hits])
+        return {key: (value if key == 'ids' or key in include else None) for key, value in results.items()}
+
+    def persist(self):
+        if self.directory is None or self.index is None:
+            return
+        with self.lock:
+            self.index.save(self.directory)
+            with open(os.path.join(self.directory, LOCAL_INDEX_META_FILE), "w") as file:
+                json.dump({"version": self.get_version()}, file)
+
+
+class LocalVectorStore(VectorStore):
+    """The LangChain vectorstore of the local backends; as Chroma, it exposes its collection as '_collection'."""
+
+    def __init__(self, collection: LocalCollection, embedding_function: Embeddings = None):
+        self._collection = collection
+        self._embedding_function = embedding_function
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self._embedding_function
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        self._collection.upsert(ids=ids, embeddings=self._embedding_function.embed_documents(texts), metadatas=metadatas, documents=texts)
+        return ids
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4, filter: Dict[str, Any] = None) -> List[Tuple[Document, float]]:
+        results = self._collection.query(query_embeddings=[embedding], n_results=k, where=filter)
+        return [
+            (Document(page_content=text or "", metadata=metadata or {}), distance)
+            for text, metadata, distance in zip(results['documents'][0], results['metadatas'][0], results['distances'][0])
+        ]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, filter: Dict[str, Any] = None, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_by_vector_with_score(embedding, k, filter=filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Dict[str, Any] = None, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding_function.embed_query(query), k, filter=filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Dict[str, Any] = None, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score(query, k, filter=filter)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        space = get_vector_space(self._collection.metadata)
+        if space == 'cosine':
+            return self._cosine_relevance_score_fn
+        if space == 'ip':
+            return self._max_inner_product_relevance_score_fn
+        return self._euclidean_relevance_score_fn
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        self._collection.delete(ids=ids)
+        return True
+
+    def persist(self):
+        self._collection.persist()
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None, **kwargs: Any) -> "LocalVectorStore":
+        # The in-process HNSW index unless the 'backend' keyword sets another local backend
+        docs_db = open_vector_store(
+            persist_directory=kwargs.get("persist_directory"),
+            collection_name=kwargs.get("collection_name"),
+            embedding=embedding,
+            backend=kwargs.get("backend") or 'hnswlib',
+            collection_metadata=kwargs.get("collection_metadata")
+        )
+        docs_db.add_texts(texts, metadatas, ids=kwargs.get("ids"))
+        return docs_db
+
+
+def open_chroma(persist_directory, collection_name, embedding, collection_metadata) -> VectorStore:
+    from langchain_community.vectorstores import Chroma
+
+    # Each vectorstore gets its own settings: Chroma sets the persist directory in them
+    return Chroma(
+        persist_directory=persist_directory,
+        collection_name=collection_name,
+        embedding_function=embedding,
+        collection_metadata=collection_metadata,
+        client_settings=get_chroma_settings().copy(),
+    )
+
+
+def get_local_opener(index_class: Callable[..., VectorIndex]) -> Callable[..., VectorStore]:
+    def open_local(persist_directory, collection_name, embedding, collection_metadata) -> VectorStore:
+        # A persist directory stores several collections as Chroma does
+        directory = os.path.join(persist_directory, collection_name) if persist_directory is not None else None
+        return LocalVectorStore(LocalCollection(directory, collection_name, index_class, metadata=collection_metadata), embedding)
+    return open_local
+
+
+def get_quantized_index(mode: str) -> Callable[..., VectorIndex]:
+    def create_index(dimensions: int, collection_metadata: Dict[str, Any] = None) -> VectorIndex:
+        # Imported on use: the quantized index extends VectorIndex of this module
+        from embeddings.quantized_index import QuantizedVectorIndex
+
+        return QuantizedVectorIndex(mode, dimensions, collection_metadata)
+    return create_index
+
+
+VECTORSTORE_OPENERS = {
+    'chroma': open_chroma,
+    'hnswlib': get_local_opener(HnswlibIndex),
+    'numpy': get_local_opener(NumpyIndex),
+    'int8': get_local_opener(get_quantized_index('int8')),
+    'pq': get_local_opener(get_quantized_index('pq')),
+}
+
+
+def open_vector_store(persist_directory: str, collection_name: str = None, embedding: Embeddings = None,
+                      backend: str = None, collection_metadata: Dict[str, Any] = None) -> VectorStore:
+    """
+    Opens the vectorstore in the persist directory with the backend of its manifest, or with the specified one.
+
+    Parameters:
+    - persist_directory (str): the vectorstore directory; if it is None, the vectorstore is not persisted
+    - collection_name (str): the collection name
+    - embedding (Embeddings): the embedding model; it is not needed to read or write the stored embeddings
+    - backend (str): one of VECTORSTORE_BACKENDS; by default, the manifest's one
+    - collection_metadata (Dict): the metadata of a new collection, e.g. the HNSW parameters
+
+    Returns:
+    - (VectorStore): the vectorstore; its '_collection' has the API of the Chroma collection
+    """
+    backend = backend or get_vectorstore_backend(persist_directory)
+    if backend not in VECTORSTORE_OPENERS:
+        raise ValueError(f"Unsupported vectorstore backend '{backend}': {VECTORSTORE_BACKENDS}")
+    return VECTORSTORE_OPENERS[backend](persist_directory, collection_name or DEFAULT_COLLECTION_NAME, embedding, collection_metadata)
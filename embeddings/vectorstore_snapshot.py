@@ -0,0 +1,300 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the CC-BY-SA-4.0 license.
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from langchain_community.vectorstores import Chroma
+
+from embeddings.embeddings_constants import DEFAULT_COLLECTION_NAME, BATCH_SIZE, get_chroma_settings
+from embeddings.embedding_database import iter_collection_batches
+from embeddings.vectorstore_backends import MANIFEST_MODEL_NAME_KEY, read_manifest as read_vectorstore_manifest
+from models.model_info import ModelInfo
+from models.models_constants import DEFAULT_MODEL_NAME
+
+# The snapshot of a vectorstore is a directory of the files read without parsing:
+# - embeddings.npy: the embedding matrix (float16, or int8 with the per-row scales in scales.npy), memory-mapped;
+# - norms.npy: the norms of the embeddings (float32), so the distances are computed without reading the rows twice;
+# - texts.bin / texts.idx.npy: the chunk texts in UTF-8 packed one after another and their offsets (n + 1);
+# - ids.bin / ids.idx.npy: the chunk ids in the same layout;
+# - metadata.bin / metadata.idx.npy: the chunk metadata as JSON objects in the same layout, empty where a chunk has none;
+# - MANIFEST.json: the collection, the embedding model, the dimensions and the SHA-256 of every file.
+
+SNAPSHOT_MANIFEST = "MANIFEST.json"
+SNAPSHOT_FORMAT_VERSION = 2
+SNAPSHOT_DTYPES = ['float16', 'int8']
+# The number of rows scored at once by the read-only query: bounds the memory of a query
+QUERY_BLOCK_ROWS = 65536
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def get_file_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def quantize(embeddings: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    if dtype == 'float16':
+        return embeddings.astype(np.float16), None
+    # Symmetric per-row int8 quantization: row = scale * int8 row
+    scales = np.abs(embeddings).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    return np.round(embeddings / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def write_packed_strings(file, values: List[str], offsets: List[int]):
+    for value in values:
+        encoded = value.encode('utf-8')
+        file.write(encoded)
+        offsets.append(offsets[-1] + len(encoded))
+
+
+def export_snapshot(docs_db: Chroma, snapshot_directory: str, dtype: str = 'float16', model_name: str = None,
+                    batch_size: int = BATCH_SIZE, persist_directory: str = None) -> Dict[str, Any]:
+    """
+    Exports the Chroma vectorstore to the snapshot directory by pages of the collection.
+
+    Parameters:
+    - docs_db (Chroma): the vectorstore
+    - snapshot_directory (str): the new directory of the snapshot; an existing directory must be empty
+    - dtype (str): the type of the stored embeddings: 'float16' or 'int8'
+    - model_name (str): the embedding model name; if not set, the one of the vectorstore's manifest or the default model
+    - batch_size (int): the number of chunks read at once
+    - persist_directory (str): the vectorstore directory with the manifest naming the embedding model of the vectorstore
+
+    Returns:
+    - (Dict): the manifest of the snapshot
+    """
+    if dtype not in SNAPSHOT_DTYPES:
+        raise ValueError(f"Unsupported snapshot type '{dtype}': {SNAPSHOT_DTYPES}")
+    # The files of another snapshot would be listed in the manifest with the exported ones
+    if os.path.exists(snapshot_directory) and os.listdir(snapshot_directory):
+        raise FileExistsError(f"The snapshot directory '{snapshot_directory}' is not empty")
+    collection = docs_db._collection
+    count = collection.count()
+    os.makedirs(snapshot_directory, exist_ok=True)
+    embeddings = None
+    scales = None
+    norms = np.zeros(count, dtype=np.float32)
+    text_offsets = [0]
+    id_offsets = [0]
+    metadata_offsets = [0]
+    row = 0
+    with open(os.path.join(snapshot_directory, "texts.bin"), "wb") as texts_file, \
+            open(os.path.join(snapshot_directory, "ids.bin"), "wb") as ids_file, \
+            open(os.path.join(snapshot_directory, "metadata.bin"), "wb") as metadata_file:
+        for batch in iter_collection_batches(collection, batch_size=batch_size):
+            batch_embeddings = np.asarray(batch['embeddings'], dtype=np.float32)
+            if embeddings is None:
+                # The files are allocated once the dimensions are known
+                embeddings = np.lib.format.open_memmap(os.path.join(snapshot_directory, "embeddings.npy"), mode="w+", dtype=dtype, shape=(count, batch_embeddings.shape[1]))
+                if dtype == 'int8':
+                    scales = np.lib.format.open_memmap(os.path.join(snapshot_directory, "scales.npy"), mode="w+", dtype=np.float32, shape=(count,))
+            next_row = row + len(batch['ids'])
+            quantized, batch_scales = quantize(batch_embeddings, dtype)
+            embeddings[row:next_row] = quantized
+            if scales is not None:
+                scales[row:next_row] = batch_scales
+            norms[row:next_row] = np.linalg.norm(batch_embeddings, axis=1)
+            write_packed_strings(texts_file, [document or "" for document in batch['documents']], text_offsets)
+            write_packed_strings(ids_file, batch['ids'], id_offsets)
+            write_packed_strings(metadata_file, [json.dumps(metadata) if metadata else "" for metadata in batch['metadatas']], metadata_offsets)
+            row = next_row
+
+    dimensions = 0 if embeddings is None else embeddings.shape[1]
+    if embeddings is None:
+        np.save(os.path.join(snapshot_directory, "embeddings.npy"), np.zeros((0, 0), dtype=dtype))
+    else:
+        embeddings.flush()
+        del embeddings
+    if scales is not None:
+        scales.flush()
+        del scales
+    np.save(os.path.join(snapshot_directory, "norms.npy"), norms)
+    np.save(os.path.join(snapshot_directory, "texts.idx.npy"), np.asarray(text_offsets, dtype=np.int64))
+    np.save(os.path.join(snapshot_directory, "ids.idx.npy"), np.asarray(id_offsets, dtype=np.int64))
+    np.save(os.path.join(snapshot_directory, "metadata.idx.npy"), np.asarray(metadata_offsets, dtype=np.int64))
+
+    file_names = sorted(file_name for file_name in os.listdir(snapshot_directory) if file_name != SNAPSHOT_MANIFEST)
+    manifest = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "created_on": datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+        "collection_name": collection.name,
+        "collection_metadata": collection.metadata,
+        "embedding_class": ModelInfo.embedding_class(),
+        "embedding_model_name": model_name or read_vectorstore_manifest(persist_directory).get(MANIFEST_MODEL_NAME_KEY) or DEFAULT_MODEL_NAME,
+        "count": count,
+        "dimensions": dimensions,
+        "dtype": dtype,
+        "files": {file_name: get_file_hash(os.path.join(snapshot_directory, file_name)) for file_name in file_names}
+    }
+    with open(os.path.join(snapshot_directory, SNAPSHOT_MANIFEST), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+    logging.info(f"Exported {count} chunks of '{collection.name}' to the snapshot '{snapshot_directory}'")
+    return manifest
+
+
+def read_manifest(snapshot_directory: str) -> Dict[str, Any]:
+    with open(os.path.join(snapshot_directory, SNAPSHOT_MANIFEST), "r", encoding="utf-8") as file:
+        manifest = json.load(file)
+    if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format version: {manifest.get('format_version')}")
+    return manifest
+
+
+def is_snapshot(directory: str) -> bool:
+    return directory is not None and os.path.exists(os.path.join(directory, SNAPSHOT_MANIFEST))
+
+
+def verify_snapshot(snapshot_directory: str) -> List[str]:
+    """Returns the names of the snapshot files whose checksums do not match the manifest."""
+    manifest = read_manifest(snapshot_directory)
+    return [
+        file_name for file_name, file_hash in manifest["files"].items()
+        if not os.path.exists(os.path.join(snapshot_directory, file_name)) or get_file_hash(os.path.join(snapshot_directory, file_name)) != file_hash
+    ]
+
+
+class SnapshotVectorStore(VectorStore):
+    """
+    The read-only vectorstore querying the memory-mapped snapshot: it starts without loading the embeddings,
+    the pages of the embedding matrix are read by the OS when a query scores them.
+    The scores are computed by blocks of rows with the distance of the snapshot's collection ('l2' by default).
+    """
+
+    def __init__(self, snapshot_directory: str, embedding: Embeddings = None):
+        self.snapshot_directory = snapshot_directory
+        self.manifest = read_manifest(snapshot_directory)
+        self.embedding = embedding
+        self.space = (self.manifest.get("collection_metadata") or {}).get("hnsw:space", "l2")
+        self.vectors = np.load(os.path.join(snapshot_directory, "embeddings.npy"), mmap_mode="r")
+        scales_path = os.path.join(snapshot_directory, "scales.npy")
+        self.scales = np.load(scales_path, mmap_mode="r") if os.path.exists(scales_path) else None
+        self.norms = np.load(os.path.join(snapshot_directory, "norms.npy"), mmap_mode="r")
+        self.text_offsets = np.load(os.path.join(snapshot_directory, "texts.idx.npy"), mmap_mode="r")
+        self.id_offsets = np.load(os.path.join(snapshot_directory, "ids.idx.npy"), mmap_mode="r")
+        self.texts = np.memmap(os.path.join(snapshot_directory, "texts.bin"), dtype=np.uint8, mode="r") if self.text_offsets[-1] > 0 else None
+        self.ids = np.memmap(os.path.join(snapshot_directory, "ids.bin"), dtype=np.uint8, mode="r") if self.id_offsets[-1] > 0 else None
+        self.metadata_offsets = np.load(os.path.join(snapshot_directory, "metadata.idx.npy"), mmap_mode="r")
+        self.metadata = np.memmap(os.path.join(snapshot_directory, "metadata.bin"), dtype=np.uint8, mode="r") if self.metadata_offsets[-1] > 0 else None
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self.embedding
+
+    def __len__(self) -> int:
+        return self.manifest["count"]
+
+    def get_text(self, row: int) -> str:
+        return bytes(self.texts[self.text_offsets[row]:self.text_offsets[row + 1]]).decode('utf-8') if self.texts is not None else ""
+
+    def get_id(self, row: int) -> str:
+        return bytes(self.ids[self.id_offsets[row]:self.id_offsets[row + 1]]).decode('utf-8') if self.ids is not None else ""
+
+    def get_metadata(self, row: int) -> Dict[str, Any]:
+        if self.metadata is None or self.metadata_offsets[row] == self.metadata_offsets[row + 1]:
+            return {}
+        return json.loads(bytes(self.metadata[self.metadata_offsets[row]:self.metadata_offsets[row + 1]]).decode('utf-8'))
+
+    def get_vectors(self, start: int, end: int) -> np.ndarray:
+        vectors = self.vectors[start:end].astype(np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[start:end, None]
+        return vectors
+
+    def score_rows(self, query: np.ndarray, start: int, end: int) -> np.ndarray:
+        """Returns the distances of the rows to the query: the lower, the closer (as Chroma)."""
+        dot = self.get_vectors(start, end) @ query
+        norms = np.asarray(self.norms[start:end])
+        if self.space == "cosine":
+            return 1.0 - dot / np.maximum(norms * np.linalg.norm(query), 1e-12)
+        if self.space == "ip":
+            return 1.0 - dot
+        return norms * norms - 2.0 * dot + float(query @ query)
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4) -> List[Tuple[Document, float]]:
+        if len(self) == 0:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, len(self), QUERY_BLOCK_ROWS):
+            end = min(start + QUERY_BLOCK_ROWS, len(self))
+            scores = self.score_rows(query, start, end)
+            # Keep the k best rows of the block with the best rows so far
+            top = np.argpartition(scores, min(k, len(scores)) - 1)[:k]
+            best_rows = np.concatenate([best_rows, top + start])
+            best_scores = np.concatenate([best_scores, scores[top]])
+            order = np.argsort(best_scores)[:k]
+            best_rows, best_scores = best_rows[order], best_scores[order]
+        return [
+            (Document(page_content=self.get_text(int(row)), metadata=self.get_metadata(int(row))), float(score))
+            for row, score in zip(best_rows, best_scores)
+        ]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        if self.embedding is None:
+            raise ValueError("The snapshot is queried by text only with the embedding model")
+        return self.similarity_search_by_vector_with_score(self.embedding.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score(query, k)]
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+        raise NotImplementedError("The snapshot is read-only: import it into Chroma to add documents")
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None, **kwargs: Any) -> "SnapshotVectorStore":
+        raise NotImplementedError("The snapshot is created by export_snapshot()")
+
+
+def import_snapshot(snapshot_directory: str, persist_directory: str, collection_name: str = None, batch_size: int = BATCH_SIZE) -> Chroma:
+    """
+    Imports the snapshot into the Chroma vectorstore in the persist directory; the checksums are verified first.
+
+    Returns:
+    - (Chroma): the vectorstore, without the embedding function: open it with load_vector_store() to query it by text
+    """
+    broken_files = verify_snapshot(snapshot_directory)
+    if broken_files:
+        raise IOError(f"The snapshot files do not match their checksums: {broken_files}")
+    snapshot = SnapshotVectorStore(snapshot_directory)
+    manifest = snapshot.manifest
+    docs_db = Chroma(
+        persist_directory=persist_directory,
+        collection_name=collection_name or manifest["collection_name"] or DEFAULT_COLLECTION_NAME,
+        # Chroma rejects the empty metadata of the collections exported from the local backends
+        collection_metadata=manifest.get("collection_metadata") or None,
+        client_settings=get_chroma_settings().copy(),
+    )
+    for start in range(0, len(snapshot), batch_size):
+        end = min(start + batch_size, len(snapshot))
+        docs_db._collection.add(
+            ids=[snapshot.get_id(row) for row in range(start, end)],
+            embeddings=snapshot.get_vectors(start, end).tolist(),
+            metadatas=[snapshot.get_metadata(row) or None for row in range(start, end)],
+            documents=[snapshot.get_text(row) for row in range(start, end)]
+        )
+    docs_db.persist()
+    logging.info(f"Imported {len(snapshot)} chunks from the snapshot '{snapshot_directory}' to '{persist_directory}'")
+    return docs_db
+
+
+def load_snapshot_vector_store(snapshot_directory: str, model_name: str = None) -> SnapshotVectorStore:
+    """Opens the snapshot for the read-only queries with the embedding model the snapshot was created with."""
+    manifest = read_manifest(snapshot_directory)
+    embedding = ModelInfo.create_embedding(model_name=model_name or manifest["embedding_model_name"])
+    return SnapshotVectorStore(snapshot_directory, embedding=embedding)
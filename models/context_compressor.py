@@ -0,0 +1,125 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the Apache-2.0 license.
+import logging
+import re
+import time
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+from langchain.retrievers.document_compressors.base import BaseDocumentCompressor
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from .retrieval_constants import COMPRESSION_MIN_SENTENCE_CHARS, COMPRESSION_TOKEN_BUDGET
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+
+
+def split_sentences(text: str, min_chars: int = COMPRESSION_MIN_SENTENCE_CHARS) -> List[str]:
+    """
+    Splits the text into sentences; too short fragments (list bullets, page numbers) are merged with the previous sentence.
+    """
+    sentences = []
+    for sentence in SENTENCE_BOUNDARY.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if sentences and len(sentence) < min_chars:
+            sentences[-1] = f"{sentences[-1]} {sentence}"
+        else:
+            sentences.append(sentence)
+    return sentences
+
+
+def truncate_to_budget(text: str, text_tokens: int, count_tokens: Callable[[str], int], token_budget: int):
+    """
+    Cuts the end of the text till it fits the token budget; the tokens are taken as spread evenly over the characters.
+
+    Returns:
+    - (str, int): the truncated text and its tokens
+    """
+    while text and text_tokens > token_budget:
+        text = text[:len(text) * token_budget // text_tokens].rstrip()
+        text_tokens = count_tokens(text)
+    return text, text_tokens
+
+
+class ExtractiveContextCompressor(BaseDocumentCompressor):
+    """
+    Keeps only the sentences of the retrieved documents which are the most similar to the question.
+
+    The sentences of all documents are embedded in one batch with the embedding model of the vectorstore,
+    scored by the cosine similarity to the question and taken by the descending score while they fit `token_budget`;
+    the best sentence is always kept, truncated if it alone does not fit the budget.
+    The kept sentences are returned in their original order, so every document stays readable for LLM.
+    """
+    embeddings: Embeddings
+    count_tokens: Callable[[str], int]
+    # Counts the tokens of all sentences at once if LLM supports it (the inference daemon client)
+    count_tokens_batch: Optional[Callable[[List[str]], List[int]]] = None
+    token_budget: int = COMPRESSION_TOKEN_BUDGET
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def compress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        if not documents:
+            return []
+
+        start_time = time.time()
+        # (document index, sentence) for every sentence of the retrieved documents
+        sentences = [
+            (index, sentence)
+            for index, document in enumerate(documents)
+            for sentence in split_sentences(document.page_content)
+        ]
+        if not sentences:
+            return list(documents)
+
+        query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        sentence_vectors = np.asarray(self.embeddings.embed_documents([sentence for _, sentence in sentences]), dtype=np.float32)
+        scores = sentence_vectors @ query_vector / (
+            np.linalg.norm(sentence_vectors, axis=1) * np.linalg.norm(query_vector) + 1e-10
+        )
+
+        if self.count_tokens_batch is not None:
+            sentence_tokens = self.count_tokens_batch([sentence for _, sentence in sentences])
+        else:
+            sentence_tokens = [self.count_tokens(sentence) for _, sentence in sentences]
+        original_tokens = sum(sentence_tokens)
+        kept = set()
+        used_tokens = 0
+        for position in np.argsort(-scores):
+            if used_tokens + sentence_tokens[position] > self.token_budget:
+                if kept:
+                    continue
+                # The best sentence is always kept, so the context is never empty
+                index, sentence = sentences[position]
+                sentence, sentence_tokens[position] = truncate_to_budget(
+                    sentence, sentence_tokens[position], self.count_tokens, self.token_budget
+                )
+                sentences[position] = (index, sentence)
+            kept.add(int(position))
+            used_tokens += sentence_tokens[position]
+
+        compressed_documents = []
+        for index, document in enumerate(documents):
+            content = " ".join(
+                sentence for position, (sentence_index, sentence) in enumerate(sentences)
+                if sentence_index == index and position in kept
+            )
+            if content:
+                compressed_documents.append(Document(page_content=content, metadata=document.metadata))
+
+        logging.info(
+            f"Compressed the context from {original_tokens} to {used_tokens} tokens "
+            f"(saved {original_tokens - used_tokens}) in {round(time.time() - start_time, ndigits=3)} seconds; "
+            f"kept {len(kept)} of {len(sentences)} sentences"
+        )
+        return compressed_documents
@@ -0,0 +1,187 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the Apache-2.0 license.
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from .models_constants import (
+    DEFAULT_MODEL_NAME,
+    EMBED_BATCH_SIZE,
+    EMBED_BATCH_WAIT,
+    EMBEDDING_KWARGS,
+    ENCODE_KWARG,
+    INFERENCE_DAEMON_SOCKET_ENV
+)
+
+EMBED_DOCUMENTS_OPERATION = "embed_documents"
+EMBED_QUERIES_OPERATION = "embed_queries"
+
+_embeddings: Dict[tuple, "SharedEmbeddings"] = {}
+_embeddings_lock = threading.Lock()
+
+
+def encode_queries(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    """Encodes several queries in one forward pass of the loaded model."""
+    query_instruction = getattr(embeddings, "query_instruction", None)
+    if query_instruction is None:
+        return [embeddings.embed_query(text) for text in texts]
+    # INSTRUCTOR encodes (instruction, text) pairs, see HuggingFaceInstructEmbeddings.embed_query
+    instruction_pairs = [[query_instruction, text] for text in texts]
+    return embeddings.client.encode(instruction_pairs, **embeddings.encode_kwargs).tolist()
+
+
+class EmbeddingBatcher:
+    """
+    Micro-batches the concurrent embedding requests: the requests arriving within `max_wait` seconds
+    (up to `max_batch_size` texts) are encoded in one forward pass and the results are split back per request.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_batch_size: int = EMBED_BATCH_SIZE, max_wait: float = EMBED_BATCH_WAIT):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        threading.Thread(target=self.run, name="EmbeddingBatcher", daemon=True).start()
+
+    def submit(self, operation: str, texts: List[str]) -> Future:
+        future = Future()
+        self.requests.put((operation, texts, future))
+        return future
+
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+            batch_size = len(batch[0][1])
+            deadline = time.monotonic() + self.max_wait
+            while batch_size < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                batch_size += len(request[1])
+            self.process(batch)
+
+    def process(self, batch):
+        for operation in (EMBED_DOCUMENTS_OPERATION, EMBED_QUERIES_OPERATION):
+            requests = [request for request in batch if request[0] == operation]
+            if not requests:
+                continue
+            texts = [text for _, request_texts, _ in requests for text in request_texts]
+            start_time = time.time()
+            try:
+                if operation == EMBED_DOCUMENTS_OPERATION:
+                    embeddings = self.embeddings.embed_documents(texts)
+                else:
+                    embeddings = encode_queries(self.embeddings, texts)
+            except Exception as e:
+                for _, _, future in requests:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for _, request_texts, future in requests:
+                future.set_result(embeddings[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+            logging.debug(f"Embedded {len(texts)} texts of {len(requests)} requests ({operation}) in {round(time.time() - start_time, ndigits=3)} seconds")
+
+
+class SharedEmbeddings(Embeddings):
+    """
+    The embedding model shared by all users in the process (the app chat, the file watcher, the CLIs, the inference daemon).
+
+    The underlying model is not safe for the concurrent encode, so only the thread of EmbeddingBatcher runs it;
+    the concurrent calls do not wait for each other's forward passes: their texts are encoded together in one pass.
+    """
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+        self.batcher = EmbeddingBatcher(embeddings)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.batcher.submit(EMBED_DOCUMENTS_OPERATION, texts).result()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embeds several queries in one forward pass."""
+        return self.batcher.submit(EMBED_QUERIES_OPERATION, texts).result()
+
+
+def embed_queries(embedding: Embeddings, texts: List[str]) -> List[List[float]]:
+    """Embeds the queries in one batch if the embedding model supports it; otherwise - one by one."""
+    if hasattr(embedding, "embed_queries"):
+        return embedding.embed_queries(texts)
+    return [embedding.embed_query(text) for text in texts]
+
+
+def get_registry_key(model_name: str, model_kwargs: Dict, encode_kwargs: Dict) -> tuple:
+    """Returns the registry key: (model name, device, model kwargs, encode kwargs)."""
+    return (
+        model_name,
+        model_kwargs.get("device"),
+        json.dumps(model_kwargs, sort_keys=True, default=str),
+        json.dumps(encode_kwargs, sort_keys=True, default=str),
+    )
+
+
+def get_embedding(
+    model_name: Optional[str] = None,
+    model_kwargs: Optional[Dict] = None,
+    encode_kwargs: Optional[Dict] = None
+) -> Embeddings:
+    """
+    Returns the embedding model loaded once per process.
+
+    If the INFERENCE_DAEMON_SOCKET environment variable is set, the client of the local inference daemon
+    is returned instead, so several processes use one loaded model (see models/inference_daemon.py).
+
+    Parameters:
+    - model_name (str): the embedding model name; DEFAULT_MODEL_NAME if it is not specified
+    - model_kwargs (dict): the model arguments, e.g. the device
+    - encode_kwargs (dict): the encode arguments
+
+    Returns:
+    - (Embeddings): the shared embedding model
+    """
+    if model_name is None:
+        model_name = DEFAULT_MODEL_NAME
+    if model_kwargs is None:
+        model_kwargs = EMBEDDING_KWARGS
+    if encode_kwargs is None:
+        encode_kwargs = ENCODE_KWARG
+
+    socket_path = os.getenv(INFERENCE_DAEMON_SOCKET_ENV)
+    if socket_path:
+        from .inference_daemon import RemoteEmbeddings
+
+        return RemoteEmbeddings(socket_path=socket_path, model_name=model_name)
+
+    key = get_registry_key(model_name, model_kwargs, encode_kwargs)
+    with _embeddings_lock:
+        embedding = _embeddings.get(key)
+        if embedding is None:
+            from langchain_community.embeddings import HuggingFaceInstructEmbeddings
+
+            start_time = time.time()
+            embedding = SharedEmbeddings(
+                HuggingFaceInstructEmbeddings(
+                    model_name=model_name,
+                    model_kwargs=model_kwargs,
+                    encode_kwargs=encode_kwargs
+                )
+            )
+            _embeddings[key] = embedding
+            logging.info(f"Loaded the embedding model '{model_name}' in {round(time.time() - start_time, ndigits=2)} seconds")
+    return embedding
@@ -1,8 +1,6 @@
 # Copyright (c) EGOGE - All Rights Reserved.
 # This software may be used and distributed according to the terms of the Apache-2.0 license.
 import logging
-from huggingface_hub import hf_hub_download
-from langchain_community.llms import LlamaCpp
 
 from .models_constants import (
     N_CTX, 
@@ -32,6 +30,9 @@ Returns:
 def load_gguf_model(model_info, cache_dir):    
 
     try:
+        from huggingface_hub import hf_hub_download
+        from langchain_community.llms import LlamaCpp
+
         model_path = hf_hub_download(
             repo_id=model_info.model_id,
             filename=model_info.model_basename,
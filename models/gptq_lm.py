@@ -1,7 +1,5 @@
 # Copyright (c) EGOGE - All Rights Reserved.
 # This software may be used and distributed according to the terms of the CC-BY-SA-4.0 license.
-from transformers import AutoModelForCausalLM, AutoTokenizer
-
 from .models_constants import DEVICE_MAP
 
 SAFETENSORS_EXT = ".safetensors"
@@ -29,6 +27,7 @@ Returns:
 - model (AutoGPTQForCausalLM): The quantized model.
 """
 def load_gptq_model(model_info):    
+    from transformers import AutoModelForCausalLM, AutoTokenizer
 
     tokenizer = AutoTokenizer.from_pretrained(model_info.model_id, use_fast=True)
 
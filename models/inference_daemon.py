@@ -0,0 +1,315 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the Apache-2.0 license.
+import argparse
+import hashlib
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+from .embedding_registry import EMBED_DOCUMENTS_OPERATION, EMBED_QUERIES_OPERATION, embed_queries
+from .models_constants import (
+    DAEMON_TOKEN_COUNT_CACHE_SIZE,
+    DEFAULT_MODEL_NAME,
+    INFERENCE_DAEMON_SOCKET_ENV
+)
+
+# Every message is the 4-byte big-endian length followed by the UTF-8 JSON
+MESSAGE_HEADER = struct.Struct(">I")
+
+GENERATE_OPERATION = "generate"
+TOKENIZE_OPERATION = "tokenize"
+
+
+def send_message(connection: socket.socket, message: Dict):
+    payload = json.dumps(message).encode("utf-8")
+    connection.sendall(MESSAGE_HEADER.pack(len(payload)) + payload)
+
+
+def receive_exactly(connection: socket.socket, size: int) -> bytes:
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = connection.recv(size - len(buffer))
+        if not chunk:
+            raise ConnectionError("The connection is closed")
+        buffer.extend(chunk)
+    return bytes(buffer)
+
+
+def receive_message(connection: socket.socket) -> Dict:
+    (size,) = MESSAGE_HEADER.unpack(receive_exactly(connection, MESSAGE_HEADER.size))
+    return json.loads(receive_exactly(connection, size).decode("utf-8"))
+
+
+def request_daemon(socket_path: str, message: Dict) -> Dict:
+    """Sends one request to the inference daemon and waits for its response."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        send_message(connection, message)
+        response = receive_message(connection)
+    if "error" in response:
+        raise RuntimeError(f"The inference daemon failed: {response['error']}")
+    return response
+
+
+class TokenCountCache:
+    """LRU cache of the token counts of the texts per LLM: the same documents and sentences are counted again by every question."""
+
+    def __init__(self, max_size: int = DAEMON_TOKEN_COUNT_CACHE_SIZE):
+        self.max_size = max_size
+        self.counts: "OrderedDict[str, int]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(model_id: Optional[str], text: str) -> str:
+        return hashlib.sha256(f"{model_id}\n{text}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[int]:
+        with self.lock:
+            count = self.counts.get(key)
+            if count is not None:
+                self.counts.move_to_end(key)
+            return count
+
+    def put(self, key: str, count: int):
+        with self.lock:
+            self.counts[key] = count
+            self.counts.move_to_end(key)
+            if len(self.counts) > self.max_size:
+                self.counts.popitem(last=False)
+
+
+# Shared by all RemoteLLM clients of the process
+token_count_cache = TokenCountCache()
+
+
+class RemoteEmbeddings(Embeddings):
+    """The client of the inference daemon: the embeddings are computed by the daemon over the Unix socket."""
+
+    def __init__(self, socket_path: str, model_name: str = DEFAULT_MODEL_NAME):
+        self.socket_path = socket_path
+        self.model_name = model_name
+
+    def request(self, operation: str, texts: List[str]) -> List[List[float]]:
+        message = {"operation": operation, "model_name": self.model_name, "texts": texts}
+        return request_daemon(self.socket_path, message)["embeddings"]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.request(EMBED_DOCUMENTS_OPERATION, texts)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self.request(EMBED_QUERIES_OPERATION, texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+
+class RemoteLLM(LLM):
+    """
+    The client of the inference daemon: the answers are generated by LLM resident in the daemon
+    and streamed back token by token; the tokens are counted by the daemon in batches and cached.
+    """
+    socket_path: str
+    model_id: Optional[str] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "study_stream_inference_daemon"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"socket_path": self.socket_path, "model_id": self.model_id}
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        message = {"operation": GENERATE_OPERATION, "model_id": self.model_id, "prompt": prompt, "stop": stop}
+        return request_daemon(self.socket_path, message)["text"]
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        message = {"operation": GENERATE_OPERATION, "model_id": self.model_id, "prompt": prompt, "stop": stop, "stream": True}
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(self.socket_path)
+            send_message(connection, message)
+            # The daemon sends a message per token, then the whole text
+            while True:
+                response = receive_message(connection)
+                if "error" in response:
+                    raise RuntimeError(f"The inference daemon failed: {response['error']}")
+                if "token" not in response:
+                    return
+                chunk = GenerationChunk(text=response["token"])
+                if run_manager:
+                    run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+
+    def get_num_tokens(self, text: str) -> int:
+        return self.get_num_tokens_batch([text])[0]
+
+    def get_num_tokens_batch(self, texts: List[str]) -> List[int]:
+        # The token budget is counted with the tokenizer of the resident LLM: the texts not cached yet are sent at once
+        keys = [token_count_cache.get_key(self.model_id, text) for text in texts]
+        counts = [token_count_cache.get(key) for key in keys]
+        missing = [position for position, count in enumerate(counts) if count is None]
+        if missing:
+            message = {"operation": TOKENIZE_OPERATION, "model_id": self.model_id, "texts": [texts[position] for position in missing]}
+            for position, count in zip(missing, request_daemon(self.socket_path, message)["num_tokens"]):
+                counts[position] = count
+                token_count_cache.put(keys[position], count)
+        return counts
+
+
+class GenerationQueue:
+    """Runs the generation requests one by one in the order of arrival; LLM evaluates one prompt at a time."""
+
+    def __init__(self, llm):
+        self.llm = llm
+        self.requests = queue.Queue()
+        threading.Thread(target=self.run, name="GenerationQueue", daemon=True).start()
+
+    def submit(self, prompt: str, stop: Optional[List[str]], on_token: Callable[[str], None] = None) -> Future:
+        """Queues the prompt; if 'on_token' is set, the answer is streamed to it token by token."""
+        future = Future()
+        self.requests.put((prompt, stop, on_token, future))
+        logging.info(f"Queued the generation request; {self.requests.qsize()} waiting")
+        return future
+
+    def run(self):
+        while True:
+            prompt, stop, on_token, future = self.requests.get()
+            try:
+                if on_token is None:
+                    future.set_result(self.llm.invoke(prompt, stop=stop))
+                    continue
+                tokens = []
+                for token in self.llm.stream(prompt, stop=stop):
+                    on_token(token)
+                    tokens.append(token)
+                future.set_result("".join(tokens))
+            except Exception as e:
+                # A client gone while streaming stops its generation
+                future.set_exception(e)
+
+
+class InferenceRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            message = receive_message(self.request)
+            send_token = (lambda token: send_message(self.request, {"token": token})) if message.get("stream") else None
+            send_message(self.request, self.server.process(message, send_token))
+        except ConnectionError:
+            pass
+        except Exception as e:
+            logging.error(f"Failed to process the inference request: {str(e)}", exc_info=True)
+            send_message(self.request, {"error": str(e)})
+
+
+class InferenceDaemonServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, model_name: str, embedding: Embeddings, model_id: Optional[str], llm):
+        self.model_name = model_name
+        self.model_id = model_id
+        self.llm = llm
+        self.embedding = embedding
+        self.generation_queue = GenerationQueue(llm) if llm is not None else None
+        super().__init__(socket_path, InferenceRequestHandler)
+
+    def process(self, message: Dict, send_token: Callable[[str], None] = None) -> Dict:
+        operation = message["operation"]
+        if operation in (EMBED_DOCUMENTS_OPERATION, EMBED_QUERIES_OPERATION):
+            if message.get("model_name", self.model_name) != self.model_name:
+                raise ValueError(f"The daemon serves the embedding model '{self.model_name}', not '{message.get('model_name')}'")
+            # The shared embedding model encodes the texts of the concurrent clients in one forward pass
+            if operation == EMBED_DOCUMENTS_OPERATION:
+                return {"embeddings": self.embedding.embed_documents(message["texts"])}
+            return {"embeddings": embed_queries(self.embedding, message["texts"])}
+
+        if self.llm is None:
+            raise ValueError("The daemon does not serve LLM")
+        if message.get("model_id") and message["model_id"] != self.model_id:
+            raise ValueError(f"The daemon serves LLM '{self.model_id}', not '{message['model_id']}'")
+        if operation == GENERATE_OPERATION:
+            return {"text": self.generation_queue.submit(message["prompt"], message.get("stop"), send_token).result()}
+        elif operation == TOKENIZE_OPERATION:
+            return {"num_tokens": [self.llm.get_num_tokens(text) for text in message["texts"]]}
+        raise ValueError(f"Unsupported operation: {operation}")
+
+
+def serve(socket_path: str, model_name: str = DEFAULT_MODEL_NAME, with_llm: bool = True):
+    """
+    Runs the local inference daemon: the embedding model and LLM are loaded once
+    and shared by all clients (the app, the CLIs) connected to the socket.
+
+    Parameters:
+    - socket_path (str): the path of the Unix socket
+    - model_name (str): the embedding model name
+    - with_llm (bool): the flag indicating if LLM of ModelInfo is loaded and served too
+    """
+    from .embedding_registry import get_embedding
+    from .model_info import ModelInfo
+    from .retrieval_qa import create_model
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    # The daemon itself must load the models, not connect to itself
+    os.environ.pop(INFERENCE_DAEMON_SOCKET_ENV, None)
+    embedding = get_embedding(model_name=model_name)
+
+    model_id = None
+    llm = None
+    if with_llm:
+        model_info = ModelInfo()
+        model_id = model_info.model_id
+        llm = create_model(model_info=model_info)
+        if llm is None:
+            raise ValueError(f"Failed to create LLM for '{model_info}'")
+
+    with InferenceDaemonServer(socket_path, model_name, embedding, model_id, llm) as server:
+        logging.info(f"The inference daemon is listening on {socket_path}; set {INFERENCE_DAEMON_SOCKET_ENV}={socket_path} for clients")
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+
+    # Create the parser
+    parser = argparse.ArgumentParser(description="Running the local inference daemon.")
+
+    # Add the arguments
+    parser.add_argument('--socket', type=str, help='The path of the Unix socket.', default="/tmp/study_stream_inference.sock")
+    parser.add_argument('--model_name', type=str, help='The embedding model name.', default=DEFAULT_MODEL_NAME)
+    parser.add_argument('--no_llm', action='store_true', help='(Optional) Serves only the embedding model.')
+
+    # Parse the arguments
+    args = parser.parse_args()
+    serve(socket_path=args.socket, model_name=args.model_name, with_llm=not args.no_llm)
@@ -1,13 +1,10 @@
 # Copyright (c) EGOGE - All Rights Reserved.
 # This software may be used and distributed according to the terms of the Apache-2.0 license.
-from langchain_community.embeddings import HuggingFaceInstructEmbeddings
 from .models_constants import (
     DEFAULT_MODEL_BASENAME, 
     DEFAULT_MODEL_ID,
     DEFAULT_MODEL_NAME, 
-    DEVICE_TYPE_CPU,
-    EMBEDDING_KWARGS,
-    ENCODE_KWARG
+    DEVICE_TYPE_CPU
 )
 
 """
@@ -65,13 +62,10 @@ class ModelInfo:
                 f"device_type='{self._device_type}')")    
     
     def create_embedding(model_name):
-        if model_name is None:
-            model_name = DEFAULT_MODEL_NAME
-        return HuggingFaceInstructEmbeddings(
-            model_name=model_name, 
-            model_kwargs=EMBEDDING_KWARGS, 
-            encode_kwargs=ENCODE_KWARG
-        )
+        # The embedding model is loaded once per process and shared
+        from .embedding_registry import get_embedding
+
+        return get_embedding(model_name=model_name)
     
     def embedding_class():
         return "langchain_community.embeddings.HuggingFaceInstructEmbeddings"   
\ No newline at end of file
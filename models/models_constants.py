@@ -1,7 +1,7 @@
 
 # Copyright (c) EGOGE - All Rights Reserved.
 # This software may be used and distributed according to the terms of the CC-BY-SA-4.0 license.
-import torch
+from functools import lru_cache
 
 DEVICE_MAP = "auto"
 
@@ -16,10 +16,28 @@ N_BATCH = 512
 # Change this value based on your model and your GPU VRAM pool.
 N_GPU_LAYERS = 40 
 
+# Token budget of the prompt window (N_CTX):
+# the number of tokens reserved for the generated answer
+ANSWER_TOKEN_RESERVE = 1024
+# the share of the remaining window which is always kept for the retrieved {context};
+# the rest goes to the chat {history}
+CONTEXT_TOKEN_SHARE = 0.6
+# the maximum number of the latest question/answer turns kept verbatim in the chat {history};
+# older turns are folded into a rolling summary
+HISTORY_WINDOW_TURNS = 4
+
 # Embedding settings
 EMBEDDING_KWARGS = {'device': 'cpu'}
 ENCODE_KWARG = {'normalize_embeddings': True}
 
+# If set, the embeddings and answers are computed by the local inference daemon listening on this Unix socket
+INFERENCE_DAEMON_SOCKET_ENV = "INFERENCE_DAEMON_SOCKET"
+# The shared embedding model micro-batches the requests arriving within the wait (seconds) up to the batch size (texts)
+EMBED_BATCH_SIZE = 256
+EMBED_BATCH_WAIT = 0.01
+# The number of the texts whose token counts are cached by the client of the daemon
+DAEMON_TOKEN_COUNT_CACHE_SIZE = 4096
+
 DEFAULT_MODEL_NAME = "hkunlp/instructor-large" 
 DEFAULT_MODEL_ID = "TheBloke/Llama-2-7b-Chat-GGUF"
 DEFAULT_MODEL_BASENAME = "llama-2-7b-chat.Q4_K_M.gguf"
@@ -34,9 +52,20 @@ DEVICE_TYPE_MPS = "mps"
 DEVICE_TYPE_CUDA = "cuda"
 DEVICE_TYPE_CPU = "cpu"
 
-if torch.backends.mps.is_available():
-    DEVICE_TYPE = DEVICE_TYPE_MPS
-elif torch.cuda.is_available():
-    DEVICE_TYPE = DEVICE_TYPE_CUDA
-else:
-    DEVICE_TYPE = DEVICE_TYPE_CPU
\ No newline at end of file
+@lru_cache(maxsize=None)
+def get_device_type():
+    """Probes the available device once; 'torch' is imported only when the device type is requested."""
+    import torch
+
+    if torch.backends.mps.is_available():
+        return DEVICE_TYPE_MPS
+    elif torch.cuda.is_available():
+        return DEVICE_TYPE_CUDA
+    else:
+        return DEVICE_TYPE_CPU
+
+def __getattr__(name):
+    # DEVICE_TYPE is resolved on the first access, not at the import time
+    if name == "DEVICE_TYPE":
+        return get_device_type()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,9 +1,5 @@
 # Copyright (c) EGOGE - All Rights Reserved.
 # This software may be used and distributed according to the terms of the Apache-2.0 license.
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer, LlamaForCausalLM, LlamaTokenizer
-from langchain_community.llms import LlamaCpp
-
 from .models_constants import (
     DEVICE_MAP, 
     DEVICE_TYPE_MPS,
@@ -11,10 +7,15 @@ from .models_constants import (
 )
 
 QUANT_TYPE="nf4"
-if torch.cuda.is_available():
-    MAX_MEMORY = f'{int(torch.cuda.mem_get_info()[0]/1024**3)-2}GB'
-else:
-   MAX_MEMORY = "4GB"    
+DEFAULT_MAX_MEMORY = "4GB"
+
+def get_max_memory():
+    """Returns the free CUDA memory less 2GB, queried only when the pretrained model is loaded."""
+    import torch
+
+    if torch.cuda.is_available():
+        return f'{int(torch.cuda.mem_get_info()[0]/1024**3)-2}GB'
+    return DEFAULT_MAX_MEMORY
 
 """
 Returns a pretrained model based on the specified device type.
@@ -36,6 +37,8 @@ Returns:
 - LlamaCpp: The LlamaCpp model if successful, otherwise - None.
 """
 def load_pretrained_model(model_info, cache_dir):    
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer, LlamaForCausalLM, LlamaTokenizer
 
     if model_info.device_type.lower() in [DEVICE_TYPE_MPS, DEVICE_TYPE_CUDA]:
         tokenizer = LlamaTokenizer.from_pretrained(
@@ -61,7 +64,7 @@ def load_pretrained_model(model_info, cache_dir):
             load_in_4bit=True,
             bnb_4bit_quant_type=QUANT_TYPE,
             bnb_4bit_compute_dtype=torch.float16,
-            max_memory=MAX_MEMORY
+            max_memory=get_max_memory()
         )
         model.tie_weights()
     return tokenizer, model
\ No newline at end of file
@@ -1,7 +1,6 @@
 # Copyright (c) EGOGE - All Rights Reserved.
 # This software may be used and distributed according to the terms of the CC-BY-SA-4.0 license.
-from langchain.memory import ConversationBufferMemory
-from langchain.prompts import PromptTemplate
+from langchain_core.prompts import PromptTemplate
 
 # Explicitly supported LLMs
 LLAMA_MODEL_NAME="llama"
@@ -69,10 +68,15 @@ class PromptInfo:
     """
     Create (PromptTemplate) for the QA chat application.
 
+    Parameters:
+    - llm (BaseLanguageModel): the optional LLM; if it is specified, the chat history is bounded 
+      by the token budget computed with the LLM tokenizer, otherwise - the chat history is unbounded.
+
     Returns:
     - (PromptTemplate): Prompt templates are pre-defined recipes for generating prompts for language models.
+    - (BaseMemory): the chat history memory
     """    
-    def get_prompt_template(self):
+    def get_prompt_template(self, llm=None):
         if self._template_type == LLAMA_MODEL_NAME: #https://huggingface.co/blog/llama2#how-to-prompt-llama-2
             if self._use_history:
                 prompt_template = INSTRUCTION_START + SYSTEM_PROMPT_START + self._system_prompt + SYSTEM_PROMPT_END + "\nContext: {history} \n {context}\nUser: {question}" + INSTRUCTION_END
@@ -94,7 +98,16 @@ class PromptInfo:
         else:
             prompt = PromptTemplate(input_variables=["context", "question"], template=prompt_template)
 
-        memory = ConversationBufferMemory(input_key="question", memory_key="history")
+        # the memory classes pull in LangChain chains, so they are imported on use
+        if self._use_history and llm is not None:
+            from .token_budget import TokenBudgetMemory, compute_token_budget
+
+            _, history_budget = compute_token_budget(llm=llm, prompt=prompt)
+            memory = TokenBudgetMemory(llm=llm, max_token_limit=history_budget, input_key="question", memory_key="history")
+        else:
+            from langchain.memory.buffer import ConversationBufferMemory
+
+            memory = ConversationBufferMemory(input_key="question", memory_key="history")
 
         return (
             prompt,
@@ -0,0 +1,141 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the Apache-2.0 license.
+import logging
+import threading
+import time
+from typing import Any, Callable, List, Optional, Sequence
+
+from langchain.retrievers.contextual_compression import ContextualCompressionRetriever
+from langchain.retrievers.document_compressors.base import BaseDocumentCompressor
+from langchain_core.callbacks import CallbackManagerForRetrieverRun, Callbacks
+from langchain_core.documents import Document
+
+from .retrieval_constants import (
+    RERANK_BATCH_SIZE,
+    RERANK_MAX_LENGTH,
+    RERANK_MODEL_NAME,
+    RERANK_QUANTIZE,
+    RERANK_TOP_N
+)
+
+RERANK_SCORE_METADATA = "rerank_score"
+
+_cross_encoders = {}
+_cross_encoders_lock = threading.Lock()
+
+
+def load_cross_encoder(model_name: str = RERANK_MODEL_NAME, quantize: bool = RERANK_QUANTIZE):
+    """
+    Loads the cross-encoder once per process and caches it.
+
+    Parameters:
+    - model_name (str): the HuggingFace name of the cross-encoder model
+    - quantize (bool): the flag indicating if the linear layers are quantized to int8 for the faster CPU inference
+
+    Returns:
+    - (CrossEncoder): the cross-encoder scoring (query, passage) pairs
+    """
+    key = (model_name, quantize)
+    with _cross_encoders_lock:
+        cross_encoder = _cross_encoders.get(key)
+        if cross_encoder is None:
+            from sentence_transformers import CrossEncoder
+
+            start_time = time.time()
+            cross_encoder = CrossEncoder(model_name, max_length=RERANK_MAX_LENGTH)
+            if quantize and str(cross_encoder.model.device) == "cpu":
+                import torch
+
+                cross_encoder.model = torch.quantization.quantize_dynamic(
+                    cross_encoder.model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+            _cross_encoders[key] = cross_encoder
+            logging.info(f"Loaded the cross-encoder '{model_name}' (quantized={quantize}) in {round(time.time() - start_time, ndigits=2)} seconds")
+    return cross_encoder
+
+
+class CrossEncoderReranker(BaseDocumentCompressor):
+    """
+    Re-scores the retrieved documents with the cross-encoder and keeps the best `top_n` of them.
+
+    If `token_budget` is set, the documents are taken by the descending score only while they fit the budget,
+    so the {context} part of the prompt never exceeds its share of the model context window.
+    """
+    cross_encoder: Any
+    top_n: int = RERANK_TOP_N
+    batch_size: int = RERANK_BATCH_SIZE
+    token_budget: Optional[int] = None
+    count_tokens: Optional[Callable[[str], int]] = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def score(self, query: str, documents: Sequence[Document]) -> List[float]:
+        pairs = [(query, document.page_content) for document in documents]
+        scores = self.cross_encoder.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+        return [float(score) for score in scores]
+
+    def compress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        if not documents:
+            return []
+
+        start_time = time.time()
+        scores = self.score(query, documents)
+        ranked = sorted(zip(scores, documents), key=lambda ranked_document: ranked_document[0], reverse=True)
+
+        selected = []
+        used_tokens = 0
+        for score, document in ranked:
+            if len(selected) >= self.top_n:
+                break
+            if self.token_budget is not None and self.count_tokens is not None:
+                document_tokens = self.count_tokens(document.page_content)
+                # The best document is always kept, even if it alone does not fit the budget
+                if selected and used_tokens + document_tokens > self.token_budget:
+                    continue
+                used_tokens += document_tokens
+            document.metadata[RERANK_SCORE_METADATA] = score
+            selected.append(document)
+
+        logging.info(
+            f"Re-ranked {len(documents)} documents in {round(time.time() - start_time, ndigits=3)} seconds; "
+            f"kept {len(selected)} ({used_tokens} tokens of {self.token_budget})"
+        )
+        return selected
+
+
+class StagedRetriever(ContextualCompressionRetriever):
+    """
+    The two-stage retriever: the base retriever fetches the wide set of candidates,
+    the compressor (e.g. CrossEncoderReranker or the pipeline of compressors) narrows it down; 
+    the latency of every stage is logged.
+    """
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+        **kwargs: Any,
+    ) -> List[Document]:
+        start_time = time.time()
+        documents = self.base_retriever.get_relevant_documents(query, callbacks=run_manager.get_child(), **kwargs)
+        fetch_time = time.time() - start_time
+
+        if documents:
+            start_time = time.time()
+            documents = list(self.base_compressor.compress_documents(documents, query, callbacks=run_manager.get_child()))
+            compress_time = time.time() - start_time
+        else:
+            compress_time = 0.0
+
+        logging.info(
+            f"Retrieval stages: fetch={round(fetch_time, ndigits=3)}s; "
+            f"compress={round(compress_time, ndigits=3)}s; documents={len(documents)}"
+        )
+        return documents
@@ -14,4 +14,19 @@ CHAIN_TYPE_STUFF="stuff"
 CHAIN_TYPE_MAP_REDUCE="map_reduce"
 CHAIN_TYPE_MAP_RERANK="map_rerank"
 
-CACHE_DIR="./model_cache/"
\ No newline at end of file
+CACHE_DIR="./model_cache/"
+
+# Retrieval stages: the vectorstore fetches a wide set of candidates cheaply,
+# the cross-encoder re-scores them and only the best few go to the prompt.
+RETRIEVAL_FETCH_K = 20
+RERANK_TOP_N = 4
+RERANK_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_BATCH_SIZE = 16
+RERANK_MAX_LENGTH = 512
+# Dynamic int8 quantization of the cross-encoder linear layers for faster CPU inference
+RERANK_QUANTIZE = True
+
+# Extractive compression of the retrieved context: only the sentences most similar to the question are kept
+CONTEXT_COMPRESSION = True
+COMPRESSION_TOKEN_BUDGET = 1024
+COMPRESSION_MIN_SENTENCE_CHARS = 20
@@ -1,31 +1,26 @@
 # Copyright (c) EGOGE - All Rights Reserved.
 # This software may be used and distributed according to the terms of the Apache-2.0 license.
 import logging
-from langchain.chains import RetrievalQA
-from langchain_community.vectorstores import Chroma
-from langchain_community.llms import HuggingFacePipeline, LlamaCpp
-from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
-from langchain.callbacks.manager import CallbackManager
-
-
-from transformers import (
-    GenerationConfig,
-    pipeline,
-)
+import os
+from langchain_core.vectorstores import VectorStore
+from langchain_core.callbacks import CallbackManager, StreamingStdOutCallbackHandler
 
 # Local API
-from models.models_constants import N_CTX
-from models.awq_lm import load_gptq_model as awq
-from models.gguf_lm import load_gguf_model as gguf
-from models.gptq_lm import load_gptq_model as qptq
-from models.pretrained_lm import load_pretrained_model as pretrained
+# LLM backends, re-ranking and LangChain chains are imported on use, 
+# so only the selected backend is loaded.
+from models.models_constants import INFERENCE_DAEMON_SOCKET_ENV, N_CTX
 
 from models.retrieval_constants import (
     AWQ_EXTENSION, 
     CACHE_DIR, 
     CHAIN_TYPE_STUFF,
+    COMPRESSION_TOKEN_BUDGET,
+    CONTEXT_COMPRESSION,
     GGML_EXTENSION, 
-    GGUF_EXTENSION
+    GGUF_EXTENSION,
+    RERANK_BATCH_SIZE,
+    RERANK_TOP_N,
+    RETRIEVAL_FETCH_K
 )
 
 CALLBACK_MANAGER = CallbackManager([StreamingStdOutCallbackHandler()])
@@ -40,25 +35,40 @@ Parameters:
      model_basename (str) 
      device_type (str)
 
+If the INFERENCE_DAEMON_SOCKET environment variable is set, LLM resident in the local inference daemon is used.
+
 Returns:
-   - LLM: (LlamaCpp) for GGUF/GGML; otherwise - (HuggingFacePipeline)
+   - LLM: (RemoteLLM) if the inference daemon is set; (LlamaCpp) for GGUF/GGML; otherwise - (HuggingFacePipeline)
     
 See https://huggingface.co/docs/transformers/    
 """
 def create_model(model_info):
+    daemon_socket = os.getenv(INFERENCE_DAEMON_SOCKET_ENV)
+    if daemon_socket:
+        from models.inference_daemon import RemoteLLM
+        logging.info(f"Using LLM '{model_info.model_id}' of the inference daemon on {daemon_socket}")
+        return RemoteLLM(socket_path=daemon_socket, model_id=model_info.model_id)
+
     logging.info(f"Creating Model Pipeline - '{model_info.model_id}/{model_info.model_basename}' on '{model_info.device_type}'")
        
     if model_info.model_basename is not None:
         lowercaseFileName = model_info.model_basename.lower() 
         if lowercaseFileName.endswith(GGUF_EXTENSION) or lowercaseFileName.endswith(GGML_EXTENSION):
+            from models.gguf_lm import load_gguf_model as gguf
             return gguf(model_info, cache_dir=CACHE_DIR)
         elif lowercaseFileName.endswith(AWQ_EXTENSION):
+            from models.awq_lm import load_gptq_model as awq
             tokenizer, model = awq(model_info)
         else:
+            from models.gptq_lm import load_gptq_model as qptq
             tokenizer, model = qptq(model_info)
     else:
+        from models.pretrained_lm import load_pretrained_model as pretrained
         tokenizer, model = pretrained(model_info, cache_dir=CACHE_DIR)
 
+    from transformers import GenerationConfig, pipeline
+    from langchain_community.llms import HuggingFacePipeline
+
     generation_config = GenerationConfig.from_pretrained(model_info.model_id)
     pipe = pipeline(
         "text-generation",
@@ -76,10 +86,99 @@ def create_model(model_info):
 
     return local_llm
 
+"""
+Creates the staged retriever: the vectorstore fetches RETRIEVAL_FETCH_K candidates,
+the cross-encoder re-ranks them keeping the best RERANK_TOP_N, and the extractive compressor 
+keeps only the sentences relevant to the question within the context token budget.
+If the cross-encoder cannot be loaded, the vectorstore fetches only RERANK_TOP_N candidates. 
+
+Parameters:
+- vectorstore (VectorStore): the vectorstore
+- context_budget (int): the token budget of the retrieved {context}
+- count_tokens (callable): the function counting tokens with the LLM tokenizer
+- count_tokens_batch (callable): the function counting tokens of many texts at once, if LLM supports it
+
+Returns:
+- BaseRetriever: the retriever
+"""
+def create_retriever(vectorstore, context_budget=None, count_tokens=None, count_tokens_batch=None):
+    from langchain.retrievers.document_compressors import DocumentCompressorPipeline
+    from models.context_compressor import ExtractiveContextCompressor
+    from models.reranker import CrossEncoderReranker, StagedRetriever, load_cross_encoder
+
+    compressors = []
+    search_k = RETRIEVAL_FETCH_K
+    compress_context = CONTEXT_COMPRESSION and count_tokens is not None
+    try:
+        compressors.append(
+            CrossEncoderReranker(
+                cross_encoder=load_cross_encoder(),
+                top_n=RERANK_TOP_N,
+                batch_size=RERANK_BATCH_SIZE,
+                # the compressor enforces the token budget if it is on
+                token_budget=None if compress_context else context_budget,
+                count_tokens=count_tokens
+            )
+        )
+    except Exception as e:
+        logging.warning(f"Failed to load the cross-encoder, re-ranking is off: {str(e)}")
+        search_k = RERANK_TOP_N
+
+    if compress_context:
+        token_budget = COMPRESSION_TOKEN_BUDGET if context_budget is None else min(COMPRESSION_TOKEN_BUDGET, context_budget)
+        compressors.append(
+            ExtractiveContextCompressor(
+                embeddings=vectorstore.embeddings,
+                count_tokens=count_tokens,
+                count_tokens_batch=count_tokens_batch,
+                token_budget=token_budget
+            )
+        )
+
+    base_retriever = vectorstore.as_retriever(search_kwargs={"k": search_k})
+    if not compressors:
+        return base_retriever
+
+    return StagedRetriever(
+        base_compressor=compressors[0] if len(compressors) == 1 else DocumentCompressorPipeline(transformers=compressors),
+        base_retriever=base_retriever
+    )
+
+"""
+Retrieves the documents for many queries at once: all queries are embedded in one batched forward pass
+and the vectorstore collection is searched with all query embeddings in one call.
+
+Parameters:
+- vectorstore (VectorStore): the vectorstore of any backend: its '_collection' has the API of the Chroma collection
+- queries (List[str]): the queries
+- k (int): the number of documents per query
+- with_scores (bool): the flag indicating if (Document, distance) pairs are returned
+
+Returns:
+- List[List[Document]]: the documents of every query in the order of the queries
+"""
+def batch_retrieve(vectorstore, queries, k=RERANK_TOP_N, with_scores=False):
+    from langchain_core.documents import Document
+    from models.embedding_registry import embed_queries
+
+    if not queries:
+        return []
+    query_embeddings = embed_queries(vectorstore.embeddings, queries)
+    results = vectorstore._collection.query(
+        query_embeddings=query_embeddings, 
+        n_results=k, 
+        include=["documents", "metadatas", "distances"]
+    )
+    batch_documents = []
+    for texts, metadatas, distances in zip(results["documents"], results["metadatas"], results["distances"]):
+        documents = [Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(texts, metadatas)]
+        batch_documents.append(list(zip(documents, distances)) if with_scores else documents)
+    return batch_documents
+
 """
 Create the retrieval framework for the QA chat application.
 
-The  framework uses RetrievalQA referencing HuggingFaceInstructEmbeddings and the spcified Chroma vectorstore. 
+The  framework uses RetrievalQA referencing HuggingFaceInstructEmbeddings and the spcified vectorstore. 
 
 Parameters:
 - model_info (map): the map storing the information about LLM:
@@ -91,23 +190,37 @@ Parameters:
     system_prompt (str): the system prompt instructions 
     template_type (str): the promp template type: 'llama', 'mistral'
     use_history (bool): the flag indicating if the chat history is on     
-- vectorstore (Chroma): the vectorstore
+- vectorstore (VectorStore): the vectorstore
 
 Returns:
 - RetrievalQA: the retrieval framewor
 """
 def create_retrieval_qa(model_info, prompt_info, vectorstore):
 
-    if not isinstance(vectorstore, Chroma):
-        raise TypeError("vectorstore must be of type Chroma")
-        
-    retriever = vectorstore.as_retriever()
+    if not isinstance(vectorstore, VectorStore):
+        raise TypeError("vectorstore must be of type VectorStore")
+
+    from langchain.chains import RetrievalQA
+    from models.token_budget import PromptTokenLogger, compute_token_budget
 
     # load the LLM
     llm = create_model(model_info=model_info)
-
-    # get the prompt template and memory if set by the user.
-    prompt, memory = prompt_info.get_prompt_template()
+    if llm is None:
+        raise ValueError(f"Failed to create LLM for '{model_info}'")
+    llm.callbacks = [PromptTokenLogger(count_tokens=llm.get_num_tokens)]
+
+    # get the prompt template and memory if set by the user;
+    # the chat history is bounded by the token budget of LLM.
+    prompt, memory = prompt_info.get_prompt_template(llm=llm)
+
+    # the retrieved context is re-ranked and bounded by its share of the token budget
+    context_budget, _ = compute_token_budget(llm=llm, prompt=prompt)
+    retriever = create_retriever(
+        vectorstore,
+        context_budget=context_budget,
+        count_tokens=llm.get_num_tokens,
+        count_tokens_batch=getattr(llm, "get_num_tokens_batch", None)
+    )
 
     if prompt_info.use_history:
         qa = RetrievalQA.from_chain_type(
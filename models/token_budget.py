@@ -0,0 +1,108 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the Apache-2.0 license.
+import logging
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from langchain.memory.summary_buffer import ConversationSummaryBufferMemory
+from langchain_core.prompts import PromptTemplate
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+
+from .models_constants import (
+    N_CTX,
+    ANSWER_TOKEN_RESERVE,
+    CONTEXT_TOKEN_SHARE,
+    HISTORY_WINDOW_TURNS
+)
+
+
+def compute_token_budget(llm, prompt: PromptTemplate, n_ctx: int = N_CTX) -> Tuple[int, int]:
+    """
+    Splits the model context window into the token budgets for the retrieved context and the chat history.
+
+    The fixed part of the prompt (the system prompt and instructions) and the answer reserve are taken first;
+    the retrieved {context} always keeps CONTEXT_TOKEN_SHARE of the remaining tokens, the rest goes to {history}.
+
+    Parameters:
+    - llm (BaseLanguageModel): the LLM which tokenizer is used to count tokens
+    - prompt (PromptTemplate): the QA prompt template
+    - n_ctx (int): the size of the model context window
+
+    Returns:
+    - (int, int): the token budgets for the retrieved context and the chat history
+    """
+    variables = {name: "" for name in prompt.input_variables}
+    prompt_tokens = llm.get_num_tokens(prompt.format(**variables))
+    available_tokens = max(0, n_ctx - ANSWER_TOKEN_RESERVE - prompt_tokens)
+    context_budget = int(available_tokens * CONTEXT_TOKEN_SHARE)
+    history_budget = available_tokens - context_budget
+    logging.info(
+        f"Prompt token budget of {n_ctx}: template={prompt_tokens}; answer={ANSWER_TOKEN_RESERVE}; "
+        f"context={context_budget}; history={history_budget}"
+    )
+    return context_budget, history_budget
+
+
+class TokenBudgetMemory(ConversationSummaryBufferMemory):
+    """
+    Chat history bounded by the token budget: a sliding window of the latest turns plus a rolling summary.
+
+    The latest `window_turns` question/answer turns are kept verbatim; older turns are folded into
+    the rolling summary by the LLM. The summary and the verbatim turns together never exceed `max_token_limit`
+    tokens counted with the model tokenizer, so the {history} part of the prompt stays flat however long the chat is.
+    """
+    window_turns: int = HISTORY_WINDOW_TURNS
+
+    def _count_tokens(self, messages: List[BaseMessage]) -> int:
+        return self.llm.get_num_tokens_from_messages(messages) if messages else 0
+
+    def prune(self) -> None:
+        buffer = self.chat_memory.messages
+        pruned_memory = []
+        # Sliding window: every turn is a pair of the human and AI messages
+        while len(buffer) > self.window_turns * 2:
+            pruned_memory.append(buffer.pop(0))
+
+        summary_tokens = self.llm.get_num_tokens(self.moving_summary_buffer) if self.moving_summary_buffer else 0
+        while buffer and self._count_tokens(buffer) + summary_tokens > self.max_token_limit:
+            pruned_memory.append(buffer.pop(0))
+
+        if pruned_memory:
+            self.moving_summary_buffer = self.predict_new_summary(pruned_memory, self.moving_summary_buffer)
+            self.trim_summary(token_limit=self.max_token_limit - self._count_tokens(buffer))
+
+    def trim_summary(self, token_limit: int) -> None:
+        """Cuts the oldest part of the rolling summary if it alone does not fit the remaining budget."""
+        summary = self.moving_summary_buffer
+        summary_tokens = self.llm.get_num_tokens(summary) if summary else 0
+        if summary_tokens <= token_limit:
+            return
+        if token_limit <= 0:
+            self.moving_summary_buffer = ""
+            return
+        # Tokens are roughly proportional to characters; keep the most recent part of the summary
+        keep_chars = int(len(summary) * token_limit / summary_tokens)
+        self.moving_summary_buffer = summary[-keep_chars:]
+
+
+class PromptTokenLogger(BaseCallbackHandler):
+    """Logs the number of prompt tokens and the LLM latency for every call of LLM."""
+
+    def __init__(self, count_tokens: Callable[[str], int], n_ctx: int = N_CTX):
+        self.count_tokens = count_tokens
+        self.n_ctx = n_ctx
+        self.llm_runs: Dict[Any, Tuple[float, int]] = {}
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id, **kwargs: Any) -> None:
+        prompt_tokens = sum(self.count_tokens(prompt) for prompt in prompts)
+        self.llm_runs[run_id] = (time.time(), prompt_tokens)
+
+    def on_llm_end(self, response, *, run_id, **kwargs: Any) -> None:
+        llm_run = self.llm_runs.pop(run_id, None)
+        if llm_run:
+            start_time, prompt_tokens = llm_run
+            logging.info(f"Prompt tokens: {prompt_tokens} of {self.n_ctx}; LLM latency: {round(time.time() - start_time, ndigits=2)} seconds")
+
+    def on_llm_error(self, error: BaseException, *, run_id, **kwargs: Any) -> None:
+        self.llm_runs.pop(run_id, None)
@@ -0,0 +1,90 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the Apache-2.0 license.
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Dict
+
+from .service_constants import MAX_PENDING_QUESTIONS, MAX_PENDING_QUESTIONS_PER_SUBJECT
+
+# The events streamed to the client of the question
+QUEUED_EVENT = "queued"
+TOKEN_EVENT = "token"
+DONE_EVENT = "done"
+ERROR_EVENT = "error"
+
+
+class QueueFullError(Exception):
+    """Raised when the question cannot be admitted: the service is at its capacity."""
+
+
+class QuestionJob:
+    """The question of the student on the way through the retrieval and the generation."""
+
+    def __init__(self, subject: str, question: str, session_id: str):
+        self.subject = subject
+        self.question = question
+        # The chat history of the client: several clients of one subject do not share their histories
+        self.session_id = session_id
+        self.start_time = time.time()
+        self.documents = []
+        # The streamed events: (event, data)
+        self.events = asyncio.Queue()
+        # Set when the client is gone, so its answer is not generated
+        self.cancelled = False
+
+    def send(self, event: str, data: Dict):
+        self.events.put_nowait((event, data))
+
+
+class FairQuestionScheduler:
+    """
+    Schedules the retrieved questions for the generation round-robin across the subjects,
+    so the study group of one subject cannot starve the others.
+
+    The scheduler also bounds the number of the pending questions, in total and per subject;
+    a question which does not fit is rejected instead of queued (backpressure).
+    """
+
+    def __init__(self, max_pending: int = MAX_PENDING_QUESTIONS, max_pending_per_subject: int = MAX_PENDING_QUESTIONS_PER_SUBJECT):
+        self.max_pending = max_pending
+        self.max_pending_per_subject = max_pending_per_subject
+        self.pending = 0
+        self.subject_pending: Dict[str, int] = {}
+        self.subject_queues: "OrderedDict[str, deque]" = OrderedDict()
+        self.available = asyncio.Event()
+
+    def admit(self, subject: str):
+        """Reserves the slot for the new question of the subject; raises QueueFullError if there is none."""
+        if self.pending >= self.max_pending:
+            raise QueueFullError(f"The service is busy: {self.pending} questions are pending")
+        if self.subject_pending.get(subject, 0) >= self.max_pending_per_subject:
+            raise QueueFullError(f"Too many pending questions of '{subject}'")
+        self.pending += 1
+        self.subject_pending[subject] = self.subject_pending.get(subject, 0) + 1
+
+    def release(self, subject: str):
+        """Frees the slot of the answered, failed or cancelled question."""
+        self.pending -= 1
+        self.subject_pending[subject] -= 1
+        if self.subject_pending[subject] == 0:
+            del self.subject_pending[subject]
+
+    def put(self, job: QuestionJob):
+        self.subject_queues.setdefault(job.subject, deque()).append(job)
+        self.available.set()
+
+    async def get(self) -> QuestionJob:
+        while not self.subject_queues:
+            self.available.clear()
+            await self.available.wait()
+        subject, jobs = next(iter(self.subject_queues.items()))
+        job = jobs.popleft()
+        # Round-robin: the subject goes to the end of the line
+        del self.subject_queues[subject]
+        if jobs:
+            self.subject_queues[subject] = jobs
+        return job
+
+    def waiting(self) -> int:
+        return sum(len(jobs) for jobs in self.subject_queues.values())
@@ -0,0 +1,23 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the Apache-2.0 license.
+
+DEFAULT_SERVICE_HOST = "127.0.0.1"
+DEFAULT_SERVICE_PORT = 8765
+
+# Backpressure: the maximum number of questions waiting for retrieval or generation;
+# new questions are rejected with 503 when it is reached
+MAX_PENDING_QUESTIONS = 64
+# The maximum number of waiting questions per subject, so one subject cannot take the whole queue
+MAX_PENDING_QUESTIONS_PER_SUBJECT = 16
+# Seconds suggested to the rejected clients before retrying
+RETRY_AFTER_SECONDS = 5
+
+# The questions arriving within the wait (seconds) are retrieved in one batch of up to the batch size
+RETRIEVAL_BATCH_SIZE = 32
+RETRIEVAL_BATCH_WAIT = 0.02
+
+# The maximum number of chat histories kept: the least recently used session forgets its history
+MAX_SESSION_MEMORIES = 256
+
+# The maximum size of HTTP request body in bytes
+MAX_REQUEST_BODY_SIZE = 64 * 1024
@@ -0,0 +1,345 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the Apache-2.0 license.
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+
+from embeddings.embedding_database import load_vector_store
+from embeddings.embeddings_constants import DEFAULT_LLM_FOLDER, STUDY_STREAM_COLLECTION_NAME
+from models.model_info import ModelInfo
+from models.prompt_info import PromptInfo
+from models.retrieval_constants import RERANK_TOP_N
+from models.retrieval_qa import batch_retrieve, create_model, create_retriever
+from models.token_budget import PromptTokenLogger, TokenBudgetMemory, compute_token_budget
+
+from .question_scheduler import (
+    DONE_EVENT,
+    ERROR_EVENT,
+    QUEUED_EVENT,
+    TOKEN_EVENT,
+    FairQuestionScheduler,
+    QueueFullError,
+    QuestionJob
+)
+from .service_constants import (
+    DEFAULT_SERVICE_HOST,
+    DEFAULT_SERVICE_PORT,
+    MAX_REQUEST_BODY_SIZE,
+    MAX_SESSION_MEMORIES,
+    RETRIEVAL_BATCH_SIZE,
+    RETRIEVAL_BATCH_WAIT,
+    RETRY_AFTER_SECONDS
+)
+
+ROOT_DIR = os.path.join(os.path.dirname(__file__), '..')
+ENV_PATH = os.path.join(ROOT_DIR, 'profiles', '.env')
+APP_DIR = os.path.join(ROOT_DIR, 'app')
+APP_CONFIG_PATH = os.path.join(APP_DIR, 'app_config.json')
+
+
+class StudyStreamQAService:
+    """
+    The headless question answering over the vectorstore for the whole study group.
+
+    The questions are retrieved in batches on the retrieval thread, then answered one by one on the generation thread
+    in the round-robin order across the subjects; every client session has its own chat history,
+    and only the most recently used sessions keep it.
+    The retrieval of the next batch overlaps with the generation of the current answer.
+    """
+
+    def __init__(self, model_info: ModelInfo, prompt_info: PromptInfo, vectorstore):
+        self.vectorstore = vectorstore
+        self.use_history = prompt_info.use_history
+        self.llm = create_model(model_info=model_info)
+        if self.llm is None:
+            raise ValueError(f"Failed to create LLM for '{model_info}'")
+        self.llm.callbacks = [PromptTokenLogger(count_tokens=self.llm.get_num_tokens)]
+
+        # The prompt without memory: the chat history is kept per session
+        self.prompt, _ = prompt_info.get_prompt_template()
+        context_budget, self.history_budget = compute_token_budget(llm=self.llm, prompt=self.prompt)
+        self.retriever = create_retriever(
+            vectorstore,
+            context_budget=context_budget,
+            count_tokens=self.llm.get_num_tokens,
+            count_tokens_batch=getattr(self.llm, "get_num_tokens_batch", None)
+        )
+        base_retriever = getattr(self.retriever, "base_retriever", self.retriever)
+        self.search_k = base_retriever.search_kwargs.get("k", RERANK_TOP_N)
+        self.compressor = getattr(self.retriever, "base_compressor", None)
+
+        self.memories: "OrderedDict[str, TokenBudgetMemory]" = OrderedDict()
+        self.scheduler = None
+        self.retrieval_queue = None
+        self.retrieval_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retrieval")
+        self.generation_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="generation")
+
+    def start(self):
+        """Starts the retrieval and generation loops in the running event loop."""
+        self.scheduler = FairQuestionScheduler()
+        self.retrieval_queue = asyncio.Queue()
+        return [
+            asyncio.create_task(self.retrieval_loop()),
+            asyncio.create_task(self.generation_loop())
+        ]
+
+    def ask(self, subject: str, question: str, session_id: str = None) -> QuestionJob:
+        """
+        Admits the question; raises QueueFullError if the service is at its capacity.
+        The question without the session starts a new one: its id is sent back with the queued event.
+        """
+        self.scheduler.admit(subject)
+        job = QuestionJob(subject=subject, question=question, session_id=session_id or uuid.uuid4().hex)
+        self.retrieval_queue.put_nowait(job)
+        job.send(QUEUED_EVENT, {"pending": self.scheduler.pending, "session": job.session_id})
+        return job
+
+    def stats(self) -> Dict:
+        return {
+            "pending": self.scheduler.pending,
+            "retrieving": self.retrieval_queue.qsize(),
+            "generating": self.scheduler.waiting(),
+            "sessions": len(self.memories)
+        }
+
+    def retrieve(self, questions: List[str]) -> List[List[Document]]:
+        start_time = time.time()
+        candidates = batch_retrieve(self.vectorstore, questions, k=self.search_k)
+        fetch_time = time.time() - start_time
+        if self.compressor is not None:
+            candidates = [
+                list(self.compressor.compress_documents(documents, question)) if documents else []
+                for question, documents in zip(questions, candidates)
+            ]
+        logging.info(f"Retrieved {len(questions)} questions in one batch: fetch={round(fetch_time, ndigits=3)}s; total={round(time.time() - start_time, ndigits=3)}s")
+        return candidates
+
+    def get_memory(self, session_id: str) -> TokenBudgetMemory:
+        # Only called on the generation thread
+        memory = self.memories.get(session_id)
+        if memory is not None:
+            self.memories.move_to_end(session_id)
+            return memory
+        memory = TokenBudgetMemory(llm=self.llm, max_token_limit=self.history_budget, input_key="question", memory_key="history")
+        self.memories[session_id] = memory
+        if len(self.memories) > MAX_SESSION_MEMORIES:
+            self.memories.popitem(last=False)
+        return memory
+
+    def generate(self, job: QuestionJob, emit) -> str:
+        variables = {
+            "context": "\n\n".join(document.page_content for document in job.documents),
+            "question": job.question
+        }
+        memory = self.get_memory(job.session_id) if self.use_history else None
+        if memory is not None:
+            variables["history"] = memory.load_memory_variables({})["history"]
+
+        chunks = []
+        for chunk in self.llm.stream(self.prompt.format(**variables)):
+            if job.cancelled:
+                break
+            chunks.append(chunk)
+            emit(chunk)
+        answer = "".join(chunks)
+        if memory is not None and not job.cancelled:
+            memory.save_context({"question": job.question}, {"result": answer})
+        return answer
+
+    async def retrieval_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.retrieval_queue.get()]
+            deadline = loop.time() + RETRIEVAL_BATCH_WAIT
+            while len(batch) < RETRIEVAL_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.retrieval_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            for job in batch:
+                if job.cancelled:
+                    self.scheduler.release(job.subject)
+            batch = [job for job in batch if not job.cancelled]
+            if not batch:
+                continue
+            try:
+                documents = await loop.run_in_executor(self.retrieval_executor, self.retrieve, [job.question for job in batch])
+            except Exception as e:
+                logging.error(f"Failed to retrieve {len(batch)} questions: {str(e)}", exc_info=True)
+                for job in batch:
+                    job.send(ERROR_EVENT, {"error": str(e)})
+                    self.scheduler.release(job.subject)
+                continue
+            for job, job_documents in zip(batch, documents):
+                job.documents = job_documents
+                self.scheduler.put(job)
+
+    async def generation_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.scheduler.get()
+            if job.cancelled:
+                self.scheduler.release(job.subject)
+                continue
+
+            def emit(token, job=job):
+                loop.call_soon_threadsafe(job.send, TOKEN_EVENT, {"token": token})
+
+            try:
+                answer = await loop.run_in_executor(self.generation_executor, self.generate, job, emit)
+                job.send(DONE_EVENT, {
+                    "answer": answer,
+                    "sources": [document.metadata.get("source") for document in job.documents],
+                    "latency": round(time.time() - job.start_time, ndigits=3)
+                })
+            except Exception as e:
+                logging.error(f"Failed to answer the question of '{job.subject}': {str(e)}", exc_info=True)
+                job.send(ERROR_EVENT, {"error": str(e)})
+            finally:
+                self.scheduler.release(job.subject)
+
+
+class StudyStreamHttpServer:
+    """
+    The minimal HTTP/1.1 front of StudyStreamQAService:
+    - POST /ask {"subject": str, "question": str, "session": str (optional)} streams the answer as the server-sent events;
+    - GET /health returns the queue statistics.
+    """
+
+    def __init__(self, qa_service: StudyStreamQAService, host: str, port: int):
+        self.qa_service = qa_service
+        self.host = host
+        self.port = port
+
+    async def serve(self):
+        self.qa_service.start()
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        logging.info(f"The StudyStream QA service is listening on http://{self.host}:{self.port}")
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            method, path, headers, body = await self.read_request(reader)
+            if method == "GET" and path == "/health":
+                self.write_json(writer, 200, "OK", self.qa_service.stats())
+            elif method == "POST" and path == "/ask":
+                await self.ask(writer, body)
+            else:
+                self.write_json(writer, 404, "Not Found", {"error": f"Unknown resource: {method} {path}"})
+            await writer.drain()
+        except (ValueError, KeyError, asyncio.IncompleteReadError) as e:
+            self.write_json(writer, 400, "Bad Request", {"error": str(e)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader: asyncio.StreamReader):
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        method, path, _ = request_line.split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        content_length = int(headers.get("content-length", 0))
+        if content_length > MAX_REQUEST_BODY_SIZE:
+            raise ValueError(f"The request body exceeds {MAX_REQUEST_BODY_SIZE} bytes")
+        body = await reader.readexactly(content_length) if content_length else b""
+        return method, path, headers, body
+
+    async def ask(self, writer: asyncio.StreamWriter, body: bytes):
+        request = json.loads(body.decode("utf-8"))
+        subject, question = str(request["subject"]), str(request["question"]).strip()
+        session_id = request.get("session")
+        if not question:
+            raise ValueError("The question is empty")
+        try:
+            job = self.qa_service.ask(subject=subject, question=question, session_id=str(session_id) if session_id else None)
+        except QueueFullError as e:
+            self.write_json(writer, 503, "Service Unavailable", {"error": str(e)}, {"Retry-After": str(RETRY_AFTER_SECONDS)})
+            return
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        try:
+            while True:
+                event, data = await job.events.get()
+                writer.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+                await writer.drain()
+                if event in (DONE_EVENT, ERROR_EVENT):
+                    break
+        except ConnectionError:
+            # The client is gone: its question is not answered
+            job.cancelled = True
+            raise
+
+    def write_json(self, writer: asyncio.StreamWriter, status: int, reason: str, data: Dict, headers: Dict = None):
+        payload = json.dumps(data).encode("utf-8")
+        extra_headers = "".join(f"{name}: {value}\r\n" for name, value in (headers or {}).items())
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"{extra_headers}"
+            f"Connection: close\r\n\r\n".encode("latin-1") + payload
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+    load_dotenv(dotenv_path=ENV_PATH)
+
+    # Create the parser
+    parser = argparse.ArgumentParser(description="Running the headless StudyStream question answering service.")
+
+    # Add the arguments
+    parser.add_argument('--host', type=str, help='The host to listen on.', default=DEFAULT_SERVICE_HOST)
+    parser.add_argument('--port', type=int, help='The port to listen on.', default=DEFAULT_SERVICE_PORT)
+    parser.add_argument('--persist_directory', type=str, help='The vectorstore directory; LLM_FOLDER by default.', default=None)
+    parser.add_argument('--collection_name', type=str, help='The name of embedding vectorstore.', default=STUDY_STREAM_COLLECTION_NAME)
+
+    # Parse the arguments
+    args = parser.parse_args()
+
+    with open(APP_CONFIG_PATH, 'r') as file:
+        app_config = json.load(file)
+
+    model_info = ModelInfo()
+    prompt_info = PromptInfo(system_prompt=app_config["system_prompt"], template_type=None, use_history=True)
+    persist_directory = args.persist_directory
+    if not persist_directory:
+        # The same vectorstore as the app, which resolves LLM_FOLDER relative to its directory
+        persist_directory = os.path.join(APP_DIR, os.getenv("LLM_FOLDER") or DEFAULT_LLM_FOLDER)
+    docs_db = load_vector_store(
+        model_name=model_info.model_name,
+        collection_name=args.collection_name,
+        persist_directory=persist_directory
+    )
+    qa_service = StudyStreamQAService(model_info=model_info, prompt_info=prompt_info, vectorstore=docs_db)
+    asyncio.run(StudyStreamHttpServer(qa_service, host=args.host, port=args.port).serve())
@@ -0,0 +1,8 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the Apache-2.0 license.
+from sqlalchemy.ext.declarative import declarative_base
+
+"""
+The declarative base of all Study Stream entities.
+"""
+Base = declarative_base()
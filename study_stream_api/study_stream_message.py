@@ -2,17 +2,30 @@
 # This software may be used and distributed according to the terms of the Apache-2.0 license.
 from datetime import datetime
 import pytz
+from sqlalchemy import Column, Integer, Text, ForeignKey, TIMESTAMP, SmallInteger
 from .study_stream_message_type import StudyStreamMessageType
+from .study_stream_base import Base
 
 """
 Stores the information of user interaction and messaging with the Study Stream application. 
+The messages of a subject are append-only: 'seq' is the position of the message in the subject's note.
 """
-class StudyStreamMessage:
+class StudyStreamMessage(Base):
+    __tablename__ = 'study_stream_message'
+
+    id = Column(Integer, primary_key=True)
+    subject_id = Column(Integer, ForeignKey('study_stream_subject.id', ondelete='CASCADE'), nullable=False)
+    seq = Column(Integer, nullable=False)
+    type = Column('message_type', SmallInteger, nullable=False)
+    content = Column(Text, nullable=False)
+    created_at = Column(TIMESTAMP, nullable=False)
 
     def __init__(self, type: StudyStreamMessageType, content: str, creation_time):
         self.type = type.value
         self.content = content
         self.created_at = creation_time
+        # Set when the message is saved
+        self.seq = None
 
     @property
     def school_type_enum(self)-> StudyStreamMessageType:
@@ -23,4 +36,4 @@ class StudyStreamMessage:
             'type': self.type,
             'content': self.content,
             'created_at': self.created_at.isoformat()
-        }
\ No newline at end of file
+        }
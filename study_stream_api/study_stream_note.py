@@ -1,18 +1,14 @@
 # Copyright (c) EGOGE - All Rights Reserved.
 # This software may be used and distributed according to the terms of the Apache-2.0 license.
-from typing import List
-import json
-from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 from sqlalchemy import Column, Integer, String, TIMESTAMP, ForeignKey
 from sqlalchemy.orm import relationship
-from .study_stream_message_type import StudyStreamMessageType
-from .study_stream_message import StudyStreamMessage
-
-Base = declarative_base()
+from .study_stream_base import Base
 
 """
 Stores the information with user's notes, comments, bookamrks amd interactions  wit LLM. 
+The messages are stored in 'study_stream_message' since the notes were migrated; 
+the note of the subject is kept only as the source of the migration.
 """
 class StudyStreamNote(Base):
     __tablename__ = 'study_stream_note'
@@ -31,28 +27,6 @@ class StudyStreamNote(Base):
         self.created_at = created_at
         self.updated_at = updated_at
 
-    def to_messages(self) -> List[StudyStreamMessage]:
-        # Check if json_content is a string and convert to list if needed
-        if isinstance(self.json_content, str):
-            messages_data = json.loads(self.json_content)
-        else:
-            messages_data = self.json_content  # assuming it's already a list
-        messages = []
-        for msg_data in messages_data:
-            message = StudyStreamMessage(                
-                type=StudyStreamMessageType(msg_data['type']),
-                content=msg_data['content'],
-                creation_time=datetime.fromisoformat(msg_data['created_at'])
-            )
-            messages.append(message)
-        messages.sort(key=lambda msg: msg.created_at)
-        return messages
-
-    @staticmethod
-    def messages_to_json(messages: List['StudyStreamMessage']) -> str:
-        messages_dicts = [message.to_dict() for message in messages]
-        return json.dumps(messages_dicts, indent=4)
-
     @staticmethod
     def create(session, note):
         session.add(note)
@@ -36,18 +36,6 @@ class StudyStreamSubject(Base):
         session.commit()
         return subject
     
-    def update_note(self, session, json_content: str):
-        if not self.note:
-            print(f"StudyStreamNote - new")
-            self.note = StudyStreamNote(json_content=json_content, created_at=datetime.now(), updated_at=datetime.now())
-            self.note.subject_id = self.id
-            session.add(self.note)
-        else:
-            print(f"StudyStreamNote - update")
-            self.note.json_content = json_content
-            self.note.updated_at = datetime.now()
-        session.commit()
-
     @staticmethod
     def read(session, subject_id)-> 'StudyStreamSubject':
         return session.query(StudyStreamSubject).filter_by(id=subject_id).first()
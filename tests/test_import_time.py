@@ -0,0 +1,27 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the CC-BY-SA-4.0 license.
+import os
+
+import pytest
+
+from utils.import_time import DEFAULT_FORBIDDEN_MODULES, DEFAULT_MODULES, IMPORT_TIME_BUDGET_MS, measure_import_time
+
+# The startup modules are imported in a fresh interpreter: the modules imported by the other tests do not count
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module", params=DEFAULT_MODULES)
+def imports(request):
+    return request.param, measure_import_time(request.param, ROOT_DIR)
+
+
+def test_no_heavy_backends(imports):
+    module_name, module_imports = imports
+    loaded = {imported_module.split(".")[0] for imported_module, _, _ in module_imports}
+    assert not loaded.intersection(DEFAULT_FORBIDDEN_MODULES), f"'{module_name}' imports the heavy backends at the startup"
+
+
+def test_import_time_budget(imports):
+    module_name, module_imports = imports
+    total_ms = sum(self_time for _, self_time, _ in module_imports) / 1000
+    assert total_ms <= IMPORT_TIME_BUDGET_MS, f"'{module_name}' is imported in {round(total_ms, ndigits=1)} ms"
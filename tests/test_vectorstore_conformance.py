@@ -0,0 +1,267 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the CC-BY-SA-4.0 license.
+import hashlib
+import os
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from embeddings.embedding_database import iter_collection_batches
+from embeddings.vectorstore_backends import (
+    get_distances,
+    open_vector_store,
+    HNSW_CONSTRUCTION_EF,
+    HNSW_SEARCH_EF,
+    LocalVectorStore,
+    VECTORSTORE_BACKENDS,
+    VECTOR_SPACES
+)
+
+# The conformance suite of the vectorstore backends: every backend behaves as Chroma for the API used by the application
+COLLECTION_NAME = "CONFORMANCE_DB"
+SOURCES = ['a.pdf', 'b.pdf', 'c.pdf']
+CHUNK_COUNT = 500
+DIMENSIONS = 64
+# The minimum recall@10 of the approximate backends
+MIN_RECALL = 0.9
+SEED = 0
+LOCAL_BACKENDS = [backend for backend in VECTORSTORE_BACKENDS if backend != 'chroma']
+
+
+class HashEmbeddings(Embeddings):
+    """The deterministic embeddings of the texts: the suite does not load an embedding model."""
+
+    def __init__(self, dimensions: int):
+        self.dimensions = dimensions
+
+    def embed_query(self, text):
+        seed = int(hashlib.sha256(text.encode('utf-8')).hexdigest()[:8], 16)
+        return np.random.default_rng(seed).normal(size=self.dimensions).astype(np.float32).tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+class Fixture:
+    """The vectorstore of the checked backend in a fresh directory with the generated chunks."""
+
+    def __init__(self, backend, directory, collection_metadata=None):
+        self.backend = backend
+        self.directory = directory
+        # Chroma and the hnswlib backend build and search their HNSW index with the same parameters
+        self.collection_metadata = {"hnsw:construction_ef": HNSW_CONSTRUCTION_EF, "hnsw:search_ef": HNSW_SEARCH_EF, **(collection_metadata or {})}
+        random_state = np.random.default_rng(SEED)
+        self.ids = [f"chunk-{index}" for index in range(CHUNK_COUNT)]
+        self.vectors = random_state.normal(size=(CHUNK_COUNT, DIMENSIONS)).astype(np.float32)
+        self.documents = [f"The text of the chunk {index}" for index in range(CHUNK_COUNT)]
+        self.metadatas = [{"source": SOURCES[index % len(SOURCES)], "page": index} for index in range(CHUNK_COUNT)]
+        self.docs_db = self.open()
+
+    def open(self):
+        return open_vector_store(
+            persist_directory=self.directory,
+            collection_name=COLLECTION_NAME,
+            embedding=HashEmbeddings(DIMENSIONS),
+            backend=self.backend,
+            collection_metadata=self.collection_metadata
+        )
+
+    @property
+    def collection(self):
+        return self.docs_db._collection
+
+    def add_all(self):
+        for start in range(0, len(self.ids), 100):
+            self.collection.add(
+                ids=self.ids[start:start + 100],
+                embeddings=self.vectors[start:start + 100].tolist(),
+                metadatas=self.metadatas[start:start + 100],
+                documents=self.documents[start:start + 100]
+            )
+
+    def exact_search(self, query, k):
+        return [self.ids[row] for row in np.argsort(((self.vectors - query) ** 2).sum(axis=1))[:k]]
+
+
+@pytest.fixture(params=VECTORSTORE_BACKENDS)
+def fixture(request, tmp_path):
+    return Fixture(request.param, os.path.join(tmp_path, request.param))
+
+
+def test_add_and_count(fixture):
+    assert fixture.collection.count() == 0, "a new collection is not empty"
+    fixture.add_all()
+    assert fixture.collection.count() == len(fixture.ids)
+
+
+def test_add_keeps_existing(fixture):
+    fixture.add_all()
+    fixture.collection.add(ids=fixture.ids[:5], embeddings=fixture.vectors[5:10].tolist(), metadatas=fixture.metadatas[:5], documents=["changed"] * 5)
+    assert fixture.collection.count() == len(fixture.ids), "adding the existing ids changed the count"
+    found = fixture.collection.get(ids=fixture.ids[:5])
+    assert "changed" not in found['documents'], "adding the existing ids replaced their chunks"
+
+
+def test_get_by_ids(fixture):
+    fixture.add_all()
+    requested = fixture.ids[::7][::-1]
+    found = fixture.collection.get(ids=requested, include=['documents', 'metadatas', 'embeddings'])
+    assert sorted(found['ids']) == sorted(requested)
+    for chunk_id, document, metadata, embedding in zip(found['ids'], found['documents'], found['metadatas'], found['embeddings']):
+        row = fixture.ids.index(chunk_id)
+        assert document == fixture.documents[row], f"the document of '{chunk_id}' differs"
+        assert metadata == fixture.metadatas[row], f"the metadata of '{chunk_id}' differs"
+        assert np.allclose(np.asarray(embedding), fixture.vectors[row], atol=1e-5), f"the embedding of '{chunk_id}' differs"
+
+
+def test_paging(fixture):
+    fixture.add_all()
+    paged_ids = [chunk_id for batch in iter_collection_batches(fixture.collection, batch_size=30, include=[]) for chunk_id in batch['ids']]
+    assert len(paged_ids) == len(fixture.ids) and set(paged_ids) == set(fixture.ids), "the pages do not cover every chunk once"
+
+
+def test_get_where(fixture):
+    fixture.add_all()
+    found = fixture.collection.get(where={"source": SOURCES[1]}, include=['metadatas'])
+    expected = [chunk_id for chunk_id, metadata in zip(fixture.ids, fixture.metadatas) if metadata["source"] == SOURCES[1]]
+    assert sorted(found['ids']) == sorted(expected)
+
+
+def test_upsert(fixture):
+    fixture.add_all()
+    new_vectors = -fixture.vectors[:10]
+    fixture.collection.upsert(ids=fixture.ids[:10], embeddings=new_vectors.tolist(), metadatas=fixture.metadatas[:10], documents=["updated"] * 10)
+    assert fixture.collection.count() == len(fixture.ids), "upsert of the existing ids changed the count"
+    found = fixture.collection.get(ids=fixture.ids[:10], include=['documents', 'embeddings'])
+    assert all(document == "updated" for document in found['documents']), "upsert did not replace the documents"
+    results = fixture.collection.query(query_embeddings=new_vectors[:3].tolist(), n_results=1)
+    assert [ids[0] for ids in results['ids']] == fixture.ids[:3], "the updated vectors are not found"
+
+
+def test_query_self(fixture):
+    fixture.add_all()
+    rows = list(range(0, len(fixture.ids), max(1, len(fixture.ids) // 20)))
+    results = fixture.collection.query(query_embeddings=fixture.vectors[rows].tolist(), n_results=3, include=['documents', 'metadatas', 'distances'])
+    assert len(results['ids']) == len(rows), "query() did not return a result per query"
+    for row, ids, distances, documents in zip(rows, results['ids'], results['distances'], results['documents']):
+        assert ids[0] == fixture.ids[row], f"the stored vector of '{fixture.ids[row]}' is not its own nearest neighbour"
+        assert abs(distances[0]) < 1e-3, f"the distance to itself is {distances[0]}"
+        assert documents[0] == fixture.documents[row], "query() returned another document"
+        assert list(distances) == sorted(distances), "the distances are not sorted"
+
+
+@pytest.mark.parametrize("backend", VECTORSTORE_BACKENDS)
+@pytest.mark.parametrize("space", VECTOR_SPACES)
+def test_query_distances(backend, space, tmp_path):
+    fixture = Fixture(backend, os.path.join(tmp_path, backend), collection_metadata={"hnsw:space": space})
+    fixture.add_all()
+    query = np.random.default_rng(SEED + 1).normal(size=DIMENSIONS).astype(np.float32)
+    results = fixture.collection.query(query_embeddings=[query.tolist()], n_results=5, include=['distances'])
+    rows = [fixture.ids.index(chunk_id) for chunk_id in results['ids'][0]]
+    expected = get_distances(fixture.vectors[rows], query, space)
+    assert np.allclose(results['distances'][0], expected, rtol=1e-3, atol=1e-3), f"the distances are not the '{space}' ones"
+
+
+@pytest.mark.parametrize("backend", LOCAL_BACKENDS)
+def test_unsupported_space(backend, tmp_path):
+    with pytest.raises(ValueError):
+        Fixture(backend, os.path.join(tmp_path, backend), collection_metadata={"hnsw:space": "hamming"})
+
+
+def test_query_where(fixture):
+    fixture.add_all()
+    results = fixture.collection.query(query_embeddings=[fixture.vectors[0].tolist()], n_results=5, where={"source": SOURCES[2]}, include=['metadatas'])
+    assert len(results['ids'][0]) == 5, "query(where) returned fewer chunks"
+    assert all(metadata["source"] == SOURCES[2] for metadata in results['metadatas'][0]), "query(where) returned a chunk of another source"
+
+
+def test_query_more_than_stored(fixture):
+    fixture.collection.add(ids=fixture.ids[:3], embeddings=fixture.vectors[:3].tolist(), metadatas=fixture.metadatas[:3], documents=fixture.documents[:3])
+    results = fixture.collection.query(query_embeddings=[fixture.vectors[0].tolist()], n_results=10)
+    assert sorted(results['ids'][0]) == sorted(fixture.ids[:3]), "query() for more chunks than stored did not return all of them"
+
+
+def assert_recall(fixture, k=10):
+    queries = np.random.default_rng(SEED + 2).normal(size=(50, DIMENSIONS)).astype(np.float32)
+    results = fixture.collection.query(query_embeddings=queries.tolist(), n_results=k, include=['distances'])
+    recall = np.mean([len(set(ids) & set(fixture.exact_search(query, k))) / k for query, ids in zip(queries, results['ids'])])
+    assert recall >= MIN_RECALL, f"recall@{k}={round(recall, ndigits=3)} is below {MIN_RECALL}"
+
+
+def test_recall(fixture):
+    fixture.add_all()
+    assert_recall(fixture)
+
+
+def test_delete(fixture):
+    fixture.add_all()
+    deleted_ids = fixture.ids[:10]
+    fixture.collection.delete(ids=deleted_ids)
+    assert fixture.collection.count() == len(fixture.ids) - 10, "delete(ids) did not remove the chunks"
+    assert fixture.collection.get(ids=deleted_ids)['ids'] == [], "get() returned the deleted chunks"
+    results = fixture.collection.query(query_embeddings=fixture.vectors[:10].tolist(), n_results=3)
+    assert not set(deleted_ids) & {chunk_id for ids in results['ids'] for chunk_id in ids}, "query() returned the deleted chunks"
+    fixture.collection.delete(where={"source": SOURCES[0]})
+    assert fixture.collection.get(where={"source": SOURCES[0]})['ids'] == [], "delete(where) did not remove the chunks"
+
+
+def test_persist_and_reopen(fixture):
+    fixture.add_all()
+    fixture.collection.delete(ids=fixture.ids[:5])
+    fixture.docs_db.persist()
+    fixture.docs_db = fixture.open()
+    assert fixture.collection.count() == len(fixture.ids) - 5, "the reopened vectorstore has another count"
+    results = fixture.collection.query(query_embeddings=fixture.vectors[5:10].tolist(), n_results=1)
+    assert [ids[0] for ids in results['ids']] == fixture.ids[5:10], "the reopened vectorstore does not find the stored vectors"
+
+
+def test_vectorstore_api(fixture):
+    texts = [f"The note about the topic {index}" for index in range(20)]
+    ids = fixture.docs_db.add_texts(texts=texts, metadatas=[{"source": SOURCES[index % len(SOURCES)]} for index in range(20)])
+    assert len(ids) == len(texts), "add_texts() did not return the ids"
+    assert [document.page_content for document in fixture.docs_db.similarity_search(texts[3], k=1)] == [texts[3]]
+    document, score = fixture.docs_db.similarity_search_with_score(texts[4], k=2)[0]
+    assert document.page_content == texts[4] and abs(score) < 1e-3, "similarity_search_with_score() did not find the text"
+    found = fixture.docs_db.similarity_search(texts[5], k=3, filter={"source": SOURCES[5 % len(SOURCES)]})
+    assert found and all(document.metadata["source"] == SOURCES[5 % len(SOURCES)] for document in found), "similarity_search(filter) returned another source"
+    assert fixture.docs_db.as_retriever(search_kwargs={"k": 2}).invoke(texts[6])[0].page_content == texts[6], "the retriever did not find the text"
+
+
+@pytest.mark.parametrize("backend", ['int8', 'pq'])
+def test_trained_quantizer(backend, tmp_path):
+    # The quantizer is trained on the first 100 chunks: the others are searched through the quantized codes
+    fixture = Fixture(backend, os.path.join(tmp_path, backend), collection_metadata={"quantization:sample_size": 100})
+    fixture.add_all()
+    fixture.collection.upsert(ids=fixture.ids[:10], embeddings=(-fixture.vectors[:10]).tolist(), documents=["updated"] * 10)
+    assert len(fixture.collection.index.quantized_index) == len(fixture.ids), "upsert added the existing chunks to the index again"
+    fixture.docs_db.persist()
+    fixture.docs_db = fixture.open()
+    assert fixture.collection.index.quantized_index is not None, "the reopened vectorstore did not load the quantized index"
+    results = fixture.collection.query(query_embeddings=(-fixture.vectors[:3]).tolist(), n_results=1)
+    assert [ids[0] for ids in results['ids']] == fixture.ids[:3], "the updated vectors are not found"
+    assert_recall(fixture)
+
+
+
+@pytest.mark.parametrize("backend", ['int8', 'pq'])
+def test_emptied_quantizer(backend, tmp_path):
+    fixture = Fixture(backend, os.path.join(tmp_path, backend), collection_metadata={"quantization:sample_size": 50})
+    fixture.collection.add(ids=fixture.ids[:60], embeddings=fixture.vectors[:60].tolist(), documents=fixture.documents[:60])
+    fixture.collection.delete(ids=fixture.ids[:60])
+    results = fixture.collection.query(query_embeddings=[fixture.vectors[0].tolist()], n_results=3)
+    assert results['ids'] == [[]], "query() of the emptied collection returned chunks"
+
+
+@pytest.mark.parametrize("backend", LOCAL_BACKENDS)
+def test_from_texts(backend, tmp_path):
+    texts = [f"The note about the topic {index}" for index in range(20)]
+    docs_db = LocalVectorStore.from_texts(
+        texts,
+        HashEmbeddings(DIMENSIONS),
+        metadatas=[{"source": SOURCES[index % len(SOURCES)]} for index in range(20)],
+        persist_directory=os.path.join(tmp_path, backend),
+        backend=backend
+    )
+    assert docs_db._collection.count() == len(texts), "from_texts() did not add the texts"
+    assert [document.page_content for document in docs_db.similarity_search(texts[3], k=1)] == [texts[3]]
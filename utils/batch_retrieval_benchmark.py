@@ -0,0 +1,58 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the CC-BY-SA-4.0 license.
+import argparse
+import sys
+import time
+
+from embeddings.embedding_database import load_vector_store
+from models.retrieval_constants import RERANK_TOP_N
+from models.retrieval_qa import batch_retrieve
+
+
+def main(args):
+    """Utility to compare the batched multi-question retrieval with the sequential retriever loop."""
+
+    with open(args.questions, "r", encoding="utf-8") as file:
+        questions = [line.strip() for line in file if line.strip()]
+
+    docs_db = load_vector_store(model_name=None, collection_name=args.collection_name, persist_directory=args.persist_directory)
+    retriever = docs_db.as_retriever(search_kwargs={"k": args.k})
+    # Warm up the embedding model and the index
+    retriever.invoke(questions[0])
+
+    start_time = time.time()
+    sequential_results = [retriever.invoke(question) for question in questions]
+    sequential_time = time.time() - start_time
+
+    start_time = time.time()
+    batch_results = batch_retrieve(docs_db, questions, k=args.k)
+    batch_time = time.time() - start_time
+
+    matches = sum(
+        1 for sequential, batch in zip(sequential_results, batch_results)
+        if [document.page_content for document in sequential] == [document.page_content for document in batch]
+    )
+    speedup = sequential_time / batch_time if batch_time > 0 else float("inf")
+    print(f"Questions: {len(questions)}; k={args.k}")
+    print(f"Sequential: {round(sequential_time, ndigits=3)} seconds ({round(1000 * sequential_time / len(questions), ndigits=1)} ms per question)")
+    print(f"Batched: {round(batch_time, ndigits=3)} seconds ({round(1000 * batch_time / len(questions), ndigits=1)} ms per question)")
+    print(f"Speedup: {round(speedup, ndigits=2)}x; identical results for {matches} of {len(questions)} questions")
+
+    if args.min_speedup is not None and speedup < args.min_speedup:
+        print(f"The speedup is below {args.min_speedup}x")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    # Create the parser
+    parser = argparse.ArgumentParser(description="Benchmarking the batched multi-question retrieval.")
+
+    # Add the arguments
+    parser.add_argument('--persist_directory', type=str, help='The path to the directory with the vectorstore.')
+    parser.add_argument('--collection_name', type=str, help='The name of embedding vectorstore.', default=None)
+    parser.add_argument('--questions', type=str, help='The text file with one question per line.')
+    parser.add_argument('--k', type=int, help='The number of documents per question.', default=RERANK_TOP_N)
+    parser.add_argument('--min_speedup', type=float, help='(Optional) The minimum expected speedup.', default=None)
+
+    # Parse the arguments
+    main(parser.parse_args())
@@ -0,0 +1,214 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the CC-BY-SA-4.0 license.
+import argparse
+import ctypes
+import os
+import random
+import shutil
+import statistics
+import sys
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+# The DAO reads the database settings at the import time
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', 'profiles', '.env'))
+
+from langchain_core.vectorstores import VectorStore
+
+from db.study_stream_dao import fetch_document_file_paths
+from embeddings.embedding_database import iter_collection_batches
+from embeddings.embeddings_constants import DEFAULT_LLM_FOLDER, DEFAULT_DOCUMENT_FOLDER, STUDY_STREAM_COLLECTION_NAME, BATCH_SIZE
+from embeddings.vectorstore_backends import open_vector_store, get_vectorstore_backend
+
+# The chunk metadata referring to the document file
+SOURCE_METADATA = 'source'
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+# renameat2() flag exchanging two paths atomically (Linux)
+RENAME_EXCHANGE = 2
+AT_FDCWD = -100
+
+
+def open_vectorstore(persist_directory, collection_name, collection_metadata=None, backend=None) -> VectorStore:
+    return open_vector_store(
+        persist_directory=persist_directory,
+        collection_name=collection_name,
+        backend=backend,
+        collection_metadata=collection_metadata,
+    )
+
+
+def get_folder_size(folder_path) -> int:
+    size = 0
+    for root, _, file_names in os.walk(folder_path):
+        for file_name in file_names:
+            size += os.path.getsize(os.path.join(root, file_name))
+    return size
+
+
+def measure_latency(collection, query_embeddings, k):
+    if not query_embeddings:
+        return 0.0, 0.0
+    latencies = []
+    for query_embedding in query_embeddings:
+        start_time = time.perf_counter()
+        collection.query(query_embeddings=[query_embedding], n_results=k)
+        latencies.append(1000 * (time.perf_counter() - start_time))
+    latencies.sort()
+    return statistics.mean(latencies), latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+
+
+def normalize_path(file_path) -> str:
+    return os.path.normcase(os.path.realpath(file_path))
+
+
+def exchange_directories(first_directory, second_directory) -> bool:
+    """Swaps two directories in one atomic rename (Linux renameat2); returns False if it is not supported."""
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        renameat2 = libc.renameat2
+    except (OSError, AttributeError):
+        return False
+    return renameat2(AT_FDCWD, os.fsencode(first_directory), AT_FDCWD, os.fsencode(second_directory), RENAME_EXCHANGE) == 0
+
+
+def report(name, persist_directory, collection, query_embeddings, k):
+    mean_latency, p95_latency = measure_latency(collection, query_embeddings, k)
+    size_mb = get_folder_size(persist_directory) / (1024 * 1024)
+    print(f"{name}: {collection.count()} chunks; {round(size_mb, ndigits=2)} MB; query mean={round(mean_latency, ndigits=2)} ms p95={round(p95_latency, ndigits=2)} ms")
+    return mean_latency
+
+
+def main(args):
+    """
+    Utility to compact the vectorstore: the chunks of the documents deleted from the database are dropped,
+    the remaining chunks, with their embeddings, are written to a new vectorstore with the tuned HNSW index,
+    which replaces the old one. The application must not run meanwhile.
+
+    Only the chunks of the files in the document folder can be orphans: the chunks merged or imported 
+    from other vectorstores are kept.
+    """
+
+    persist_directory = os.path.abspath(args.persist_directory or os.path.join(APP_DIR, os.getenv("LLM_FOLDER") or DEFAULT_LLM_FOLDER))
+    document_folder = normalize_path(args.document_folder or os.path.join(APP_DIR, os.getenv("DOCUMENT_FOLDER") or DEFAULT_DOCUMENT_FOLDER))
+    file_paths = fetch_document_file_paths()
+    if file_paths is None:
+        print("Cannot read the documents from the database; nothing is compacted")
+        sys.exit(1)
+    file_paths = {normalize_path(file_path) for file_path in file_paths}
+
+    def is_kept(metadata) -> bool:
+        source = (metadata or {}).get(SOURCE_METADATA)
+        if not source:
+            return True
+        source = normalize_path(source)
+        return source in file_paths or os.path.commonpath([source, document_folder]) != document_folder
+
+    docs_db = open_vectorstore(persist_directory, args.collection_name)
+    collection = docs_db._collection
+
+    # Find the orphan chunks and sample the query embeddings among the kept ones
+    kept_count = 0
+    orphan_count = 0
+    orphan_sources = set()
+    query_embeddings = []
+    for batch in iter_collection_batches(collection, batch_size=args.batch_size, include=['metadatas', 'embeddings']):
+        for metadata, embedding in zip(batch['metadatas'], batch['embeddings']):
+            if is_kept(metadata):
+                kept_count += 1
+                if len(query_embeddings) < args.queries:
+                    query_embeddings.append(list(embedding))
+                elif random.randrange(kept_count) < args.queries:
+                    query_embeddings[random.randrange(args.queries)] = list(embedding)
+            else:
+                orphan_count += 1
+                orphan_sources.add(metadata[SOURCE_METADATA])
+    print(f"Documents in the database: {len(file_paths)}; chunks to keep: {kept_count}; orphan chunks: {orphan_count} of {len(orphan_sources)} deleted documents")
+    before_latency = report("Before", persist_directory, collection, query_embeddings, args.k)
+    if args.dry_run:
+        return
+    # A wrong database or document folder makes every chunk an orphan: such a compaction must be forced
+    orphan_ratio = orphan_count / max(1, kept_count + orphan_count)
+    if not args.force and (kept_count == 0 or orphan_ratio > args.max_orphan_ratio):
+        print(f"{round(100 * orphan_ratio, ndigits=1)}% of the chunks are orphans (the limit is {round(100 * args.max_orphan_ratio, ndigits=1)}%); "
+              f"check the database and '{document_folder}', or use --force")
+        sys.exit(1)
+
+    # Rebuild the index in a fresh directory next to the current one: the current vectorstore is not changed
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    compact_directory = f"{persist_directory}.compact-{timestamp}"
+    collection_metadata = dict(collection.metadata or {})
+    collection_metadata.update({
+        "hnsw:M": args.hnsw_m,
+        "hnsw:construction_ef": args.hnsw_construction_ef,
+        "hnsw:search_ef": args.hnsw_search_ef
+    })
+    # The compacted vectorstore keeps the backend: its manifest is copied below
+    compact_db = open_vectorstore(compact_directory, args.collection_name, collection_metadata, get_vectorstore_backend(persist_directory))
+    compact_collection = compact_db._collection
+    for batch in iter_collection_batches(collection, batch_size=args.batch_size):
+        kept = [index for index, metadata in enumerate(batch['metadatas']) if is_kept(metadata)]
+        if kept:
+            compact_collection.add(
+                ids=[batch['ids'][index] for index in kept],
+                embeddings=[batch['embeddings'][index] for index in kept],
+                metadatas=[batch['metadatas'][index] for index in kept],
+                documents=[batch['documents'][index] for index in kept]
+            )
+    compact_db.persist()
+    meta_inf_path = os.path.join(persist_directory, 'META-INF')
+    if os.path.exists(meta_inf_path):
+        shutil.copytree(meta_inf_path, os.path.join(compact_directory, 'META-INF'))
+
+    if compact_collection.count() != kept_count:
+        print(f"The compacted vectorstore has {compact_collection.count()} chunks instead of {kept_count}; it is left in '{compact_directory}'")
+        sys.exit(1)
+    after_latency = report("After", compact_directory, compact_collection, query_embeddings, args.k)
+
+    # Swap the directories: the old vectorstore is kept as the backup till it is deleted explicitly
+    backup_directory = f"{persist_directory}.backup-{timestamp}"
+    if exchange_directories(compact_directory, persist_directory):
+        os.rename(compact_directory, backup_directory)
+    else:
+        # Without the atomic exchange, the vectorstore directory is missing between the two renames;
+        # if the second one fails, the old vectorstore is put back
+        os.rename(persist_directory, backup_directory)
+        try:
+            os.rename(compact_directory, persist_directory)
+        except OSError:
+            os.rename(backup_directory, persist_directory)
+            raise
+    print(f"The compacted vectorstore replaced '{persist_directory}'")
+    if args.delete_backup:
+        shutil.rmtree(backup_directory)
+    else:
+        print(f"The old vectorstore is kept in '{backup_directory}'")
+
+    if args.max_latency_ratio is not None and before_latency > 0 and after_latency > args.max_latency_ratio * before_latency:
+        print(f"The query latency after the compaction exceeds {args.max_latency_ratio}x of the latency before it")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    # Create the parser
+    parser = argparse.ArgumentParser(description="Compacting the vectorstore: removing the chunks of the deleted documents and rebuilding the index.")
+
+    # Add the arguments
+    parser.add_argument('--persist_directory', type=str, help='The vectorstore directory; LLM_FOLDER of the app by default.', default=None)
+    parser.add_argument('--document_folder', type=str, help='The folder of the documents; DOCUMENT_FOLDER of the app by default.', default=None)
+    parser.add_argument('--collection_name', type=str, help='The name of embedding vectorstore.', default=STUDY_STREAM_COLLECTION_NAME)
+    parser.add_argument('--batch_size', type=int, help='The number of chunks read and written at once.', default=BATCH_SIZE)
+    parser.add_argument('--hnsw_m', type=int, help='The number of the HNSW links per vector.', default=16)
+    parser.add_argument('--hnsw_construction_ef', type=int, help='The HNSW candidate list size while building the index.', default=200)
+    parser.add_argument('--hnsw_search_ef', type=int, help='The HNSW candidate list size while querying.', default=50)
+    parser.add_argument('--queries', type=int, help='The number of the sampled queries measuring the latency.', default=50)
+    parser.add_argument('--k', type=int, help='The number of chunks per measured query.', default=4)
+    parser.add_argument('--dry_run', action='store_true', help='Only report the orphan chunks, the size and the latency.')
+    parser.add_argument('--max_orphan_ratio', type=float, help='Refuse to compact if a larger share of the chunks are orphans.', default=0.5)
+    parser.add_argument('--force', action='store_true', help='Compact even if no chunk is kept or the orphan ratio is above the limit.')
+    parser.add_argument('--delete_backup', action='store_true', help='Delete the old vectorstore after the swap.')
+    parser.add_argument('--max_latency_ratio', type=float, help='(Optional) Fail if the query latency grows above this ratio.', default=None)
+
+    # Parse the arguments
+    main(parser.parse_args())
@@ -0,0 +1,82 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the CC-BY-SA-4.0 license.
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from dotenv import load_dotenv
+
+# The DAO reads the database settings at the import time
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', 'profiles', '.env'))
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+
+from db import study_stream_dao
+
+
+def measure(name, call, iterations):
+    latencies = []
+    for _ in range(iterations):
+        start_time = time.perf_counter()
+        call()
+        latencies.append(1000 * (time.perf_counter() - start_time))
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+    print(f"  {name:<32} mean={round(statistics.mean(latencies), ndigits=2):>8} ms  p50={round(statistics.median(latencies), ndigits=2):>8} ms  p95={round(p95, ndigits=2):>8} ms")
+    return statistics.mean(latencies)
+
+
+def run_calls(iterations, subject_id):
+    def raw_query():
+        conn = study_stream_dao.get_db_connection()
+        study_stream_dao.table_exists(conn, 'study_stream_note')
+        conn.close()
+
+    return {
+        "fetch_schools_with_counts": measure("fetch_schools_with_document_counts", study_stream_dao.fetch_schools_with_document_counts, iterations),
+        "get_subject": measure("get_subject", lambda: study_stream_dao.get_subject(subject_id), iterations),
+        "raw_connection": measure("get_db_connection + query", raw_query, iterations),
+    }
+
+
+def main(args):
+    """Utility to measure the DAO call latency without the connection pool (NullPool) and with it."""
+
+    pooled_engine = study_stream_dao.engine
+    unpooled_engine = create_engine(pooled_engine.url, poolclass=NullPool)
+
+    # Before: every call opens a new connection
+    print("NullPool (a new connection per call):")
+    study_stream_dao.Session.configure(bind=unpooled_engine)
+    study_stream_dao.engine = unpooled_engine
+    before = run_calls(args.iterations, args.subject_id)
+
+    # After: the connections are reused from the pool
+    print("QueuePool:")
+    study_stream_dao.Session.configure(bind=pooled_engine)
+    study_stream_dao.engine = pooled_engine
+    after = run_calls(args.iterations, args.subject_id)
+    print(f"Pool stats: {study_stream_dao.get_pool_stats()}")
+
+    for call_name, before_latency in before.items():
+        print(f"{call_name}: {round(before_latency / after[call_name], ndigits=2)}x faster with the pool")
+
+    if args.max_mean_ms is not None and max(after.values()) > args.max_mean_ms:
+        print(f"The mean DAO call latency exceeds the budget of {args.max_mean_ms} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    # Create the parser
+    parser = argparse.ArgumentParser(description="Benchmarking the DAO call latency with and without the connection pool.")
+
+    # Add the arguments
+    parser.add_argument('--iterations', type=int, help='The number of calls per DAO function.', default=50)
+    parser.add_argument('--subject_id', type=int, help='The subject fetched by get_subject.', default=1)
+    parser.add_argument('--max_mean_ms', type=float, help='(Optional) The mean latency budget of the pooled DAO calls.', default=None)
+
+    # Parse the arguments
+    main(parser.parse_args())
@@ -0,0 +1,96 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the CC-BY-SA-4.0 license.
+import argparse
+import os
+import subprocess
+import sys
+
+# The startup modules of the application
+DEFAULT_MODULES = ["models.retrieval_qa", "models.prompt_info", "embeddings.embedding_database", "app.study_stream_app"]
+# The heavy backends which must not be loaded at the startup
+DEFAULT_FORBIDDEN_MODULES = ["torch", "transformers", "llama_cpp", "sentence_transformers", "chromadb"]
+# The database settings of the fresh interpreter if they are not set: the DAO creates its engine at the import time,
+# and the engine does not connect till it is used
+PLACEHOLDER_DB_ENV = {
+    "DB_NAME": "study_stream_db",
+    "DB_USER": "study_stream_db_admin",
+    "DB_PASSWORD": "study_stream_db_psw",
+    "DB_HOST": "localhost",
+    "DB_PORT": "5432",
+}
+# The import-time budget of a startup module in milliseconds, enforced by tests/test_import_time.py
+IMPORT_TIME_BUDGET_MS = 2000
+
+
+def measure_import_time(module_name, root_dir):
+    """
+    Imports the module in a fresh interpreter with '-X importtime'.
+
+    Parameters:
+    - module_name (str): the module to import
+    - root_dir (str): the project root directory
+
+    Returns:
+    - (List[(str, int, int)]): the imported modules with their self and cumulative import time in microseconds
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+        cwd=root_dir,
+        env={**PLACEHOLDER_DB_ENV, **os.environ},
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to import '{module_name}':\n{result.stderr[-2000:]}")
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, cumulative_time, imported_module = line[len("import time:"):].split("|")
+        imports.append((imported_module.strip(), int(self_time), int(cumulative_time)))
+    return imports
+
+
+def main(args):
+    """Utility to report the per-module import time of the startup modules and enforce the import-time budget."""
+
+    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    failed = False
+    for module_name in args.modules:
+        imports = measure_import_time(module_name, root_dir)
+        total_ms = sum(self_time for _, self_time, _ in imports) / 1000
+        # The top-level packages, e.g. 'torch', but not 'torch.nn'
+        top_level = sorted(
+            (entry for entry in imports if "." not in entry[0]),
+            key=lambda entry: entry[2],
+            reverse=True
+        )
+        print(f"\n{module_name}: {round(total_ms, ndigits=1)} ms")
+        for imported_module, _, cumulative_time in top_level[:args.top]:
+            print(f"  {round(cumulative_time / 1000, ndigits=1):>10} ms  {imported_module}")
+
+        loaded = {imported_module.split(".")[0] for imported_module, _, _ in imports}
+        forbidden = sorted(loaded.intersection(args.forbidden))
+        if forbidden:
+            print(f"  FAILED: '{module_name}' imports the heavy backends at the startup: {forbidden}")
+            failed = True
+        if args.budget_ms is not None and total_ms > args.budget_ms:
+            print(f"  FAILED: '{module_name}' exceeds the import-time budget of {args.budget_ms} ms")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    # Create the parser
+    parser = argparse.ArgumentParser(description="Measuring the import time of the application startup modules.")
+
+    # Add the arguments
+    parser.add_argument('--modules', nargs='+', help='The modules to import.', default=DEFAULT_MODULES)
+    parser.add_argument('--forbidden', nargs='*', help='The packages which must not be imported.', default=DEFAULT_FORBIDDEN_MODULES)
+    parser.add_argument('--budget_ms', type=float, help='The import-time budget per module in milliseconds.', default=IMPORT_TIME_BUDGET_MS)
+    parser.add_argument('--top', type=int, help='The number of the slowest top-level packages to print.', default=15)
+
+    # Parse the arguments
+    main(parser.parse_args())
@@ -0,0 +1,115 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the CC-BY-SA-4.0 license.
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+
+from service.service_constants import DEFAULT_SERVICE_HOST, DEFAULT_SERVICE_PORT
+
+DEFAULT_QUESTIONS = [
+    "What is the main topic of the document?",
+    "Summarize the key concepts of the first chapter.",
+    "Which definitions are introduced in the lecture notes?",
+    "Explain the example given for the main theorem.",
+]
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))]
+
+
+async def ask(host, port, subject, question):
+    """
+    Sends one question to the QA service and reads the server-sent events till the answer is done.
+
+    Returns:
+    - (str, float, float): the outcome ('done', 'error' or 'rejected'), the time to the first token and the total latency
+    """
+    start_time = time.time()
+    reader, writer = await asyncio.open_connection(host, port)
+    body = json.dumps({"subject": subject, "question": question}).encode("utf-8")
+    writer.write(
+        f"POST /ask HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+
+    status_line = (await reader.readline()).decode("latin-1")
+    outcome = "rejected" if " 503 " in status_line else "error"
+    first_token_time = None
+    if " 200 " in status_line:
+        event = None
+        async for line in reader:
+            line = line.decode("utf-8").rstrip("\n")
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+                if event == "token" and first_token_time is None:
+                    first_token_time = time.time() - start_time
+                if event in ("done", "error"):
+                    outcome = event
+                    break
+    writer.close()
+    latency = time.time() - start_time
+    return outcome, first_token_time or latency, latency
+
+
+async def run_load_test(args, questions):
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited_ask(index):
+        async with semaphore:
+            subject = f"subject-{index % args.subjects}"
+            return await ask(args.host, args.port, subject, questions[index % len(questions)])
+
+    start_time = time.time()
+    results = await asyncio.gather(*(limited_ask(index) for index in range(args.requests)))
+    return results, time.time() - start_time
+
+
+def main(args):
+    """Utility to load-test the StudyStream QA service: latency percentiles, throughput and rejections."""
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as file:
+            questions = [line.strip() for line in file if line.strip()]
+
+    results, elapsed_time = asyncio.run(run_load_test(args, questions))
+    answered = [(first_token, latency) for outcome, first_token, latency in results if outcome == "done"]
+    latencies = [latency for _, latency in answered]
+    first_tokens = [first_token for first_token, _ in answered]
+    rejected = sum(1 for outcome, _, _ in results if outcome == "rejected")
+    failed = len(results) - len(answered) - rejected
+
+    print(f"Requests: {len(results)}; answered: {len(answered)}; rejected (503): {rejected}; failed: {failed}")
+    print(f"Concurrency: {args.concurrency}; subjects: {args.subjects}; elapsed: {round(elapsed_time, ndigits=2)} seconds")
+    print(f"Throughput: {round(len(answered) / elapsed_time, ndigits=3)} answers/second")
+    if answered:
+        print(f"Latency p50: {round(statistics.median(latencies), ndigits=3)} s; p99: {round(percentile(latencies, 0.99), ndigits=3)} s")
+        print(f"First token p50: {round(statistics.median(first_tokens), ndigits=3)} s; p99: {round(percentile(first_tokens, 0.99), ndigits=3)} s")
+
+    if args.max_p99 is not None and (not latencies or percentile(latencies, 0.99) > args.max_p99):
+        print(f"The p99 latency exceeds the budget of {args.max_p99} seconds")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    # Create the parser
+    parser = argparse.ArgumentParser(description="Load-testing the StudyStream question answering service.")
+
+    # Add the arguments
+    parser.add_argument('--host', type=str, help='The host of the service.', default=DEFAULT_SERVICE_HOST)
+    parser.add_argument('--port', type=int, help='The port of the service.', default=DEFAULT_SERVICE_PORT)
+    parser.add_argument('--requests', type=int, help='The total number of questions.', default=40)
+    parser.add_argument('--concurrency', type=int, help='The number of concurrent clients.', default=8)
+    parser.add_argument('--subjects', type=int, help='The number of subjects the questions are spread across.', default=4)
+    parser.add_argument('--questions', type=str, help='(Optional) The text file with one question per line.', default=None)
+    parser.add_argument('--max_p99', type=float, help='(Optional) The p99 latency budget in seconds.', default=None)
+
+    # Parse the arguments
+    main(parser.parse_args())
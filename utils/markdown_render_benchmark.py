@@ -0,0 +1,70 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the CC-BY-SA-4.0 license.
+import argparse
+import json
+import sys
+import time
+
+from app.study_stream_markdown_renderer import StudyStreamMarkdownRenderer, RENDER_FRAME_BUDGET_MS
+
+SAMPLE_ANSWER = """The **main theorem** states that every bounded sequence has a convergent subsequence.
+
+1. Take the bisection of the interval.
+2. Pick the half with infinitely many terms.
+
+```python
+def bisect(low, high):
+    return (low + high) / 2
+```
+
+| Term | Definition |
+|------|------------|
+| Bounded | There is M with abs(a_n) <= M |
+"""
+
+
+def load_messages(note_file: str, count: int):
+    if note_file:
+        # The messages as exported by StudyStreamMessage.to_dict: [{"type", "content", "created_at"}]
+        with open(note_file, "r", encoding="utf-8") as file:
+            return [message["content"] for message in json.load(file)]
+    return [f"Question #{index}: what does the theorem state?" if index % 2 == 0 else f"{SAMPLE_ANSWER}\nAnswer #{index}." for index in range(count)]
+
+
+def main(args):
+    """Utility to measure the Markdown rendering of the chat messages: cold, cached and per message against the frame budget."""
+
+    messages = load_messages(args.note_file, args.count)
+    renderer = StudyStreamMarkdownRenderer()
+
+    start_time = time.perf_counter()
+    renderer.prerender(messages)
+    cold_time = 1000 * (time.perf_counter() - start_time)
+    cold_stats = renderer.get_stats()
+
+    # Re-opening the note: every message is taken from the cache
+    start_time = time.perf_counter()
+    renderer.prerender(messages)
+    warm_time = 1000 * (time.perf_counter() - start_time)
+
+    print(f"Messages: {len(messages)}")
+    print(f"Cold rendering: {round(cold_time, ndigits=2)} ms; mean={cold_stats['mean_render_ms']} ms; p99={cold_stats['p99_render_ms']} ms; max={cold_stats['max_render_ms']} ms per message")
+    print(f"Cached rendering: {round(warm_time, ndigits=2)} ms ({round(1000 * warm_time / len(messages), ndigits=2)} us per message)")
+    print(f"Cache: {renderer.get_stats()}")
+
+    if cold_stats['p99_render_ms'] > args.frame_budget_ms:
+        print(f"The p99 render time of a message exceeds the frame budget of {args.frame_budget_ms} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    # Create the parser
+    parser = argparse.ArgumentParser(description="Benchmarking the cached Markdown rendering of the chat messages.")
+
+    # Add the arguments
+    parser.add_argument('--note_file', type=str, help='(Optional) The JSON file with the messages of a note.', default=None)
+    parser.add_argument('--count', type=int, help='The number of the generated messages if no note file is given.', default=2000)
+    parser.add_argument('--frame_budget_ms', type=float, help='The per-message render time budget.', default=RENDER_FRAME_BUDGET_MS)
+
+    # Parse the arguments
+    main(parser.parse_args())
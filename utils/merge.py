@@ -1,67 +1,161 @@
 # Copyright (c) EGOGE - All Rights Reserved.
 # This software may be used and distributed according to the terms of the CC-BY-SA-4.0 license.
 import argparse
-from langchain_community.vectorstores import Chroma
-from embeddings.embeddings_constants import CHROMA_SETTINGS, DEFAULT_COLLECTION_NAME
-from models.model_info import ModelInfo
+import hashlib
+import queue
+import threading
+import time
+from embeddings.embeddings_constants import DEFAULT_COLLECTION_NAME, BATCH_SIZE
+from embeddings.embedding_database import iter_collection_batches
+from embeddings.vectorstore_backends import open_vector_store, set_vectorstore_backend, VECTORSTORE_BACKENDS
 
-def create_vectorstore(persist_directory, collection_name, embedding):
-    """Create and return a Chroma instance."""
-    return Chroma(
-        persist_directory=persist_directory,
-        embedding_function=embedding,
-        collection_name=collection_name or DEFAULT_COLLECTION_NAME,
-        client_settings=CHROMA_SETTINGS,
-    )
+# What to do with a chunk whose id is already in the target
+CONFLICT_POLICIES = ['skip', 'overwrite', 'rekey']
+# The end of the source's batches in the queue
+END_OF_SOURCE = None
+
+def create_vectorstore(persist_directory, collection_name, backend=None):
+    """Open the vectorstore with the backend of its manifest; the stored embeddings are merged, so no embedding model is needed."""
+    return open_vector_store(persist_directory=persist_directory, collection_name=collection_name, backend=backend)
+
+def read_source(source_index, collection, batch_size, batches: queue.Queue):
+    """Puts the pages of the source collection to the bounded queue: the reader waits while the writer is behind."""
+    try:
+        for batch in iter_collection_batches(collection, batch_size=batch_size):
+            batches.put((source_index, batch))
+    except Exception as e:
+        batches.put((source_index, e))
+    batches.put((source_index, END_OF_SOURCE))
+
+def rekey(chunk_id, persist_directory):
+    # The new id is stable: merging the same source again finds the re-keyed chunk
+    return f"{chunk_id}@{hashlib.sha1(persist_directory.encode('utf-8')).hexdigest()[:8]}"
+
+def write_batch(to_collection, batch, on_conflict, persist_directory):
+    """Adds the batch to the target; returns the number of the added, overwritten and skipped chunks."""
+    ids = list(batch['ids'])
+    existing_ids = set(to_collection.get(ids=ids, include=[])['ids'])
+    if on_conflict == 'rekey' and existing_ids:
+        ids = [rekey(chunk_id, persist_directory) if chunk_id in existing_ids else chunk_id for chunk_id in ids]
+        existing_ids = set(to_collection.get(ids=ids, include=[])['ids'])
+    kept = list(range(len(ids))) if on_conflict == 'overwrite' else [index for index, chunk_id in enumerate(ids) if chunk_id not in existing_ids]
+    if kept:
+        to_collection.upsert(
+            ids=[ids[index] for index in kept],
+            embeddings=[batch['embeddings'][index] for index in kept],
+            metadatas=[batch['metadatas'][index] for index in kept],
+            documents=[batch['documents'][index] for index in kept]
+        )
+    overwritten_count = len(existing_ids) if on_conflict == 'overwrite' else 0
+    return len(kept) - overwritten_count, overwritten_count, len(ids) - len(kept)
 
 def main(args):
-    """Utility to merge the 'from' vectorstore to the target 'to' vectorstore."""
+    """Utility to merge the 'from' vectorstores to the target 'to' vectorstore by pages, with bounded memory."""
 
-    embedding = ModelInfo.create_embedding(model_name=None)
+    sources = [create_vectorstore(persist_directory, args.from_collection_name) for persist_directory in args.from_persist_directory]
+    source_counts = [source._collection.count() for source in sources]
+    total_count = sum(source_counts)
+    for persist_directory, count in zip(args.from_persist_directory, source_counts):
+        print(f"The from vectorestore '{persist_directory}' of '{args.from_collection_name or DEFAULT_COLLECTION_NAME}' collection count: {count}")
 
-    from_docs_db = create_vectorstore(args.from_persist_directory, args.from_collection_name, embedding)
-    print(f"The from vectorestore of '{args.from_collection_name or DEFAULT_COLLECTION_NAME}' collection count: {from_docs_db._collection.count()}")
+    to_docs_db = create_vectorstore(args.to_persist_directory, args.to_collection_name, args.to_backend)
+    if args.to_backend:
+        set_vectorstore_backend(args.to_persist_directory, args.to_backend)
+    to_collection = to_docs_db._collection
+    print(f"The target vectorestore of '{args.to_collection_name or DEFAULT_COLLECTION_NAME}' collection count: {to_collection.count()}")
 
-    to_docs_db = create_vectorstore(args.to_persist_directory, args.to_collection_name, embedding)
-    print(f"The target vectorestore of '{args.to_collection_name or DEFAULT_COLLECTION_NAME}' collection count: {to_docs_db._collection.count()}")
+    # The sources are read in parallel; the target is written by this thread only.
+    # At most 2 pages per reader wait in memory
+    batches = queue.Queue(maxsize=2 * args.workers)
+    pending_sources = list(enumerate(sources))
+    active_readers = 0
 
-    from_db_data = from_docs_db._collection.get(include=['documents', 'metadatas', 'embeddings'])
+    def start_readers():
+        nonlocal active_readers
+        while pending_sources and active_readers < args.workers:
+            source_index, source = pending_sources.pop(0)
+            threading.Thread(target=read_source, args=(source_index, source._collection, args.batch_size, batches), daemon=True).start()
+            active_readers += 1
 
-    to_docs_db._collection.add(
-        embeddings=from_db_data['embeddings'],
-        metadatas=from_db_data['metadatas'],
-        documents=from_db_data['documents'],
-        ids=from_db_data['ids']
-    )
-    to_docs_db.persist()
+    start_time = time.time()
+    added_count = overwritten_count = skipped_count = 0
+    read_counts = [0] * len(sources)
+    start_readers()
+    while active_readers:
+        source_index, batch = batches.get()
+        if batch is END_OF_SOURCE:
+            active_readers -= 1
+            start_readers()
+            continue
+        if isinstance(batch, Exception):
+            raise batch
+        added, overwritten, skipped = write_batch(to_collection, batch, args.on_conflict, args.from_persist_directory[source_index])
+        added_count += added
+        overwritten_count += overwritten
+        skipped_count += skipped
+        read_counts[source_index] += len(batch['ids'])
+        done_count = sum(read_counts)
+        elapsed_time = time.time() - start_time
+        throughput = done_count / elapsed_time if elapsed_time > 0 else 0.0
+        print(f"Merged {done_count}/{total_count} chunks ({round(throughput, ndigits=1)} chunks/s): added {added_count}, overwritten {overwritten_count}, skipped {skipped_count}")
 
-    print(f"After the merge, the target vectorestore stores {len(to_docs_db.get()['ids'])} documents")
+    to_docs_db.persist()
+    elapsed_time = time.time() - start_time
+    print(f"The merge took {round(elapsed_time, ndigits=2)} seconds; conflicts policy: {args.on_conflict}")
+    print(f"After the merge, the target vectorestore stores {to_collection.count()} documents")
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Merging two vectorestore.")
+    parser = argparse.ArgumentParser(description="Merging vectorestores.")
     parser.add_argument(
-        '--from_persist_directory', 
-        type=str, 
-        required=True, 
-        help='Path to the source vectorestore directory.'
+        '--from_persist_directory',
+        type=str,
+        nargs='+',
+        required=True,
+        help='Paths to the source vectorestore directories.'
     )
     parser.add_argument(
-        '--from_collection_name', 
-        type=str, 
-        default=None, 
-        help='Collection name of the source vectorestore.'
+        '--from_collection_name',
+        type=str,
+        default=None,
+        help='Collection name of the source vectorestores.'
     )
     parser.add_argument(
-        '--to_persist_directory', 
-        type=str, 
-        required=True, 
+        '--to_persist_directory',
+        type=str,
+        required=True,
         help='Path to the target vectorestore directory.'
     )
     parser.add_argument(
-        '--to_collection_name', 
-        type=str, 
-        default=None, 
+        '--to_collection_name',
+        type=str,
+        default=None,
         help='Collection name of the target vectorestore.'
     )
+    parser.add_argument(
+        '--to_backend',
+        type=str,
+        choices=VECTORSTORE_BACKENDS,
+        default=None,
+        help='The backend of a new target vectorestore; the backend of its manifest by default.'
+    )
+    parser.add_argument(
+        '--batch_size',
+        type=int,
+        default=BATCH_SIZE,
+        help='The number of chunks read and written at once.'
+    )
+    parser.add_argument(
+        '--on_conflict',
+        type=str,
+        choices=CONFLICT_POLICIES,
+        default='skip',
+        help='What to do with a chunk whose id is already in the target: skip it, overwrite the target one, or add it with a new id.'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=2,
+        help='The number of source vectorestores read in parallel.'
+    )
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,134 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the CC-BY-SA-4.0 license.
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from embeddings.embedding_database import iter_collection_batches
+from embeddings.embeddings_constants import DEFAULT_LLM_FOLDER, STUDY_STREAM_COLLECTION_NAME, BATCH_SIZE
+from embeddings.quantized_index import QUANTIZATION_MODES, PQ_SUBVECTORS, TRAINING_SAMPLE_SIZE, RERANK_FACTOR
+from embeddings.vectorstore_backends import open_vector_store
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+COLLECTION_NAME = "QUANTIZATION_BENCHMARK_DB"
+
+
+def load_chunks(collection, batch_size):
+    ids, vectors, documents, metadatas = [], [], [], []
+    for batch in iter_collection_batches(collection, batch_size=batch_size, include=['embeddings', 'documents', 'metadatas']):
+        ids.extend(batch['ids'])
+        vectors.append(np.asarray(batch['embeddings'], dtype=np.float32))
+        documents.extend(batch['documents'])
+        metadatas.extend(batch['metadatas'])
+    return ids, np.concatenate(vectors) if vectors else np.zeros((0, 0), dtype=np.float32), documents, metadatas
+
+
+def exact_search(vectors, query, k):
+    distances = ((vectors - query) ** 2).sum(axis=1)
+    return np.argsort(distances)[:k]
+
+
+def percentile(latencies, ratio):
+    latencies = sorted(latencies)
+    return latencies[min(len(latencies) - 1, int(ratio * len(latencies)))]
+
+
+def main(args):
+    """
+    Utility to benchmark the quantized backends on the chunks of the vectorstore: recall@k against the exact search,
+    with and without the re-ranking on the full-precision vectors fetched from the collection, the index memory
+    and the query latency.
+    """
+
+    persist_directory = os.path.abspath(args.persist_directory or os.path.join(APP_DIR, os.getenv("LLM_FOLDER") or DEFAULT_LLM_FOLDER))
+    docs_db = open_vector_store(persist_directory=persist_directory, collection_name=args.collection_name)
+    # The ground truth needs all full-precision vectors in memory
+    ids, vectors, documents, metadatas = load_chunks(docs_db._collection, args.batch_size)
+    if len(ids) == 0:
+        print(f"The collection '{args.collection_name}' is empty")
+        sys.exit(1)
+    if len(ids) < args.sample_size:
+        print(f"The {len(ids)} chunks are fewer than the training sample of {args.sample_size}: they are searched exactly")
+    random_state = np.random.default_rng(args.seed)
+    query_rows = random_state.choice(len(ids), size=min(args.queries, len(ids)), replace=False)
+    # The queries are the stored vectors with a small noise: a chunk is not trivially its own nearest neighbour
+    queries = vectors[query_rows] + random_state.normal(scale=args.noise, size=(len(query_rows), vectors.shape[1])).astype(np.float32)
+    ground_truth = [{ids[row] for row in exact_search(vectors, query, args.k)} for query in queries]
+
+    exact_latencies = []
+    for query in queries:
+        start_time = time.perf_counter()
+        exact_search(vectors, query, args.k)
+        exact_latencies.append(1000 * (time.perf_counter() - start_time))
+    print(f"{len(ids)} chunks, {vectors.shape[1]} dimensions; float32: {round(vectors.nbytes / (1024 * 1024), ndigits=2)} MB; "
+          f"exact search mean={round(statistics.mean(exact_latencies), ndigits=2)} ms")
+
+    failed = False
+    for mode in args.modes:
+        with tempfile.TemporaryDirectory() as directory:
+            start_time = time.time()
+            quantized_db = open_vector_store(
+                persist_directory=directory,
+                collection_name=COLLECTION_NAME,
+                backend=mode,
+                collection_metadata={"quantization:sample_size": args.sample_size, "pq:subvectors": args.pq_subvectors}
+            )
+            collection = quantized_db._collection
+            for start in range(0, len(ids), args.batch_size):
+                end = start + args.batch_size
+                collection.add(
+                    ids=ids[start:end],
+                    embeddings=vectors[start:end].tolist(),
+                    metadatas=[metadata or None for metadata in metadatas[start:end]],
+                    documents=documents[start:end]
+                )
+            build_time = time.time() - start_time
+            memory_bytes = collection.index.memory_bytes()
+            for rerank_factor in ([1, args.rerank_factor] if args.rerank_factor > 1 else [1]):
+                # The candidates are re-ranked by the collection on the full-precision vectors it stores
+                collection.index.rerank_factor = rerank_factor
+                recalls = []
+                latencies = []
+                for query, expected in zip(queries, ground_truth):
+                    start_time = time.perf_counter()
+                    results = collection.query(query_embeddings=[query.tolist()], n_results=args.k, include=['distances'])
+                    latencies.append(1000 * (time.perf_counter() - start_time))
+                    recalls.append(len(expected.intersection(results['ids'][0])) / len(expected))
+                recall = statistics.mean(recalls)
+                name = f"{mode}{' + re-rank x' + str(rerank_factor) if rerank_factor > 1 else ''}"
+                print(f"{name}: recall@{args.k}={round(recall, ndigits=3)}; {round(memory_bytes / (1024 * 1024), ndigits=2)} MB "
+                      f"({round(vectors.nbytes / max(1, memory_bytes), ndigits=1)}x smaller); "
+                      f"query mean={round(statistics.mean(latencies), ndigits=2)} ms p95={round(percentile(latencies, 0.95), ndigits=2)} ms; "
+                      f"built in {round(build_time, ndigits=2)} seconds")
+                if args.min_recall is not None and rerank_factor == max(1, args.rerank_factor) and recall < args.min_recall:
+                    print(f"The recall@{args.k} of '{name}' is below {args.min_recall}")
+                    failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    # Create the parser
+    parser = argparse.ArgumentParser(description="Benchmarking the quantized backends: recall@k vs memory vs latency.")
+
+    # Add the arguments
+    parser.add_argument('--persist_directory', type=str, help='The vectorstore directory; LLM_FOLDER of the app by default.', default=None)
+    parser.add_argument('--collection_name', type=str, help='The name of embedding vectorstore.', default=STUDY_STREAM_COLLECTION_NAME)
+    parser.add_argument('--modes', type=str, nargs='+', choices=QUANTIZATION_MODES, help='The benchmarked quantizations.', default=QUANTIZATION_MODES)
+    parser.add_argument('--pq_subvectors', type=int, help='The number of the PQ sub-vectors.', default=PQ_SUBVECTORS)
+    parser.add_argument('--sample_size', type=int, help='The number of the vectors training the quantizer.', default=TRAINING_SAMPLE_SIZE)
+    parser.add_argument('--rerank_factor', type=int, help='The number of the re-ranked candidates per found chunk.', default=RERANK_FACTOR)
+    parser.add_argument('--queries', type=int, help='The number of the sampled queries.', default=100)
+    parser.add_argument('--noise', type=float, help='The standard deviation of the noise added to the sampled queries.', default=0.01)
+    parser.add_argument('--k', type=int, help='The number of chunks per query.', default=4)
+    parser.add_argument('--batch_size', type=int, help='The number of chunks read and added at once.', default=BATCH_SIZE)
+    parser.add_argument('--seed', type=int, help='The seed of the sampled queries.', default=0)
+    parser.add_argument('--min_recall', type=float, help='(Optional) Fail if the recall@k with the re-ranking is below this value.', default=None)
+
+    # Parse the arguments
+    main(parser.parse_args())
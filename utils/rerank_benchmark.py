@@ -0,0 +1,80 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the CC-BY-SA-4.0 license.
+import argparse
+import json
+import os
+import sys
+import time
+
+from embeddings.embedding_database import load_vector_store
+from models.reranker import CrossEncoderReranker, load_cross_encoder
+from models.retrieval_constants import RERANK_BATCH_SIZE, RERANK_TOP_N, RETRIEVAL_FETCH_K
+
+
+def load_questions(file_path):
+    """
+    Loads the labeled question set: a JSON list of {"question": str, "sources": [str]},
+    where "sources" are the names of the documents which contain the answer.
+    """
+    with open(file_path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def recall(documents, sources):
+    """Returns the share of the relevant sources found among the retrieved documents."""
+    relevant = {os.path.basename(source) for source in sources}
+    found = {os.path.basename(document.metadata.get("source", "")) for document in documents}
+    return len(relevant & found) / len(relevant) if relevant else 0.0
+
+
+def main(args):
+    """Utility to compare the recall@n and latency of the plain vector retrieval and the cross-encoder re-ranking."""
+
+    docs_db = load_vector_store(model_name=None, collection_name=args.collection_name, persist_directory=args.persist_directory)
+    reranker = CrossEncoderReranker(
+        cross_encoder=load_cross_encoder(quantize=not args.no_quantize),
+        top_n=args.top_n,
+        batch_size=RERANK_BATCH_SIZE
+    )
+    questions = load_questions(args.questions)
+
+    plain_recall = rerank_recall = 0.0
+    fetch_time = rerank_time = 0.0
+    for labeled_question in questions:
+        question = labeled_question["question"]
+        start_time = time.time()
+        candidates = docs_db.similarity_search(question, k=args.fetch_k)
+        fetch_time += time.time() - start_time
+
+        start_time = time.time()
+        reranked = reranker.compress_documents(candidates, question)
+        rerank_time += time.time() - start_time
+
+        plain_recall += recall(candidates[:args.top_n], labeled_question["sources"])
+        rerank_recall += recall(reranked, labeled_question["sources"])
+
+    count = max(1, len(questions))
+    print(f"Questions: {len(questions)}; fetch_k={args.fetch_k}; top_n={args.top_n}")
+    print(f"Vector search recall@{args.top_n}: {round(plain_recall / count, ndigits=3)}; latency: {round(1000 * fetch_time / count, ndigits=1)} ms")
+    print(f"Re-ranked recall@{args.top_n}: {round(rerank_recall / count, ndigits=3)}; latency: +{round(1000 * rerank_time / count, ndigits=1)} ms")
+
+    if args.max_rerank_ms is not None and 1000 * rerank_time / count > args.max_rerank_ms:
+        print(f"Re-ranking latency exceeds the budget of {args.max_rerank_ms} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    # Create the parser
+    parser = argparse.ArgumentParser(description="Benchmarking the cross-encoder re-ranking of the vectorstore retrieval.")
+
+    # Add the arguments
+    parser.add_argument('--persist_directory', type=str, help='The path to the directory with the vectorstore.')
+    parser.add_argument('--collection_name', type=str, help='The name of embedding vectorstore.', default=None)
+    parser.add_argument('--questions', type=str, help='The JSON file with the labeled questions.')
+    parser.add_argument('--fetch_k', type=int, help='The number of candidates fetched by the vector search.', default=RETRIEVAL_FETCH_K)
+    parser.add_argument('--top_n', type=int, help='The number of documents kept after re-ranking.', default=RERANK_TOP_N)
+    parser.add_argument('--no_quantize', action='store_true', help='(Optional) Disables the int8 quantization of the cross-encoder.')
+    parser.add_argument('--max_rerank_ms', type=float, help='(Optional) The re-ranking latency budget per question.', default=None)
+
+    # Parse the arguments
+    main(parser.parse_args())
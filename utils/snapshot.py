@@ -0,0 +1,62 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the CC-BY-SA-4.0 license.
+import argparse
+import sys
+import time
+
+from embeddings.embeddings_constants import BATCH_SIZE
+from embeddings.vectorstore_backends import open_vector_store
+from embeddings.vectorstore_snapshot import (export_snapshot, import_snapshot, verify_snapshot,
+                                             load_snapshot_vector_store, SNAPSHOT_DTYPES)
+
+
+def main(args):
+    """Utility to export the vectorstore to the portable snapshot, to import the snapshot, or to query it read-only."""
+
+    start_time = time.time()
+    if args.action == 'export':
+        docs_db = open_vector_store(persist_directory=args.persist_directory, collection_name=args.collection_name)
+        manifest = export_snapshot(
+            docs_db,
+            args.snapshot_directory,
+            dtype=args.dtype,
+            model_name=args.model_name,
+            batch_size=args.batch_size,
+            persist_directory=args.persist_directory
+        )
+        print(f"Exported {manifest['count']} chunks ({manifest['dimensions']} dimensions, {manifest['dtype']}) in {round(time.time() - start_time, ndigits=2)} seconds")
+    elif args.action == 'import':
+        docs_db = import_snapshot(args.snapshot_directory, args.persist_directory, collection_name=args.collection_name, batch_size=args.batch_size)
+        print(f"Imported {docs_db._collection.count()} chunks in {round(time.time() - start_time, ndigits=2)} seconds")
+    elif args.action == 'verify':
+        broken_files = verify_snapshot(args.snapshot_directory)
+        if broken_files:
+            print(f"The files do not match their checksums: {broken_files}")
+            sys.exit(1)
+        print("The snapshot is valid")
+    else:
+        snapshot_db = load_snapshot_vector_store(args.snapshot_directory, model_name=args.model_name)
+        print(f"Opened {len(snapshot_db)} chunks in {round(time.time() - start_time, ndigits=3)} seconds")
+        start_time = time.time()
+        for document, score in snapshot_db.similarity_search_with_score(args.query, k=args.k):
+            print(f"{round(score, ndigits=4)}: {document.metadata.get('source')}: {document.page_content[:100]}")
+        print(f"The query took {round(1000 * (time.time() - start_time), ndigits=2)} ms")
+
+
+if __name__ == "__main__":
+    # Create the parser
+    parser = argparse.ArgumentParser(description="Exporting, importing and querying the portable vectorstore snapshots.")
+
+    # Add the arguments
+    parser.add_argument('action', type=str, choices=['export', 'import', 'verify', 'query'], help='The snapshot action.')
+    parser.add_argument('--snapshot_directory', type=str, required=True, help='The snapshot directory.')
+    parser.add_argument('--persist_directory', type=str, help='The Chroma vectorstore directory: exported or imported to.', default=None)
+    parser.add_argument('--collection_name', type=str, help='The name of embedding vectorstore.', default=None)
+    parser.add_argument('--model_name', type=str, help='The embedding model name; the snapshot\'s one for the query.', default=None)
+    parser.add_argument('--dtype', type=str, choices=SNAPSHOT_DTYPES, help='The type of the exported embeddings.', default='float16')
+    parser.add_argument('--batch_size', type=int, help='The number of chunks exported or imported at once.', default=BATCH_SIZE)
+    parser.add_argument('--query', type=str, help='The query text.', default=None)
+    parser.add_argument('--k', type=int, help='The number of chunks found by the query.', default=4)
+
+    # Parse the arguments
+    main(parser.parse_args())
@@ -29,9 +29,7 @@ if __name__ == "__main__":
         collection_name=args.collection_name,
         client_settings=CHROMA_SETTINGS,
     )   
-    print(f" Collection count: {docs_db._collection.count()}")
-    doc_ids = docs_db.get()["ids"]
-    print(f"The vectorestore stors {len(doc_ids)} documents")
+    print(f"The vectorestore stors {docs_db._collection.count()} documents")
 
     if args.test_question is not None:        
         retriever = docs_db.as_retriever()
@@ -0,0 +1,131 @@
+# Copyright (c) EGOGE - All Rights Reserved.
+# This software may be used and distributed according to the terms of the CC-BY-SA-4.0 license.
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from embeddings.embedding_database import iter_collection_batches
+from embeddings.embeddings_constants import BATCH_SIZE
+from embeddings.vectorstore_backends import open_vector_store, VECTORSTORE_BACKENDS
+
+COLLECTION_NAME = "BENCHMARK_DB"
+
+
+def load_chunks(args):
+    """Reads the chunks of the vectorstore, or generates the random ones if no vectorstore is specified."""
+    if args.persist_directory is None:
+        random_state = np.random.default_rng(args.seed)
+        vectors = random_state.normal(size=(args.count, args.dimensions)).astype(np.float32)
+        return [f"chunk-{index}" for index in range(args.count)], vectors, [f"text {index}" for index in range(args.count)], [{"page": index} for index in range(args.count)]
+    docs_db = open_vector_store(persist_directory=args.persist_directory, collection_name=args.collection_name)
+    ids, vectors, documents, metadatas = [], [], [], []
+    for batch in iter_collection_batches(docs_db._collection, batch_size=args.batch_size):
+        ids.extend(batch['ids'])
+        vectors.append(np.asarray(batch['embeddings'], dtype=np.float32))
+        documents.extend(batch['documents'])
+        metadatas.extend(batch['metadatas'])
+    return ids, np.concatenate(vectors), documents, metadatas
+
+
+def get_folder_size(folder_path) -> int:
+    size = 0
+    for root, _, file_names in os.walk(folder_path):
+        for file_name in file_names:
+            size += os.path.getsize(os.path.join(root, file_name))
+    return size
+
+
+def percentile(latencies, ratio):
+    latencies = sorted(latencies)
+    return latencies[min(len(latencies) - 1, int(ratio * len(latencies)))]
+
+
+def main(args):
+    """
+    Utility to compare the vectorstore backends on the same chunks: the load time, the size on disk, the open time,
+    the query latency and recall@k against the exact search.
+    """
+
+    ids, vectors, documents, metadatas = load_chunks(args)
+    if len(ids) == 0:
+        print("No chunks to benchmark")
+        sys.exit(1)
+    random_state = np.random.default_rng(args.seed)
+    query_rows = random_state.choice(len(ids), size=min(args.queries, len(ids)), replace=False)
+    # The queries are the stored vectors with a small noise: a chunk is not trivially its own nearest neighbour
+    queries = vectors[query_rows] + random_state.normal(scale=args.noise, size=(len(query_rows), vectors.shape[1])).astype(np.float32)
+    ground_truth = []
+    for query in queries:
+        distances = ((vectors - query) ** 2).sum(axis=1)
+        ground_truth.append({ids[row] for row in np.argsort(distances)[:args.k]})
+    print(f"{len(ids)} chunks, {vectors.shape[1]} dimensions, {len(queries)} queries, k={args.k}")
+
+    failed = False
+    for backend in args.backends:
+        with tempfile.TemporaryDirectory() as directory:
+            persist_directory = os.path.join(directory, backend)
+            start_time = time.time()
+            docs_db = open_vector_store(persist_directory=persist_directory, collection_name=COLLECTION_NAME, backend=backend)
+            for start in range(0, len(ids), args.batch_size):
+                end = start + args.batch_size
+                docs_db._collection.add(
+                    ids=ids[start:end],
+                    embeddings=vectors[start:end].tolist(),
+                    metadatas=[metadata or None for metadata in metadatas[start:end]],
+                    documents=documents[start:end]
+                )
+            docs_db.persist()
+            load_time = time.time() - start_time
+            del docs_db
+
+            start_time = time.time()
+            docs_db = open_vector_store(persist_directory=persist_directory, collection_name=COLLECTION_NAME, backend=backend)
+            open_time = time.time() - start_time
+
+            latencies = []
+            recalls = []
+            for query, expected in zip(queries, ground_truth):
+                start_time = time.perf_counter()
+                results = docs_db._collection.query(query_embeddings=[query.tolist()], n_results=args.k, include=['documents', 'metadatas', 'distances'])
+                latencies.append(1000 * (time.perf_counter() - start_time))
+                recalls.append(len(expected.intersection(results['ids'][0])) / len(expected))
+            recall = statistics.mean(recalls)
+            mean_latency = statistics.mean(latencies)
+            print(f"{backend}: recall@{args.k}={round(recall, ndigits=3)}; query mean={round(mean_latency, ndigits=2)} ms "
+                  f"p95={round(percentile(latencies, 0.95), ndigits=2)} ms; loaded in {round(load_time, ndigits=2)} seconds; "
+                  f"opened in {round(open_time, ndigits=2)} seconds; {round(get_folder_size(persist_directory) / (1024 * 1024), ndigits=2)} MB")
+            if args.min_recall is not None and recall < args.min_recall:
+                print(f"The recall@{args.k} of '{backend}' is below {args.min_recall}")
+                failed = True
+            if args.max_latency_ms is not None and mean_latency > args.max_latency_ms:
+                print(f"The query latency of '{backend}' exceeds {args.max_latency_ms} ms")
+                failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    # Create the parser
+    parser = argparse.ArgumentParser(description="Benchmarking the vectorstore backends: latency vs recall@k.")
+
+    # Add the arguments
+    parser.add_argument('--persist_directory', type=str, help='(Optional) The vectorstore whose chunks are benchmarked; random chunks by default.', default=None)
+    parser.add_argument('--collection_name', type=str, help='The name of embedding vectorstore.', default=None)
+    parser.add_argument('--backends', type=str, nargs='+', choices=VECTORSTORE_BACKENDS, help='The benchmarked backends.', default=VECTORSTORE_BACKENDS)
+    parser.add_argument('--count', type=int, help='The number of the random chunks.', default=20000)
+    parser.add_argument('--dimensions', type=int, help='The dimensions of the random chunks.', default=768)
+    parser.add_argument('--queries', type=int, help='The number of the sampled queries.', default=100)
+    parser.add_argument('--noise', type=float, help='The standard deviation of the noise added to the sampled queries.', default=0.01)
+    parser.add_argument('--k', type=int, help='The number of chunks per query.', default=4)
+    parser.add_argument('--batch_size', type=int, help='The number of chunks read and added at once.', default=BATCH_SIZE)
+    parser.add_argument('--seed', type=int, help='The seed of the random chunks and the sampled queries.', default=0)
+    parser.add_argument('--min_recall', type=float, help='(Optional) Fail if the recall@k of a backend is below this value.', default=None)
+    parser.add_argument('--max_latency_ms', type=float, help='(Optional) Fail if the mean query latency of a backend exceeds this value.', default=None)
+
+    # Parse the arguments
+    main(parser.parse_args())